@@ -1,9 +1,10 @@
-from http.server import BaseHTTPRequestHandler
 import json
 import base64
 from urllib.parse import urlparse
+from tracing import TracedRequestHandler, traced_handler
 
-class handler(BaseHTTPRequestHandler):
+class handler(TracedRequestHandler):
+    @traced_handler('/api/create_permanent_link')
     def do_POST(self):
         try:
             content_length = int(self.headers['Content-Length'])
@@ -12,8 +13,14 @@ class handler(BaseHTTPRequestHandler):
             
             calendar_url = data.get('calendar_url')
             selected_courses = data.get('selected_courses', [])
-            
-            if not all([calendar_url, selected_courses]):
+
+            # Più calendari: "feeds": [{"calendar_url", "selected_courses"}, ...]
+            feeds = data.get('feeds') or [{
+                'calendar_url': calendar_url,
+                'selected_courses': selected_courses
+            }]
+
+            if not all(feed.get('calendar_url') and feed.get('selected_courses') for feed in feeds):
                 self.send_error_response({'error': 'Dati mancanti'}, 400)
                 return
             
@@ -24,10 +31,15 @@ class handler(BaseHTTPRequestHandler):
             base_url = f"{protocol}://{host}"
 
             # Encoda la configurazione come parametro URL (base64 url-safe)
-            cfg_payload = {
-                'url': calendar_url,
-                'corsi': selected_courses
-            }
+            if len(feeds) == 1:
+                cfg_payload = {
+                    'url': feeds[0]['calendar_url'],
+                    'corsi': feeds[0]['selected_courses']
+                }
+            else:
+                cfg_payload = {'feeds': [
+                    {'url': feed['calendar_url'], 'corsi': feed['selected_courses']} for feed in feeds
+                ]}
             cfg_str = json.dumps(cfg_payload, separators=(',', ':'))
             cfg_enc = base64.urlsafe_b64encode(cfg_str.encode('utf-8')).decode('ascii').rstrip('=')
 
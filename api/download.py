@@ -1,10 +1,15 @@
-from http.server import BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
-import os
 from datetime import datetime
+from session_store import SessionFileStore
+from tracing import TracedRequestHandler, traced_handler
 
+# Stessa cartella di api/generate_calendar.py
+SESSION_STORE = SessionFileStore('/tmp/calendario-unito-sessions', max_bytes=64 * 1024 * 1024,
+                                 max_entries=200, ttl=60 * 60)
 
-class handler(BaseHTTPRequestHandler):
+
+class handler(TracedRequestHandler):
+    @traced_handler('/api/download')
     def do_GET(self):
         try:
             # Parsifica la query string
@@ -18,9 +23,9 @@ class handler(BaseHTTPRequestHandler):
                 return
             
             # Controlla se il file esiste
-            file_path = f'/tmp/{session_id}_filtered.ics'
+            file_path = SESSION_STORE.get_path(f'{session_id}_filtered.ics')
             
-            if not os.path.exists(file_path):
+            if file_path is None:
                 self.send_error_response('File non trovato. Rigenera il calendario.', 404)
                 return
             
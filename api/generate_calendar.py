@@ -1,11 +1,17 @@
-from http.server import BaseHTTPRequestHandler
 import json
 import os
 from datetime import datetime
 import hashlib
 from calendar_manager import UniversityCalendarManager
+from session_store import SessionFileStore
+from tracing import TracedRequestHandler, traced_handler
 
-class handler(BaseHTTPRequestHandler):
+# File temporanei delle sessioni (condivisi con api/download.py), puliti a ogni scrittura
+SESSION_STORE = SessionFileStore('/tmp/calendario-unito-sessions', max_bytes=64 * 1024 * 1024,
+                                 max_entries=200, ttl=60 * 60)
+
+class handler(TracedRequestHandler):
+    @traced_handler('/api/generate_calendar')
     def do_POST(self):
         try:
             content_length = int(self.headers['Content-Length'])
@@ -35,13 +41,8 @@ class handler(BaseHTTPRequestHandler):
 
             # Se non sono stati forniti corsi, siamo in modalità "analisi"
             if selected_courses is None:
-                courses_list = manager.summarize_courses(calendar)
+                courses_list = manager.summarize_courses(manager.extract_courses(calendar))
                 session_id = hashlib.md5(calendar_url.encode()).hexdigest()
-                
-                # Salva il calendario originale per dopo
-                temp_file = f'/tmp/{session_id}_calendar.txt'
-                with open(temp_file, 'w', encoding='utf-8') as f:
-                    f.write(calendar_data)
 
                 response_data = {
                     'success': True,
@@ -62,10 +63,8 @@ class handler(BaseHTTPRequestHandler):
                  self.send_error_response({'error': 'ID sessione mancante'}, 400)
                  return
 
-            filtered_calendar = manager.create_filtered_calendar(calendar, selected_courses)
-            output_path = f'/tmp/{session_id}_filtered.ics'
-            with open(output_path, 'wb') as f:
-                f.write(filtered_calendar.to_ical())
+            SESSION_STORE.write_chunks(f'{session_id}_filtered.ics',
+                                       manager.iter_filtered_calendar(calendar, selected_courses))
 
             response_data = {
                 'success': True,
@@ -1,10 +1,54 @@
-from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 import base64
+import hashlib
 import json
-from calendar_manager import UniversityCalendarManager
+import logging
+from calendar_manager import UniversityCalendarManager, iter_merged_calendar
+from calendar_cache import (
+    SUPPORTED_ENCODINGS, RenderedCalendar, RenderedCalendarCache, calendar_etag,
+    choose_encoding, variant_etag
+)
+from subscription_store import canonical_feeds
+from tracing import (
+    TracedRequestHandler, annotate, bind_trace, current_trace, log_event, span, stage, traced_handler
+)
 
-class handler(BaseHTTPRequestHandler):
+# Calendari filtrati (con varianti compresse) riusati finché l'istanza resta attiva
+RENDERED_CACHE = RenderedCalendarCache(max_bytes=32 * 1024 * 1024)
+
+# I calendari originali di un link a più calendari vengono scaricati in parallelo
+FEED_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix='calendar-feed')
+
+def download_feed(feed):
+    """
+    Scarica un calendario originale (o l'ultima copia valida se il server remoto è in errore)
+
+    Returns:
+        Terna (manager, contenuto, copia non aggiornata), oppure None
+    """
+    url, _ = feed
+    manager = UniversityCalendarManager(url)
+    calendar_data = manager.download_calendar()
+    stale = False
+    if not calendar_data:
+        # Server remoto in errore o lento: ultima copia valida scaricata da questa istanza
+        calendar_data = manager.last_good_calendar()
+        stale = calendar_data is not None
+    if not calendar_data:
+        return None
+    return manager, calendar_data, stale
+
+def latest_last_modified(headers):
+    """Last-Modified più recente tra i calendari originali, o None se non tutti lo indicano"""
+    try:
+        return max(headers, key=parsedate_to_datetime) if all(headers) else None
+    except (TypeError, ValueError):
+        return None
+
+class handler(TracedRequestHandler):
+    @traced_handler('/api/ical')
     def do_GET(self):
         try:
             parsed = urlparse(self.path)
@@ -20,40 +64,164 @@ class handler(BaseHTTPRequestHandler):
                 # Aggiungi padding se necessario
                 cfg_json = base64.urlsafe_b64decode(cfg_param + '===').decode('utf-8')
                 cfg = json.loads(cfg_json)
-                calendar_url = cfg.get('url')
-                selected_courses = cfg.get('corsi', [])
-            except (json.JSONDecodeError, TypeError, ValueError) as e:
+                # Più calendari: "feeds": [{"url": ..., "corsi": [...]}, ...]
+                feeds = [(feed.get('url'), feed.get('corsi', [])) for feed in cfg.get('feeds', [])]
+                if not feeds:
+                    feeds = [(cfg.get('url'), cfg.get('corsi', []))]
+            except (json.JSONDecodeError, TypeError, ValueError, AttributeError) as e:
                 self.send_error_response(f'Configurazione non valida: {e}', 400)
                 return
 
-            if not calendar_url or not selected_courses:
+            if not all(url and courses for url, courses in feeds):
                 self.send_error_response('URL calendario o corsi mancanti nella configurazione', 400)
                 return
+            feeds = canonical_feeds(feeds)
 
-            # Processa il calendario
-            manager = UniversityCalendarManager(calendar_url)
-            calendar_data = manager.download_calendar()
-            if not calendar_data:
+            # Processa i calendari originali
+            downloads = list(FEED_EXECUTOR.map(bind_trace(download_feed), feeds))
+            if not all(downloads):
                 self.send_error_response('Impossibile scaricare il calendario originale', 502)
                 return
-            
-            calendar = manager.parse_calendar(calendar_data)
-            filtered_calendar = manager.create_filtered_calendar(calendar, selected_courses)
-            
-            # Servi il calendario filtrato
-            data = filtered_calendar.to_ical()
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/calendar; charset=utf-8')
-            # Cache per 1 ora per non sovraccaricare il server di origine
-            self.send_header('Cache-Control', 'public, max-age=3600, s-maxage=3600')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.send_header('Content-Length', str(len(data)))
+            stale = any(feed_stale for _, _, feed_stale in downloads)
+            if stale:
+                annotate(stale=stale)
+
+            if len(feeds) == 1:
+                calendar_hash = downloads[0][0].last_download['hash']
+                selection = feeds[0][1]
+            else:
+                # Stessa versione e selezione dei calendari uniti dell'app Flask
+                calendar_hash = hashlib.md5('\n'.join(
+                    manager.last_download['hash'] for manager, _, _ in downloads
+                ).encode('utf-8')).hexdigest()
+                selection = tuple(json.dumps([url, list(courses)], separators=(',', ':'))
+                                  for url, courses in feeds)
+            annotate(feeds=len(feeds), selection_size=sum(len(courses) for _, courses in feeds))
+
+            # Validatori noti prima del parsing: se il client ha già questa
+            # versione risponde 304 senza parsificare né serializzare
+            etag = calendar_etag(calendar_hash, selection)
+            last_modified = latest_last_modified(
+                [manager.last_download.get('last_modified') for manager, _, _ in downloads]
+            )
+            accept_encoding = self.headers.get('Accept-Encoding')
+            if self.is_not_modified(etag, last_modified):
+                annotate(not_modified=True)
+                self.send_calendar_headers(304, choose_encoding(accept_encoding, SUPPORTED_ENCODINGS),
+                                           etag, last_modified, stale)
+                self.end_headers()
+                return
+
+            with span('cache_lookup', cache='rendered') as lookup:
+                rendered = RENDERED_CACHE.get(calendar_hash, selection)
+                lookup.set(result='hit' if rendered is not None else 'miss')
+
+            if rendered is None:
+                parts = []
+                for (_, courses), (manager, calendar_data, _) in zip(feeds, downloads):
+                    calendar = manager.parse_calendar(calendar_data)
+                    if not calendar:
+                        self.send_error_response('Formato calendario non valido', 400)
+                        return
+                    parts.append((manager, calendar, courses))
+
+                if len(parts) == 1:
+                    manager, calendar, courses = parts[0]
+                    chunks = manager.iter_filtered_calendar(calendar, courses)
+                else:
+                    chunks = iter_merged_calendar(
+                        (manager, manager.build_course_index(calendar), courses)
+                        for manager, calendar, courses in parts
+                    )
+                # Cache mancata: ETag e Last-Modified non dipendono dai byte generati,
+                # quindi il calendario viene inviato a blocchi mentre viene serializzato.
+                # Le varianti compresse richiedono il contenuto completo: vengono create
+                # a fine invio per la cache e servite dalle richieste successive
+                self.stream_calendar(chunks, calendar_hash, selection, etag, last_modified, stale)
+                return
+
+            # Variante precompressa scelta in base ad Accept-Encoding
+            encoding = choose_encoding(accept_encoding, rendered.variants)
+            body = rendered.variants[encoding]
+            self.send_calendar_headers(200, encoding, etag, last_modified, stale)
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(data)
+            try:
+                self.wfile.write(body)
+            except OSError:
+                # Client disconnesso: le intestazioni sono già inviate, niente risposta di errore
+                self.close_connection = True
 
         except Exception as e:
             self.send_error_response(f'Errore nel servire il calendario: {str(e)}', 500)
 
+    def stream_calendar(self, chunks, calendar_hash, selection, etag, last_modified, stale):
+        """
+        Invia il calendario non compresso a blocchi e, a invio completato, lo salva in cache
+
+        Senza Content-Length la fine della risposta è la chiusura della connessione;
+        se la generazione si interrompe la connessione viene chiusa e nulla va in cache.
+        """
+        self.send_calendar_headers(200, 'identity', etag, last_modified, stale)
+        self.end_headers()
+        self.close_connection = True
+        body = []
+        try:
+            for chunk in chunks:
+                self.wfile.write(chunk)
+                body.append(chunk)
+        except OSError:
+            # Client disconnesso
+            return
+        except Exception as e:
+            # Intestazioni già inviate: niente risposta di errore, solo il log
+            log_event("Errore durante l'invio del calendario", logging.ERROR, error=str(e))
+            trace = current_trace()
+            if trace is not None:
+                trace.error = f'{type(e).__name__}: {e}'
+            return
+
+        data = b''.join(body)
+        with stage('compress', bytes=len(data)):
+            rendered = RenderedCalendar.from_ics(data, etag)
+        RENDERED_CACHE.put(calendar_hash, selection, rendered)
+
+    def is_not_modified(self, etag, last_modified):
+        """Verifica If-None-Match / If-Modified-Since (vale l'ETag di qualunque variante)"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            if if_none_match.strip() == '*':
+                return True
+            etags = {variant_etag(etag, encoding) for encoding in ('identity',) + SUPPORTED_ENCODINGS}
+            tags = {tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')}
+            return not etags.isdisjoint(tags)
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since and last_modified:
+            try:
+                return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_calendar_headers(self, status, encoding, etag, last_modified=None, stale=False):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/calendar; charset=utf-8')
+        if stale:
+            # Copia non aggiornata: cache breve, così i client riprovano presto
+            self.send_header('Cache-Control', 'public, max-age=300')
+            self.send_header('Warning', '110 - "Response is Stale"')
+            self.send_header('X-Calendar-Stale', 'upstream-error')
+        else:
+            # Cache per 1 ora per non sovraccaricare il server di origine
+            self.send_header('Cache-Control', 'public, max-age=3600, s-maxage=3600')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('ETag', f'"{variant_etag(etag, encoding)}"')
+        if last_modified:
+            self.send_header('Last-Modified', last_modified)
+        self.send_header('Access-Control-Allow-Origin', '*')
+
     def send_error_response(self, message, status_code):
         self.send_response(status_code)
         self.send_header('Content-type', 'text/plain; charset=utf-8')
@@ -4,44 +4,828 @@ Applicazione Flask per la gestione del calendario universitario
 Interfaccia web moderna per selezionare e filtrare i corsi
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, redirect
+from flask import Flask, g, render_template, request, jsonify, send_file, redirect
+import logging
 import os
 import json
 import base64
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
 import hashlib
+import threading
 import time
-from calendar_manager import UniversityCalendarManager
+from concurrent.futures import ThreadPoolExecutor
+from calendar_manager import UniversityCalendarManager, circuit_breaker_stats, iter_merged_calendar
+from calendar_cache import (
+    SUPPORTED_ENCODINGS, RenderedCalendar, RenderedCalendarCache, SingleFlight,
+    calendar_etag, canonical_selection, choose_encoding, variant_etag
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY as METRICS
+from profiling import RequestProfiler, annotate_profile
+from resilience import AdmissionLimiter, AdmissionRejected
+from tracing import (
+    annotate, bind_trace, end_trace, log_event, request_trace, span, stage, start_trace
+)
+from shared_cache import SharedCalendarStore
+from session_store import SessionFileStore
+from subscription_store import SubscriptionFeed, SubscriptionStore, canonical_feeds
 
 # Cache per i calendari scaricati (24 ore)
 CALENDAR_CACHE = {}
 CACHE_DURATION = 24 * 60 * 60  # 24 ore in secondi
+CALENDAR_CACHE_STATS = {'hits': 0, 'stale': 0, 'misses': 0, 'expired': 0, 'revalidations': 0}
 
-def download_and_cache_calendar(calendar_url, cache_key):
+# Stale-while-revalidate: oltre CACHE_DURATION la copia in cache viene ancora
+# servita (per al massimo STALE_DURATION) mentre si aggiorna in background
+STALE_DURATION = int(os.environ.get('STALE_DURATION', 24 * 60 * 60))
+# Aggiornamento anticipato dei calendari richiesti di recente ("caldi")
+REFRESH_AHEAD = int(os.environ.get('REFRESH_AHEAD', 60 * 60))
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', 5 * 60))
+HOT_WINDOW = int(os.environ.get('HOT_WINDOW', 6 * 60 * 60))
+BACKGROUND_REFRESH = os.environ.get('BACKGROUND_REFRESH', 'true').lower() == 'true'
+
+# Tempo massimo (secondi) per ottenere il calendario originale durante una
+# richiesta, sotto il timeout dei worker di gunicorn: oltre, o con il server
+# remoto in errore, viene servita l'ultima copia valida in cache
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 20))
+# Cache più breve per le risposte non aggiornate, così i client riprovano presto
+STALE_MAX_AGE = int(os.environ.get('STALE_MAX_AGE', 5 * 60))
+STALE_RESPONSE_STATS = {'revalidating': 0, 'upstream_error': 0}
+
+# Cache dei calendari già parsificati, indicizzata per hash del contenuto.
+# Ogni versione del calendario originale viene parsificata una sola volta.
+PARSED_CACHE = OrderedDict()
+PARSED_CACHE_MAX_ENTRIES = int(os.environ.get('PARSED_CACHE_MAX_ENTRIES', 16))
+PARSED_CACHE_LOCK = threading.Lock()
+PARSED_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# Scanner veloce (solo VEVENT e proprietà necessarie) al posto di Calendar.from_ical
+FAST_ICS_SCANNER = os.environ.get('FAST_ICS_SCANNER', 'false').lower() == 'true'
+
+# Cache LRU dei calendari filtrati già serializzati (con varianti gzip/brotli),
+# per (hash, selezione corsi)
+RENDERED_CACHE = RenderedCalendarCache(
+    max_bytes=int(os.environ.get('RENDERED_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+)
+
+# Cache condivisa tra i worker gunicorn dello stesso nodo (attiva se SHARED_CACHE_DIR è impostata)
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR')
+SHARED_STORE = SharedCalendarStore(
+    SHARED_CACHE_DIR,
+    max_rendered_bytes=int(os.environ.get('SHARED_RENDERED_MAX_BYTES', 256 * 1024 * 1024))
+) if SHARED_CACHE_DIR else None
+
+# Iscrizioni con ID breve servite su /api/ical/<id> (attive se SUBSCRIPTIONS_DB è impostata):
+# il database deve stare su un volume persistente, altrimenti i link smettono di funzionare
+# dopo un nuovo deploy. Senza, i link contengono la configurazione codificata (/api/ical?cfg=)
+SUBSCRIPTIONS_DB = os.environ.get('SUBSCRIPTIONS_DB')
+SUBSCRIPTION_STORE = SubscriptionStore(SUBSCRIPTIONS_DB) if SUBSCRIPTIONS_DB else None
+
+# Download, parsing e serializzazione concorrenti della stessa risorsa vengono eseguiti una volta sola
+DOWNLOAD_FLIGHTS = SingleFlight()
+PARSE_FLIGHTS = SingleFlight()
+RENDER_FLIGHTS = SingleFlight()
+
+# Controllo di ammissione: parsing, filtraggio e serializzazione (cache mancate)
+# al più RENDER_CONCURRENCY per processo, con una coda; oltre, risposta 503
+# immediata con Retry-After. Il posto lo occupa solo chi esegue davvero il lavoro:
+# cache, richieste condizionali e richieste accodate allo stesso lavoro non passano di qui.
+# I valori predefiniti seguono i thread del worker (--threads di gunicorn nel Procfile),
+# così il worker non rifiuta richieste finché ha thread liberi che le attendono
+WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', 8))
+RENDER_LIMITER = AdmissionLimiter(
+    max_concurrent=int(os.environ.get('RENDER_CONCURRENCY', max(2, WORKER_THREADS // 4))),
+    max_queue=int(os.environ.get('RENDER_QUEUE', WORKER_THREADS)),
+    queue_timeout=float(os.environ.get('RENDER_QUEUE_TIMEOUT', 2))
+)
+RENDER_RETRY_AFTER = int(os.environ.get('RENDER_RETRY_AFTER', 5))
+
+# Le iscrizioni a più calendari scaricano e parsificano i calendari originali in parallelo
+FEED_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('FEED_FETCH_WORKERS', 8)), thread_name_prefix='calendar-feed'
+)
+
+# Preriscaldamento: quando il calendario originale cambia, le selezioni servite
+# di recente vengono rigenerate in background prima della richiesta successiva
+PREWARM_ON_CHANGE = os.environ.get('PREWARM_ON_CHANGE', 'true').lower() == 'true'
+PREWARM_WINDOW = int(os.environ.get('PREWARM_WINDOW', 7 * 24 * 60 * 60))
+PREWARM_MAX_SELECTIONS = int(os.environ.get('PREWARM_MAX_SELECTIONS', 128))
+PREWARM_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PREWARM_WORKERS', 2)), thread_name_prefix='calendar-prewarm'
+)
+SERVED_SELECTIONS = {}  # cache_key -> OrderedDict(selezione -> ultimo accesso)
+SERVED_MERGED_SELECTIONS = {}  # cache_key -> OrderedDict(selezione unita -> ultimo accesso)
+SERVED_SELECTIONS_LOCK = threading.Lock()
+PREWARM_STATS = {'scheduled': 0, 'rendered': 0, 'skipped': 0}
+
+# Versioni dei calendari uniti servite da questo worker (hash unito -> coppie URL e
+# versione dei calendari originali), per spostarne o invalidarne i filtrati quando uno cambia
+MERGED_VERSIONS = OrderedDict()
+MERGED_VERSIONS_MAX_ENTRIES = int(os.environ.get('MERGED_VERSIONS_MAX_ENTRIES', 1024))
+MERGED_VERSIONS_LOCK = threading.Lock()
+
+def store_calendar_entry(cache_key, entry):
+    """Installa una versione del calendario in CALENDAR_CACHE"""
+    previous = CALENDAR_CACHE.get(cache_key)
+    entry['last_access'] = previous.get('last_access', 0) if previous else 0
+
+    CALENDAR_CACHE[cache_key] = entry
+
+    # Se il calendario è cambiato, il confronto con la versione precedente (parsing
+    # e differenze evento per evento) avviene in background, fuori dalla richiesta
+    if previous is not None and previous['hash'] != entry['hash']:
+        schedule_version_change(cache_key, previous, entry)
+    return entry
+
+def remember_merged_version(versions):
+    """
+    Registra la versione di un calendario unito
+
+    Args:
+        versions: Coppie (URL, versione) dei calendari originali, nell'ordine dell'iscrizione
+
+    Returns:
+        Hash della versione del calendario unito
+    """
+    versions = tuple(versions)
+    merged_hash = hashlib.md5(
+        '\n'.join(calendar_hash for _, calendar_hash in versions).encode('utf-8')
+    ).hexdigest()
+    with MERGED_VERSIONS_LOCK:
+        MERGED_VERSIONS[merged_hash] = versions
+        MERGED_VERSIONS.move_to_end(merged_hash)
+        while len(MERGED_VERSIONS) > MERGED_VERSIONS_MAX_ENTRIES:
+            MERGED_VERSIONS.popitem(last=False)
+    return merged_hash
+
+def changed_courses_between(previous, entry):
+    """
+    Corsi modificati tra due versioni del calendario, dal confronto evento per evento
+
+    Returns:
+        Insieme dei corsi modificati, oppure None se la versione precedente
+        non è più parsificata in memoria (il confronto non è possibile)
+    """
+    with PARSED_CACHE_LOCK:
+        old_parsed = PARSED_CACHE.get(previous['hash'])
+    if old_parsed is None:
+        return None
+
+    manager = UniversityCalendarManager(entry['url'])
+    new_parsed = get_parsed_calendar(manager, entry['data'], entry['hash'])
+    if not new_parsed:
+        return None
+    return manager.changed_courses(get_fingerprints(manager, old_parsed),
+                                   get_fingerprints(manager, new_parsed))
+
+def rekey_rendered(old_hash, new_hash, keep):
+    """Sposta alla nuova versione i filtrati ancora validi (cache locale e condivisa), eliminando gli altri"""
+    carried = RENDERED_CACHE.rekey(old_hash, new_hash, keep)
+    if SHARED_STORE is not None and SHARED_STORE.has_rendered(old_hash):
+        carried += SHARED_STORE.rekey_rendered(old_hash, new_hash, keep)
+    return carried
+
+def carry_over_merged(previous, entry, changed):
+    """
+    Sposta alla nuova versione i calendari uniti che includono il calendario cambiato,
+    se da quel calendario non selezionano corsi modificati; invalida gli altri
+
+    Returns:
+        Numero di calendari uniti riusati
+    """
+    old_version, new_version = (entry['url'], previous['hash']), (entry['url'], entry['hash'])
+    with MERGED_VERSIONS_LOCK:
+        affected = [(merged_hash, versions) for merged_hash, versions in MERGED_VERSIONS.items()
+                    if old_version in versions]
+
+    carried = 0
+    for merged_hash, versions in affected:
+        # La selezione di un calendario unito ha un elemento [url, corsi] per calendario
+        positions = [i for i, version in enumerate(versions) if version == old_version]
+
+        def unchanged(selection, positions=positions):
+            return changed is not None and all(
+                changed.isdisjoint(json.loads(selection[i])[1]) for i in positions
+            )
+
+        new_merged = remember_merged_version(
+            new_version if version == old_version else version for version in versions
+        )
+        carried += rekey_rendered(merged_hash, new_merged, unchanged)
+        with MERGED_VERSIONS_LOCK:
+            MERGED_VERSIONS.pop(merged_hash, None)
+    return carried
+
+def carry_over_rendered(previous, entry):
+    """
+    Sposta alla nuova versione i calendari filtrati (anche uniti) che non includono
+    corsi modificati (stessi byte e stessi validatori), eliminando gli altri
+
+    Returns:
+        Numero di calendari filtrati riusati
+    """
+    old_hash, new_hash = previous['hash'], entry['hash']
+    shared = SHARED_STORE is not None and SHARED_STORE.has_rendered(old_hash)
+    with MERGED_VERSIONS_LOCK:
+        merged = any((entry['url'], old_hash) in versions for versions in MERGED_VERSIONS.values())
+    if not RENDERED_CACHE.selections(old_hash) and not shared and not merged:
+        return 0
+
+    # Senza la versione precedente parsificata il confronto non è possibile: tutto invalidato
+    changed = changed_courses_between(previous, entry)
+
+    def unchanged(selection):
+        return changed is not None and changed.isdisjoint(selection)
+
+    carried = rekey_rendered(old_hash, new_hash, unchanged)
+    carried += carry_over_merged(previous, entry, changed)
+    if changed is not None:
+        log_event("Calendario modificato: riusati i calendari filtrati senza corsi modificati",
+                  url=entry['url'], changed_courses=len(changed), carried=carried)
+    return carried
+
+def record_served_selection(cache_key, selection, now=None, merged=False):
+    """
+    Registra una selezione servita, candidata al preriscaldamento
+
+    Args:
+        merged: La selezione è di un calendario unito (vedi merged_version),
+            registrata per ognuno dei calendari originali che lo compongono
+    """
+    now = now or time.time()
+    served = SERVED_MERGED_SELECTIONS if merged else SERVED_SELECTIONS
+    with SERVED_SELECTIONS_LOCK:
+        selections = served.setdefault(cache_key, OrderedDict())
+        selections[selection] = now
+        selections.move_to_end(selection)
+        while len(selections) > PREWARM_MAX_SELECTIONS:
+            selections.popitem(last=False)
+
+def recent_selections(cache_key, now=None, merged=False):
+    """Selezioni servite per il calendario negli ultimi PREWARM_WINDOW secondi"""
+    now = now or time.time()
+    served = SERVED_MERGED_SELECTIONS if merged else SERVED_SELECTIONS
+    with SERVED_SELECTIONS_LOCK:
+        selections = served.get(cache_key)
+        if not selections:
+            return []
+        for selection in [sel for sel, served in selections.items() if now - served >= PREWARM_WINDOW]:
+            del selections[selection]
+        return list(reversed(selections))
+
+def schedule_version_change(cache_key, previous, entry):
+    """
+    Programma in background il riuso dei filtrati della versione precedente
+    e la rigenerazione delle selezioni recenti per la nuova versione
+
+    Returns:
+        True se è stato programmato anche il preriscaldamento
+    """
+    selections = recent_selections(cache_key) if PREWARM_ON_CHANGE else []
+    merged_selections = recent_selections(cache_key, merged=True) if PREWARM_ON_CHANGE else []
+    if selections or merged_selections:
+        PREWARM_STATS['scheduled'] += 1
+    PREWARM_EXECUTOR.submit(_handle_version_change, cache_key, previous, entry,
+                            selections, merged_selections)
+    return bool(selections or merged_selections)
+
+def prewarm_selections(cache_key, entry, selections):
+    """
+    Genera e salva in cache i calendari filtrati non ancora presenti per la versione data
+
+    Args:
+        cache_key: Chiave del calendario in CALENDAR_CACHE
+        entry: Voce di CALENDAR_CACHE con la nuova versione
+        selections: Selezioni canoniche da generare (le più recenti prima)
+
+    Returns:
+        Numero di calendari filtrati generati
+    """
+    manager = UniversityCalendarManager(entry['url'])
+    parsed = None
+    rendered = 0
+    for selection in selections:
+        # Versione già sostituita da una più recente: il lavoro non servirebbe
+        current = CALENDAR_CACHE.get(cache_key)
+        if current is None or current['hash'] != entry['hash']:
+            break
+        if get_rendered_calendar(entry['hash'], selection) is not None:
+            PREWARM_STATS['skipped'] += 1
+            continue
+
+        if parsed is None:
+            parsed = get_parsed_calendar(manager, entry['data'], entry['hash'])
+            if not parsed:
+                break
+        put_rendered_calendar(entry['hash'], selection,
+                              render_filtered_calendar(manager, parsed, selection),
+                              calendar_etag(entry['hash'], selection), entry['changed_at'])
+        PREWARM_STATS['rendered'] += 1
+        rendered += 1
+    return rendered
+
+def prewarm_merged_selections(merged_selections):
+    """
+    Genera e salva in cache i calendari uniti non ancora presenti per le versioni
+    correnti dei calendari originali
+
+    Args:
+        merged_selections: Selezioni di calendari uniti (le più recenti prima)
+
+    Returns:
+        Numero di calendari uniti generati
+    """
+    rendered = 0
+    for selection in merged_selections:
+        feeds = [SubscriptionFeed(url, courses) for url, courses in map(json.loads, selection)]
+        entries = [CALENDAR_CACHE.get(feed.cache_key) for feed in feeds]
+        if not all(entries):
+            # Calendario non più in cache: verrà scaricato alla prossima richiesta
+            continue
+        merged_hash, _ = merged_version(feeds, entries)
+        if get_rendered_calendar(merged_hash, selection) is not None:
+            PREWARM_STATS['skipped'] += 1
+            continue
+
+        parts = []
+        for feed, entry in zip(feeds, entries):
+            manager = UniversityCalendarManager(feed.url)
+            parts.append((manager, get_parsed_calendar(manager, entry['data'], entry['hash']),
+                          feed.selection))
+        if not all(parsed for _, parsed, _ in parts):
+            continue
+        put_rendered_calendar(merged_hash, selection, render_merged_calendar(parts),
+                              calendar_etag(merged_hash, selection),
+                              max(entry['changed_at'] for entry in entries))
+        PREWARM_STATS['rendered'] += 1
+        rendered += 1
+    return rendered
+
+def _handle_version_change(cache_key, previous, entry, selections, merged_selections=()):
+    """Riuso dei filtrati e preriscaldamento dopo un cambio di versione, eseguiti nel pool in background"""
+    try:
+        with request_trace('version_change', url=entry['url'],
+                           selections=len(selections) + len(merged_selections)) as trace:
+            carried = carry_over_rendered(previous, entry)
+            rendered = prewarm_selections(cache_key, entry, selections) if selections else 0
+            rendered += prewarm_merged_selections(merged_selections)
+            trace.set(carried=carried, rendered=rendered)
+    except Exception as e:
+        log_event("Errore dopo il cambio di versione del calendario", logging.ERROR,
+                  url=entry['url'], error=str(e))
+
+def load_shared_calendar(cache_key, newer_than=0):
+    """
+    Adotta il calendario salvato nella cache condivisa da un altro worker
+
+    Args:
+        cache_key: Chiave del calendario
+        newer_than: Adotta solo versioni scaricate dopo questo istante
+
+    Returns:
+        Voce di CALENDAR_CACHE aggiornata, oppure None
+    """
+    if SHARED_STORE is None:
+        return None
+
+    # Controlla prima solo il timestamp, senza leggere il contenuto
+    timestamp = SHARED_STORE.get_upstream_timestamp(cache_key)
+    if timestamp is None or timestamp <= newer_than:
+        return None
+
+    entry = SHARED_STORE.get_upstream(cache_key)
+    if entry is None:
+        return None
+
+    # Validatori per le richieste condizionali di questo worker
+    UniversityCalendarManager(entry['url']).remember_upstream(
+        entry['data'], entry['hash'], entry['etag'], entry['last_modified']
+    )
+    return store_calendar_entry(cache_key, entry)
+
+def download_and_cache_calendar(calendar_url, cache_key, force=False, deadline=None):
+    """
+    Scarica calendario e lo salva in cache (un solo download in corso per URL)
+
+    Args:
+        calendar_url: URL del calendario
+        cache_key: Chiave del calendario in CALENDAR_CACHE
+        force: Interroga il server anche se un altro worker ha appena scaricato il calendario
+        deadline: Scadenza del download (time.monotonic()), o None
+
+    Returns:
+        Voce di CALENDAR_CACHE aggiornata, oppure None se il download fallisce
+        (o se il download già in corso non termina entro la scadenza)
+    """
+    try:
+        return DOWNLOAD_FLIGHTS.do(cache_key, _download_and_cache_calendar, calendar_url, cache_key,
+                                   force, deadline, wait_until=deadline)
+    except TimeoutError:
+        log_event("Download già in corso non terminato entro la scadenza", logging.WARNING,
+                  url=calendar_url)
+        return None
+
+def _download_and_cache_calendar(calendar_url, cache_key, force=False, deadline=None):
     """Scarica calendario e lo salva in cache"""
+    previous = CALENDAR_CACHE.get(cache_key)
+
+    # Se un altro worker ha già scaricato una versione recente, usa quella
+    if not force:
+        fresh_after = max(previous['timestamp'] if previous else 0,
+                          time.time() - (CACHE_DURATION - REFRESH_AHEAD))
+        shared = load_shared_calendar(cache_key, newer_than=fresh_after)
+        if shared is not None:
+            return shared
+
     manager = UniversityCalendarManager(calendar_url)
-    calendar_data = manager.download_calendar()
-    
-    if calendar_data:
-        # Salva in cache
-        CALENDAR_CACHE[cache_key] = {
-            'data': calendar_data,
-            'timestamp': time.time(),
-            'url': calendar_url
-        }
+    calendar_data = manager.download_calendar(deadline)
     
-    return calendar_data
+    if not calendar_data:
+        # La copia in cache resta valida ma va segnalata come non aggiornata
+        if previous is not None:
+            previous['failed_at'] = time.time()
+        return None
+
+    download = manager.last_download
+    calendar_hash = download['hash']
+
+    # Momento dell'ultima modifica reale del calendario originale
+    if previous and previous.get('hash') == calendar_hash:
+        changed_at = previous['changed_at']
+    else:
+        changed_at = upstream_changed_at(download.get('last_modified'))
+
+    # Salva in cache
+    entry = {
+        'data': calendar_data,
+        'hash': calendar_hash,
+        'etag': download.get('etag'),
+        'last_modified': download.get('last_modified'),
+        'changed_at': changed_at,
+        'timestamp': time.time(),
+        'url': calendar_url
+    }
+    store_calendar_entry(cache_key, entry)
+
+    if SHARED_STORE is not None:
+        SHARED_STORE.put_upstream(cache_key, entry)
+    return entry
+
+# Aggiornamenti in background dei calendari (stale-while-revalidate)
+REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='calendar-refresh')
+REFRESH_PENDING = set()
+REFRESH_LOCK = threading.Lock()
+_refresher_thread = None
+
+def schedule_refresh(calendar_url, cache_key, force=False):
+    """
+    Programma un aggiornamento asincrono del calendario, se non è già in corso
+
+    Returns:
+        True se l'aggiornamento è stato programmato
+    """
+    with REFRESH_LOCK:
+        if cache_key in REFRESH_PENDING:
+            return False
+        REFRESH_PENDING.add(cache_key)
+
+    def refresh():
+        try:
+            with request_trace('refresh', url=calendar_url, force=force):
+                download_and_cache_calendar(calendar_url, cache_key, force)
+        except Exception as e:
+            log_event("Errore durante l'aggiornamento in background", logging.ERROR,
+                      url=calendar_url, error=str(e))
+        finally:
+            with REFRESH_LOCK:
+                REFRESH_PENDING.discard(cache_key)
+
+    REFRESH_EXECUTOR.submit(refresh)
+    return True
+
+def refresh_hot_calendars(now=None):
+    """
+    Riconvalida i calendari richiesti di recente prima che scadano
+
+    Returns:
+        Numero di aggiornamenti programmati
+    """
+    now = now or time.time()
+    scheduled = 0
+    for cache_key, entry in list(CALENDAR_CACHE.items()):
+        is_hot = now - entry.get('last_access', 0) < HOT_WINDOW
+        expires_soon = now - entry['timestamp'] >= CACHE_DURATION - REFRESH_AHEAD
+        if is_hot and expires_soon and schedule_refresh(entry['url'], cache_key):
+            scheduled += 1
+    return scheduled
+
+def _refresher_loop():
+    """Ciclo del thread di aggiornamento anticipato"""
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        try:
+            refresh_hot_calendars()
+        except Exception as e:
+            log_event("Errore nel thread di aggiornamento", logging.ERROR, error=str(e))
+
+def ensure_refresher_started():
+    """Avvia il thread di aggiornamento (nel processo worker, alla prima richiesta)"""
+    global _refresher_thread
+    if not BACKGROUND_REFRESH or _refresher_thread is not None:
+        return
+    with REFRESH_LOCK:
+        if _refresher_thread is None:
+            _refresher_thread = threading.Thread(
+                target=_refresher_loop, name='calendar-refresher', daemon=True
+            )
+            _refresher_thread.start()
+
+def upstream_changed_at(last_modified_header):
+    """Istante di modifica del calendario originale (Last-Modified se presente, altrimenti ora)"""
+    if last_modified_header:
+        try:
+            return parsedate_to_datetime(last_modified_header).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return time.time()
+
+def get_parsed_calendar(manager, calendar_data, calendar_hash=None, admission=False):
+    """
+    Restituisce la voce parsificata per il contenuto dato, parsificando
+    solo se questa versione del calendario non è già in cache
+
+    Args:
+        admission: Il parsing occupa un posto del controllo di ammissione
+            (solo chi lo esegue, non chi attende lo stesso parsing)
+
+    Returns:
+        Dizionario con 'scanned' (eventi in forma compatta), 'hash', 'index'
+        (corso -> eventi) e 'courses' (riepilogo calcolato su richiesta),
+        oppure None se il calendario non è valido
+
+    Raises:
+        AdmissionRejected: Se il parsing è rifiutato dal controllo di ammissione
+    """
+    if calendar_hash is None:
+        calendar_hash = manager.calculate_hash(calendar_data)
+
+    with PARSED_CACHE_LOCK:
+        entry = PARSED_CACHE.get(calendar_hash)
+        if entry is not None:
+            PARSED_CACHE.move_to_end(calendar_hash)
+            PARSED_CACHE_STATS['hits'] += 1
+            return entry
+        PARSED_CACHE_STATS['misses'] += 1
+
+    if admission:
+        return PARSE_FLIGHTS.do(calendar_hash, run_admitted, _parse_and_cache_calendar,
+                                manager, calendar_data, calendar_hash)
+    return PARSE_FLIGHTS.do(calendar_hash, _parse_and_cache_calendar,
+                            manager, calendar_data, calendar_hash)
+
+def _parse_and_cache_calendar(manager, calendar_data, calendar_hash):
+    """Parsifica il calendario e salva la voce in PARSED_CACHE"""
+    if FAST_ICS_SCANNER:
+        scanned = manager.scan_calendar(calendar_data)
+    else:
+        # Parsing completo, poi solo la forma compatta (byte degli eventi e proprietà
+        # per l'indice): l'albero icalendar non resta in PARSED_CACHE
+        calendar = manager.parse_calendar(calendar_data)
+        scanned = manager.compact_calendar(calendar) if calendar else None
+    if scanned is None:
+        return None
+
+    entry = {
+        'scanned': scanned,
+        'hash': calendar_hash,
+        'index': scanned.index,
+        'courses': None,
+        'fingerprints': None
+    }
+
+    with PARSED_CACHE_LOCK:
+        PARSED_CACHE[calendar_hash] = entry
+        while len(PARSED_CACHE) > PARSED_CACHE_MAX_ENTRIES:
+            PARSED_CACHE.popitem(last=False)
+            PARSED_CACHE_STATS['evictions'] += 1
+    return entry
+
+def get_courses(manager, parsed_entry):
+    """
+    Restituisce il riepilogo dei corsi (nome, numero di eventi, luogo), calcolandolo una volta sola
+
+    Il riepilogo viene letto direttamente dall'indice, senza un record per ogni evento.
+    """
+    if parsed_entry['courses'] is None:
+        parsed_entry['courses'] = manager.summarize_courses(parsed_entry['index'])
+    return parsed_entry['courses']
+
+def get_fingerprints(manager, parsed_entry):
+    """Restituisce le impronte degli eventi per corso, calcolandole una volta sola"""
+    if parsed_entry['fingerprints'] is None:
+        parsed_entry['fingerprints'] = manager.event_fingerprints(parsed_entry['index'])
+    return parsed_entry['fingerprints']
+
+def iter_filtered_calendar(manager, parsed_entry, selected_courses):
+    """Genera a blocchi il calendario filtrato riusando i byte degli eventi della voce parsificata"""
+    return manager.iter_filtered_ics(parsed_entry['scanned'], selected_courses)
+
+def render_filtered_calendar(manager, parsed_entry, selected_courses):
+    """Filtra e serializza il calendario parsificato (o letto con lo scanner veloce)"""
+    return b''.join(iter_filtered_calendar(manager, parsed_entry, selected_courses))
+
+def render_merged_calendar(parts):
+    """
+    Unisce e serializza più calendari parsificati
+
+    Args:
+        parts: Terne (manager, voce parsificata, selezione canonica), una per calendario
+    """
+    return b''.join(iter_merged_calendar(
+        (manager, parsed_entry['index'], selection) for manager, parsed_entry, selection in parts
+    ))
+
+def get_rendered_calendar(calendar_hash, selection):
+    """Cerca il calendario filtrato nella cache locale e poi in quella condivisa"""
+    data = RENDERED_CACHE.get(calendar_hash, selection)
+    if data is None and SHARED_STORE is not None:
+        data = SHARED_STORE.get_rendered(calendar_hash, selection)
+        if data is not None:
+            RENDERED_CACHE.put(calendar_hash, selection, data)
+    return data
+
+def put_rendered_calendar(calendar_hash, selection, data, etag=None, last_modified=None):
+    """Comprime una volta sola il calendario filtrato e lo salva nella cache locale e in quella condivisa"""
+    with stage('compress', bytes=len(data)):
+        rendered = RenderedCalendar.from_ics(data, etag, last_modified)
+    RENDERED_CACHE.put(calendar_hash, selection, rendered)
+    if SHARED_STORE is not None:
+        SHARED_STORE.put_rendered(calendar_hash, selection, rendered)
+    return rendered
+
+def acquire_render_slot():
+    """
+    Occupa un posto del controllo di ammissione per un'elaborazione costosa
+
+    Returns:
+        Funzione che libera il posto, oppure None se la richiesta va rifiutata
+    """
+    with span('admission') as admission:
+        admitted = RENDER_LIMITER.acquire()
+        admission.set(admitted=admitted)
+    if not admitted:
+        annotate(shed=True)
+        return None
+    return RENDER_LIMITER.release
+
+def run_admitted(fn, *args):
+    """
+    Esegue fn(*args) occupando un posto del controllo di ammissione
+
+    Raises:
+        AdmissionRejected: Se la richiesta va rifiutata
+    """
+    release = acquire_render_slot()
+    if release is None:
+        raise AdmissionRejected()
+    try:
+        return fn(*args)
+    finally:
+        release()
+
+def render_once(calendar_hash, selection, parse, serialize, etag=None, last_modified=None):
+    """
+    Genera e salva in cache un calendario filtrato una sola volta per le richieste concorrenti
+
+    Solo la prima richiesta occupa un posto del controllo di ammissione, per
+    filtraggio, serializzazione e compressione; le altre attendono il suo risultato.
+    Il parsing avviene prima, fuori dal posto: chi attende il parsing di un'altra
+    richiesta non occupa posti.
+
+    Args:
+        parse: Funzione senza argomenti che restituisce il calendario parsificato (o None);
+            il parsing occupa un proprio posto (vedi get_parsed_calendar)
+        serialize: Funzione che serializza il calendario parsificato in byte
+
+    Returns:
+        RenderedCalendar, oppure None se il calendario non è valido
+
+    Raises:
+        AdmissionRejected: Se la generazione è rifiutata dal controllo di ammissione
+    """
+    def render(parsed):
+        return put_rendered_calendar(calendar_hash, selection, serialize(parsed),
+                                     etag, last_modified)
+
+    def lead():
+        # Un'altra richiesta può averlo appena generato: in tal caso nessun posto
+        rendered = get_rendered_calendar(calendar_hash, selection)
+        if rendered is not None:
+            return rendered
+        parsed = parse()
+        if not parsed:
+            return None
+        return run_admitted(render, parsed)
+
+    return RENDER_FLIGHTS.do((calendar_hash, selection), lead)
+
+def overloaded_response():
+    """Risposta 503 per le richieste rifiutate dal controllo di ammissione"""
+    response = app.response_class("Servizio sovraccarico, riprova tra poco", status=503,
+                                  mimetype='text/plain')
+    response.headers.set('Retry-After', str(RENDER_RETRY_AFTER))
+    return response
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key')
 
+@app.before_request
+def begin_trace():
+    """Avvia la traccia della richiesta (ID dall'intestazione X-Request-ID, se presente)"""
+    rule = request.url_rule.rule if request.url_rule else request.path
+    request_id = request.headers.get('X-Request-ID', '')[:64] or None
+    g.trace = start_trace(f'{request.method} {rule}', request_id, method=request.method, route=rule)
+
+@app.after_request
+def finish_trace(response):
+    """Chiude la traccia a fine risposta (dopo l'ultimo blocco, se inviata a blocchi)"""
+    trace = g.get('trace')
+    if trace is not None:
+        response.headers['X-Request-ID'] = trace.id
+        trace.set(status=response.status_code)
+        response.call_on_close(lambda: end_trace(trace))
+        g.trace = None
+    return response
+
+@app.teardown_request
+def abort_trace(error=None):
+    """Chiude la traccia delle richieste terminate senza risposta"""
+    trace = g.get('trace')
+    if trace is not None:
+        end_trace(trace, error)
+
 # Configurazione cartella upload
 UPLOAD_FOLDER = os.path.join(os.getcwd(), 'temp_calendars')
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Crea cartella se non esiste
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# File temporanei delle sessioni: limitati per numero e dimensione, eliminati
+# dopo SESSION_TTL secondi dall'ultimo accesso (crea la cartella se non esiste)
+SESSION_STORE = SessionFileStore(
+    UPLOAD_FOLDER,
+    max_bytes=int(os.environ.get('SESSION_STORE_MAX_BYTES', 256 * 1024 * 1024)),
+    max_entries=int(os.environ.get('SESSION_STORE_MAX_ENTRIES', 1000)),
+    ttl=int(os.environ.get('SESSION_TTL', 24 * 60 * 60)),
+    sweep_interval=int(os.environ.get('SESSION_SWEEP_INTERVAL', 10 * 60))
+)
+
+# Profilazione su richiesta (PROFILE_REQUESTS=true): le richieste con intestazione
+# X-Profile o parametro ?profile=1 (o campionate con PROFILE_SAMPLE_RATE) più lente
+# di PROFILE_THRESHOLD_MS salvano il profilo cProfile in PROFILE_DIR
+PROFILER = RequestProfiler(
+    os.environ.get('PROFILE_DIR', os.path.join(os.getcwd(), 'data', 'profiles')),
+    enabled=os.environ.get('PROFILE_REQUESTS', 'false').lower() == 'true',
+    threshold=int(os.environ.get('PROFILE_THRESHOLD_MS', 500)) / 1000,
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    max_files=int(os.environ.get('PROFILE_MAX_FILES', 50)),
+    token=os.environ.get('PROFILE_TOKEN') or None
+)
+
+def get_session_calendar(manager, session_id, calendar_url):
+    """
+    Restituisce la versione parsificata a cui si riferisce la sessione
+
+    Se non è più in PARSED_CACHE (o la richiesta arriva a un altro worker)
+    la parsifica dalla cache dei calendari, purché sia ancora la versione corrente.
+
+    Returns:
+        Voce parsificata, oppure None se la versione della sessione non è più disponibile
+    """
+    with PARSED_CACHE_LOCK:
+        parsed = PARSED_CACHE.get(session_id)
+    if parsed is not None or not calendar_url:
+        return parsed
+
+    cache_entry = get_calendar_entry(calendar_url, hashlib.md5(calendar_url.encode()).hexdigest(),
+                                     deadline=time.monotonic() + REQUEST_DEADLINE)
+    if not cache_entry or cache_entry['hash'] != session_id:
+        # Il calendario è cambiato: i corsi scelti si riferiscono a un'altra versione
+        log_event("Sessione non più in cache", session_id=session_id, url=calendar_url)
+        return None
+    return get_parsed_calendar(manager, cache_entry['data'], cache_entry['hash'])
+
+def is_known_session(session_id, calendar_url):
+    """True se la versione della sessione è ancora in cache, senza scaricare né parsificare"""
+    with PARSED_CACHE_LOCK:
+        if session_id in PARSED_CACHE:
+            return True
+    cache_key = hashlib.md5(calendar_url.encode()).hexdigest()
+    cache_entry = CALENDAR_CACHE.get(cache_key)
+    if cache_entry is not None and cache_entry['hash'] == session_id:
+        return True
+    # Un altro worker può aver già scaricato la versione della sessione
+    shared_entry = load_shared_calendar(cache_key, cache_entry['timestamp'] if cache_entry else 0)
+    return shared_entry is not None and shared_entry['hash'] == session_id
 
 @app.route('/')
 def index():
@@ -49,6 +833,7 @@ def index():
     return render_template('index.html')
 
 @app.route('/api/analyze_calendar', methods=['POST'])
+@PROFILER.profile
 def analyze_calendar():
     """Analizza calendario"""
     try:
@@ -58,47 +843,49 @@ def analyze_calendar():
         if not calendar_url:
             return jsonify({'error': 'URL richiesto'}), 400
 
+        # Stessa cache dei calendari e delle versioni parsificate usata da /api/ical
+        ensure_refresher_started()
         manager = UniversityCalendarManager(calendar_url)
-        calendar_data = manager.download_calendar()
+        cache_entry = get_calendar_entry(calendar_url, hashlib.md5(calendar_url.encode()).hexdigest(),
+                                         deadline=time.monotonic() + REQUEST_DEADLINE)
 
-        if not calendar_data:
+        if not cache_entry:
             return jsonify({'error': 'Impossibile scaricare calendario'}), 400
+        stale = calendar_staleness([cache_entry])
 
-        calendar = manager.parse_calendar(calendar_data)
-        if not calendar:
+        annotate_profile(upstream_bytes=len(cache_entry['data']))
+        # Il parsing di una nuova versione passa dal controllo di ammissione
+        try:
+            parsed = get_parsed_calendar(manager, cache_entry['data'], cache_entry['hash'],
+                                         admission=True)
+        except AdmissionRejected:
+            response = jsonify({'error': 'Servizio sovraccarico, riprova tra poco'})
+            response.headers.set('Retry-After', str(RENDER_RETRY_AFTER))
+            return response, 503
+        if not parsed:
             return jsonify({'error': 'Formato calendario non valido'}), 400
 
-        courses = manager.extract_courses(calendar)
-        if not courses:
+        courses_list = get_courses(manager, parsed)
+        if not courses_list:
             return jsonify({'error': 'Nessun corso trovato'}), 400
 
-        courses_list = []
-        for course_name, events in courses.items():
-            courses_list.append({
-                'name': course_name,
-                'events_count': len(events),
-                'location': events[0]['location'] if events and events[0]['location'] else 'N/A'
-            })
-
-        courses_list.sort(key=lambda x: x['name'])
-
-        session_id = hashlib.md5(calendar_url.encode()).hexdigest()
-        temp_file = os.path.join(UPLOAD_FOLDER, f'{session_id}_calendar.txt')
-        with open(temp_file, 'w', encoding='utf-8') as f:
-            f.write(calendar_data)
+        # La sessione è la versione parsificata del calendario (hash del contenuto)
+        session_id = cache_entry['hash']
 
         return jsonify({
             'success': True,
             'courses': courses_list,
             'total_courses': len(courses_list),
             'session_id': session_id,
-            'calendar_url': calendar_url
+            'calendar_url': calendar_url,
+            'stale': stale is not None
         })
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/generate_calendar', methods=['POST'])
+@PROFILER.profile
 def generate_calendar():
     """Genera calendario filtrato"""
     try:
@@ -110,26 +897,42 @@ def generate_calendar():
         if not session_id or not selected_courses:
             return jsonify({'error': 'Dati mancanti'}), 400
 
-        temp_file = os.path.join(UPLOAD_FOLDER, f'{session_id}_calendar.txt')
-        if not os.path.exists(temp_file):
-            return jsonify({'error': 'Sessione scaduta'}), 400
-
-        with open(temp_file, 'r', encoding='utf-8') as f:
-            calendar_data = f.read()
-
         manager = UniversityCalendarManager(calendar_url)
-        calendar = manager.parse_calendar(calendar_data)
-        filtered_calendar = manager.create_filtered_calendar(calendar, selected_courses)
+        parsed = get_session_calendar(manager, session_id, calendar_url)
+        if not parsed:
+            return jsonify({'error': 'Sessione scaduta'}), 400
 
-        output_filename = f'{session_id}_filtered.ics'
-        output_path = os.path.join(UPLOAD_FOLDER, output_filename)
+        # Il file da scaricare dipende solo dalla versione e dalla selezione;
+        # il calendario filtrato resta in cache anche per i link iCal
+        selection = canonical_selection(selected_courses)
+        annotate_profile(selection_size=len(selection),
+                         upstream_events=sum(len(events) for events in parsed['index'].values()))
+        download_id = calendar_etag(parsed['hash'], selection)
+        rendered = get_rendered_calendar(parsed['hash'], selection)
+        if rendered is None:
+            # Stessi validatori del link iCal, se la sessione è la versione corrente
+            cache_entry = CALENDAR_CACHE.get(hashlib.md5((calendar_url or '').encode()).hexdigest())
+            if cache_entry is not None and cache_entry['hash'] == parsed['hash']:
+                etag, last_modified = download_id, cache_entry['changed_at']
+            else:
+                etag = last_modified = None
+            try:
+                rendered = render_once(
+                    parsed['hash'], selection, lambda: parsed,
+                    lambda session: render_filtered_calendar(manager, session, selection),
+                    etag, last_modified
+                )
+            except AdmissionRejected:
+                response = jsonify({'error': 'Servizio sovraccarico, riprova tra poco'})
+                response.headers.set('Retry-After', str(RENDER_RETRY_AFTER))
+                return response, 503
 
-        with open(output_path, 'wb') as f:
-            f.write(filtered_calendar.to_ical())
+        SESSION_STORE.start_sweeper()
+        SESSION_STORE.write_chunks(f'{download_id}_filtered.ics', [rendered.variants['identity']])
 
         return jsonify({
             'success': True,
-            'download_url': f'/download/{session_id}',
+            'download_url': f'/download/{download_id}',
             'filename': f'calendario_filtrato_{datetime.now().strftime("%Y%m%d")}.ics'
         })
 
@@ -139,10 +942,9 @@ def generate_calendar():
 @app.route('/download/<session_id>')
 def download_calendar(session_id):
     """Download calendario"""
-    filename = f'{session_id}_filtered.ics'
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    file_path = SESSION_STORE.get_path(f'{session_id}_filtered.ics')
 
-    if not os.path.exists(file_path):
+    if file_path is None:
         return "File non trovato", 404
 
     return send_file(
@@ -161,28 +963,33 @@ def create_permanent_link():
         calendar_url = data.get('calendar_url')
         selected_courses = data.get('selected_courses', [])
 
-        if not all([session_id, calendar_url, selected_courses]):
-            return jsonify({'error': 'Dati mancanti'}), 400
+        # Più calendari: "feeds": [{"session_id", "calendar_url", "selected_courses"}, ...]
+        feeds = data.get('feeds') or [{
+            'session_id': session_id,
+            'calendar_url': calendar_url,
+            'selected_courses': selected_courses
+        }]
 
-        # Verifica che la sessione esista
-        temp_file = os.path.join(UPLOAD_FOLDER, f'{session_id}_calendar.txt')
-        if not os.path.exists(temp_file):
-            return jsonify({'error': 'Sessione scaduta'}), 400
+        for feed in feeds:
+            if not all([feed.get('session_id'), feed.get('calendar_url'), feed.get('selected_courses')]):
+                return jsonify({'error': 'Dati mancanti'}), 400
+
+            # Verifica che la sessione esista
+            if not is_known_session(feed['session_id'], feed['calendar_url']):
+                return jsonify({'error': 'Sessione scaduta'}), 400
 
         # Genera URL di base
         base_url = request.host_url.rstrip('/')
 
-        # Encoda la configurazione
-        cfg_payload = {
-            'session_id': session_id,
-            'url': calendar_url,
-            'corsi': selected_courses
-        }
-        cfg_str = json.dumps(cfg_payload, separators=(',', ':'))
-        cfg_enc = base64.urlsafe_b64encode(cfg_str.encode('utf-8')).decode('ascii').rstrip('=')
-
-        # Link iCal
-        ical_url = f"{base_url}/api/ical?cfg={cfg_enc}"
+        if SUBSCRIPTION_STORE is not None:
+            # Registra l'iscrizione: selezioni identiche hanno lo stesso ID breve
+            subscription = SUBSCRIPTION_STORE.create_feeds(
+                [(feed['calendar_url'], feed['selected_courses']) for feed in feeds]
+            )
+            ical_url = f"{base_url}/api/ical/{subscription.id}"
+        else:
+            # Link autosufficiente: la configurazione è codificata nell'URL
+            ical_url = f"{base_url}/api/ical?cfg={encode_feeds_config(feeds)}"
         webcal_url = ical_url.replace('http://', 'webcal://').replace('https://', 'webcal://')
 
         return jsonify({
@@ -194,9 +1001,302 @@ def create_permanent_link():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def encode_feeds_config(feeds):
+    """
+    Codifica la configurazione di un link iCal autosufficiente (base64 url-safe)
+
+    Args:
+        feeds: Calendari con "session_id", "calendar_url" e "selected_courses"
+    """
+    cfg_payload = {'session_id': feeds[0]['session_id']}
+    if len(feeds) == 1:
+        cfg_payload.update(url=feeds[0]['calendar_url'], corsi=feeds[0]['selected_courses'])
+    else:
+        cfg_payload['feeds'] = [{'url': feed['calendar_url'], 'corsi': feed['selected_courses']}
+                                for feed in feeds]
+    cfg_str = json.dumps(cfg_payload, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cfg_str.encode('utf-8')).decode('ascii').rstrip('=')
+
+def is_not_modified(etags, last_modified):
+    """Verifica If-None-Match / If-Modified-Since della richiesta corrente"""
+    if request.if_none_match:
+        return any(request.if_none_match.contains_weak(etag) for etag in etags)
+    if request.if_modified_since and last_modified:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+def set_ical_cache_headers(response, etag, last_modified, encoding='identity', stale=None):
+    """
+    Imposta le intestazioni di cache, codifica e validatori del calendario iCal
+
+    Args:
+        stale: Coppia (motivo, età in secondi) se il calendario originale non è aggiornato
+    """
+    if stale is None:
+        # Cache più lunga per ridurre le richieste (24 ore)
+        response.headers.set('Cache-Control', 'public, max-age=86400, s-maxage=86400')  # 24 ore
+    else:
+        reason, age = stale
+        response.headers.set('Cache-Control', f'public, max-age={STALE_MAX_AGE}')
+        response.headers.set('Age', str(int(age)))
+        response.headers.set('Warning', '110 - "Response is Stale"')
+        response.headers.set('X-Calendar-Stale', reason)
+    response.headers.set('Vary', 'Accept-Encoding')
+    if encoding != 'identity':
+        response.headers.set('Content-Encoding', encoding)
+    response.set_etag(variant_etag(etag, encoding))
+    response.last_modified = int(last_modified)
+    return response
+
+def get_calendar_entry(calendar_url, cache_key, force_refresh=False, deadline=None):
+    """
+    Restituisce il calendario originale dalla cache o scaricandolo
+    (stale-while-revalidate: una copia scaduta da poco viene servita e aggiornata in background;
+    se il download fallisce viene servita l'ultima copia valida, di qualunque età)
+
+    Args:
+        calendar_url: URL del calendario originale
+        cache_key: Chiave del calendario in CALENDAR_CACHE
+        force_refresh: Riconvalida il calendario anche se la copia in cache è recente
+        deadline: Scadenza del download (time.monotonic()), o None
+
+    Returns:
+        Voce di CALENDAR_CACHE, oppure None se il download fallisce senza copie in cache
+    """
+    current_time = time.time()
+    with span('cache_lookup', cache='calendar', url=calendar_url) as lookup:
+        cache_entry = CALENDAR_CACHE.get(cache_key) or load_shared_calendar(cache_key)
+
+        if cache_entry is None:
+            # Nessuna cache, scarica nuovo calendario
+            lookup.set(result='miss')
+            CALENDAR_CACHE_STATS['misses'] += 1
+            cache_entry = download_and_cache_calendar(calendar_url, cache_key, deadline=deadline)
+        else:
+            age = current_time - cache_entry['timestamp']
+            lookup.set(age_s=round(age, 3))
+            if age < CACHE_DURATION and not force_refresh:
+                lookup.set(result='hit')
+                CALENDAR_CACHE_STATS['hits'] += 1
+            elif age < CACHE_DURATION:
+                # Copia recente con riconvalida richiesta (refresh=true): servita e aggiornata
+                # in background, contata a parte per non gonfiare le copie scadute
+                lookup.set(result='revalidate')
+                CALENDAR_CACHE_STATS['revalidations'] += 1
+                schedule_refresh(calendar_url, cache_key, force=True)
+            elif age < CACHE_DURATION + STALE_DURATION:
+                # Serve la copia in cache e aggiorna in background
+                lookup.set(result='stale')
+                CALENDAR_CACHE_STATS['stale'] += 1
+                schedule_refresh(calendar_url, cache_key, force=force_refresh)
+            else:
+                # Copia troppo vecchia, scarica nuovo calendario
+                lookup.set(result='expired')
+                CALENDAR_CACHE_STATS['expired'] += 1
+                fresh = download_and_cache_calendar(calendar_url, cache_key, deadline=deadline)
+                if fresh is not None:
+                    cache_entry = fresh
+                else:
+                    lookup.set(result='stale_on_error')
+
+    if cache_entry:
+        cache_entry['last_access'] = current_time
+    return cache_entry
+
+def calendar_staleness(entries, now=None):
+    """
+    Indica se la risposta usa copie non aggiornate del calendario originale
+
+    Args:
+        entries: Voci di CALENDAR_CACHE usate per la risposta
+
+    Returns:
+        Coppia (motivo, età in secondi) della copia più vecchia, oppure None se tutte
+        sono recenti; motivo è 'upstream-error' se l'ultimo download è fallito,
+        altrimenti 'revalidating' (aggiornamento in background in corso)
+    """
+    now = now or time.time()
+    stale = [entry for entry in entries if now - entry['timestamp'] >= CACHE_DURATION]
+    if not stale:
+        return None
+    failed = any(entry.get('failed_at', 0) > entry['timestamp'] for entry in stale)
+    reason = 'upstream-error' if failed else 'revalidating'
+    STALE_RESPONSE_STATS[reason.replace('-', '_')] += 1
+    annotate(stale=reason)
+    return reason, now - min(entry['timestamp'] for entry in stale)
+
+def serve_calendar(calendar_url, selection, cache_key):
+    """
+    Servi il calendario filtrato per una selezione canonica di corsi
+
+    Args:
+        calendar_url: URL del calendario originale
+        selection: Selezione canonica dei corsi (vedi canonical_selection)
+        cache_key: Chiave del calendario originale in CALENDAR_CACHE
+    """
+    # Controlla cache o scarica calendario fresco
+    ensure_refresher_started()
+    current_time = time.time()
+    force_refresh = request.args.get('refresh') == 'true'
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    cache_entry = get_calendar_entry(calendar_url, cache_key, force_refresh, deadline)
+
+    if not cache_entry:
+        return "Impossibile scaricare calendario", 502
+    stale = calendar_staleness([cache_entry], current_time)
+
+    calendar_data = cache_entry['data']
+    calendar_hash = cache_entry['hash']
+    record_served_selection(cache_key, selection, current_time)
+    annotate_profile(selection_size=len(selection), upstream_bytes=len(calendar_data))
+
+    # Riusa il calendario filtrato già serializzato (e compresso) per la stessa selezione
+    with span('cache_lookup', cache='rendered') as lookup:
+        rendered = get_rendered_calendar(calendar_hash, selection)
+        lookup.set(result='hit' if rendered is not None else 'miss')
+    annotate(selection_size=len(selection))
+
+    # Validatori noti prima della serializzazione: se il client ha già
+    # questa versione risponde 304 senza parsificare né serializzare
+    # (le varianti compresse hanno lo stesso contenuto: vale qualunque loro ETag).
+    # Un filtrato riusato da una versione precedente mantiene i suoi validatori.
+    if rendered is not None and rendered.etag is not None:
+        etag, last_modified = rendered.etag, rendered.last_modified
+    else:
+        etag, last_modified = calendar_etag(calendar_hash, selection), cache_entry['changed_at']
+    accept_encoding = request.headers.get('Accept-Encoding')
+    if is_not_modified([variant_etag(etag, encoding)
+                        for encoding in ('identity',) + SUPPORTED_ENCODINGS], last_modified):
+        encoding = choose_encoding(accept_encoding, SUPPORTED_ENCODINGS)
+        annotate(not_modified=True)
+        return set_ical_cache_headers(app.response_class(status=304), etag, last_modified,
+                                      encoding, stale)
+
+    if rendered is None:
+        # Parsing, filtraggio e serializzazione passano dal controllo di ammissione;
+        # il posto viene liberato prima dell'invio, che dipende dalla velocità del client
+        manager = UniversityCalendarManager(calendar_url)
+        try:
+            # Processa calendario (riusa la versione parsificata se già in cache)
+            rendered = render_once(
+                calendar_hash, selection,
+                lambda: get_parsed_calendar(manager, calendar_data, calendar_hash, admission=True),
+                lambda parsed: render_filtered_calendar(manager, parsed, selection),
+                etag, last_modified
+            )
+        except AdmissionRejected:
+            return overloaded_response()
+        if rendered is None:
+            return "Formato calendario non valido", 400
+
+    # Servi calendario
+    encoding = choose_encoding(accept_encoding, rendered.variants)
+    response = app.response_class(
+        rendered.variants[encoding],
+        mimetype='text/calendar; charset=utf-8'
+    )
+    return set_ical_cache_headers(response, etag, last_modified, encoding, stale)
+
+def merged_version(feeds, entries):
+    """
+    Versione e selezione di un calendario unito, usate come chiave e per l'ETag
+
+    Args:
+        feeds: Calendari dell'iscrizione (SubscriptionFeed), in forma canonica
+        entries: Voci di CALENDAR_CACHE corrispondenti
+
+    Returns:
+        Coppia (hash delle versioni dei calendari originali, selezione)
+    """
+    merged_hash = remember_merged_version(
+        (feed.url, entry['hash']) for feed, entry in zip(feeds, entries)
+    )
+    selection = tuple(
+        json.dumps([feed.url, list(feed.selection)], separators=(',', ':')) for feed in feeds
+    )
+    return merged_hash, selection
+
+def serve_merged_calendar(feeds):
+    """
+    Servi un unico calendario con i corsi selezionati di più calendari originali
+
+    I calendari originali vengono scaricati (o letti dalla cache) e parsificati
+    in parallelo: la latenza dipende dal più lento, non dalla somma.
+
+    Args:
+        feeds: Calendari dell'iscrizione (SubscriptionFeed), in forma canonica
+    """
+    ensure_refresher_started()
+    force_refresh = request.args.get('refresh') == 'true'
+    deadline = time.monotonic() + REQUEST_DEADLINE
+    entries = list(FEED_EXECUTOR.map(
+        bind_trace(lambda feed: get_calendar_entry(feed.url, feed.cache_key, force_refresh,
+                                                   deadline)), feeds
+    ))
+    if not all(entries):
+        return "Impossibile scaricare calendario", 502
+    stale = calendar_staleness(entries)
+
+    annotate_profile(feeds=len(feeds),
+                     selection_size=sum(len(feed.selection) for feed in feeds),
+                     upstream_bytes=sum(len(entry['data']) for entry in entries))
+    merged_hash, selection = merged_version(feeds, entries)
+    for feed in feeds:
+        record_served_selection(feed.cache_key, selection, merged=True)
+    with span('cache_lookup', cache='rendered') as lookup:
+        rendered = get_rendered_calendar(merged_hash, selection)
+        lookup.set(result='hit' if rendered is not None else 'miss')
+    annotate(feeds=len(feeds))
+    if rendered is not None and rendered.etag is not None:
+        etag, last_modified = rendered.etag, rendered.last_modified
+    else:
+        etag = calendar_etag(merged_hash, selection)
+        last_modified = max(entry['changed_at'] for entry in entries)
+    accept_encoding = request.headers.get('Accept-Encoding')
+    if is_not_modified([variant_etag(etag, encoding)
+                        for encoding in ('identity',) + SUPPORTED_ENCODINGS], last_modified):
+        encoding = choose_encoding(accept_encoding, SUPPORTED_ENCODINGS)
+        annotate(not_modified=True)
+        return set_ical_cache_headers(app.response_class(status=304), etag, last_modified,
+                                      encoding, stale)
+
+    if rendered is None:
+        def parse(feed_entry):
+            feed, entry = feed_entry
+            manager = UniversityCalendarManager(feed.url)
+            return (manager, get_parsed_calendar(manager, entry['data'], entry['hash'], admission=True),
+                    feed.selection)
+
+        def parse_all():
+            parts = list(FEED_EXECUTOR.map(bind_trace(parse), zip(feeds, entries)))
+            return parts if all(parsed for _, parsed, _ in parts) else None
+
+        try:
+            rendered = render_once(merged_hash, selection, parse_all, render_merged_calendar,
+                                   etag, last_modified)
+        except AdmissionRejected:
+            return overloaded_response()
+        if rendered is None:
+            return "Formato calendario non valido", 400
+
+    encoding = choose_encoding(accept_encoding, rendered.variants)
+    response = app.response_class(
+        rendered.variants[encoding],
+        mimetype='text/calendar; charset=utf-8'
+    )
+    return set_ical_cache_headers(response, etag, last_modified, encoding, stale)
+
+def serve_feeds(feeds):
+    """Servi il calendario di un'iscrizione (un solo calendario originale o più calendari uniti)"""
+    if len(feeds) == 1:
+        feed = feeds[0]
+        return serve_calendar(feed.url, feed.selection, feed.cache_key)
+    return serve_merged_calendar(feeds)
+
 @app.route('/api/ical')
+@PROFILER.profile
 def serve_ical():
-    """Servi calendario iCal aggiornato"""
+    """Servi calendario iCal aggiornato (link con configurazione codificata)"""
     try:
         cfg_param = request.args.get('cfg')
         if not cfg_param:
@@ -207,58 +1307,35 @@ def serve_ical():
             cfg_json = base64.urlsafe_b64decode(cfg_param + '===').decode('utf-8')
             cfg = json.loads(cfg_json)
             session_id = cfg.get('session_id')
-            calendar_url = cfg.get('url')
-            selected_courses = cfg.get('corsi', [])
+            # Più calendari: "feeds": [{"url": ..., "corsi": [...]}, ...]
+            feeds = [(feed.get('url'), feed.get('corsi', [])) for feed in cfg.get('feeds', [])]
+            if not feeds:
+                feeds = [(cfg.get('url'), cfg.get('corsi', []))]
         except Exception as e:
             return f"Configurazione non valida: {e}", 400
 
-        if not all([session_id, calendar_url, selected_courses]):
+        if not session_id or not all(url and courses for url, courses in feeds):
             return "Parametri mancanti nella configurazione", 400
 
-        # Controlla cache o scarica calendario fresco
-        current_time = time.time()
-        cache_key = hashlib.md5(calendar_url.encode()).hexdigest()
-        
-        # Verifica se abbiamo una versione in cache valida (meno di 24 ore)
-        if cache_key in CALENDAR_CACHE:
-            cached_data = CALENDAR_CACHE[cache_key]
-            if current_time - cached_data['timestamp'] < CACHE_DURATION:
-                print(f"Using cached calendar for: {calendar_url}")
-                calendar_data = cached_data['data']
-            else:
-                # Cache scaduta, scarica nuovo calendario
-                print(f"Cache expired, downloading fresh calendar from: {calendar_url}")
-                calendar_data = download_and_cache_calendar(calendar_url, cache_key)
-        else:
-            # Nessuna cache, scarica nuovo calendario
-            print(f"No cache found, downloading fresh calendar from: {calendar_url}")
-            calendar_data = download_and_cache_calendar(calendar_url, cache_key)
-        
-        if not calendar_data:
-            return "Impossibile scaricare calendario", 502
+        return serve_feeds([SubscriptionFeed(url, courses) for url, courses in canonical_feeds(feeds)])
 
-        # Processa calendario
-        manager = UniversityCalendarManager(calendar_url)
-        calendar = manager.parse_calendar(calendar_data)
-        if not calendar:
-            return "Formato calendario non valido", 400
+    except Exception as e:
+        log_event("Errore nel servire il calendario iCal", logging.ERROR, error=str(e))
+        return f"Errore: {str(e)}", 500
 
-        filtered_calendar = manager.create_filtered_calendar(calendar, selected_courses)
+@app.route('/api/ical/<subscription_id>')
+@PROFILER.profile
+def serve_subscription_ical(subscription_id):
+    """Servi calendario iCal aggiornato (link con ID breve dell'iscrizione)"""
+    try:
+        subscription = SUBSCRIPTION_STORE.get(subscription_id) if SUBSCRIPTION_STORE is not None else None
+        if subscription is None:
+            return "Iscrizione non trovata", 404
 
-        # Servi calendario
-        data = filtered_calendar.to_ical()
-        response = app.response_class(
-            data,
-            mimetype='text/calendar; charset=utf-8'
-        )
-        # Cache più lunga per ridurre le richieste (24 ore)
-        response.headers.set('Cache-Control', 'public, max-age=86400, s-maxage=86400')  # 24 ore
-        response.headers.set('ETag', hashlib.md5(data).hexdigest())
-        response.headers.set('Last-Modified', datetime.now().strftime('%a, %d %b %Y %H:%M:%S GMT'))
-        return response
+        return serve_feeds(subscription.feeds)
 
     except Exception as e:
-        print(f"Error serving iCal: {e}")
+        log_event("Errore nel servire il calendario iCal", logging.ERROR, error=str(e))
         return f"Errore: {str(e)}", 500
 
 @app.route('/api/ical/refresh/<path:cfg>')
@@ -270,10 +1347,106 @@ def force_refresh_ical(cfg):
     except Exception as e:
         return f"Errore: {str(e)}", 500
 
+def cache_metrics():
+    """Stato e contatori delle cache, letti a ogni esportazione delle metriche"""
+    rendered = RENDERED_CACHE.stats()
+    sessions = SESSION_STORE.stats()
+    yield ('calendar_cache_entries', 'gauge', 'Voci nelle cache', [
+        ({'cache': 'calendar'}, len(CALENDAR_CACHE)),
+        ({'cache': 'parsed'}, len(PARSED_CACHE)),
+        ({'cache': 'rendered'}, rendered['entries']),
+        ({'cache': 'sessions'}, sessions['entries']),
+    ])
+    yield ('calendar_cache_bytes', 'gauge', 'Dimensione delle cache limitate in byte', [
+        ({'cache': 'rendered'}, rendered['bytes']),
+        ({'cache': 'sessions'}, sessions['bytes']),
+    ])
+    yield ('calendar_cache_requests_total', 'counter', 'Ricerche nelle cache per esito', [
+        ({'cache': 'calendar', 'result': 'hit'}, CALENDAR_CACHE_STATS['hits']),
+        ({'cache': 'calendar', 'result': 'stale'}, CALENDAR_CACHE_STATS['stale']),
+        ({'cache': 'calendar', 'result': 'miss'}, CALENDAR_CACHE_STATS['misses']),
+        ({'cache': 'calendar', 'result': 'expired'}, CALENDAR_CACHE_STATS['expired']),
+        ({'cache': 'calendar', 'result': 'revalidate'}, CALENDAR_CACHE_STATS['revalidations']),
+        ({'cache': 'parsed', 'result': 'hit'}, PARSED_CACHE_STATS['hits']),
+        ({'cache': 'parsed', 'result': 'miss'}, PARSED_CACHE_STATS['misses']),
+        ({'cache': 'rendered', 'result': 'hit'}, rendered['hits']),
+        ({'cache': 'rendered', 'result': 'miss'}, rendered['misses']),
+    ])
+    yield ('calendar_cache_evictions_total', 'counter', 'Voci eliminate dalle cache', [
+        ({'cache': 'parsed', 'reason': 'size'}, PARSED_CACHE_STATS['evictions']),
+        ({'cache': 'rendered', 'reason': 'size'}, rendered['evictions']),
+        ({'cache': 'sessions', 'reason': 'size'}, sessions['evictions']),
+        ({'cache': 'sessions', 'reason': 'ttl'}, sessions['expired']),
+    ])
+    yield ('calendar_rendered_rekeyed_total', 'counter',
+           'Calendari filtrati riusati dopo una modifica del calendario originale',
+           [(None, rendered['rekeyed'])])
+    yield ('calendar_flights_total', 'counter',
+           'Download e parsing eseguiti o raggruppati con una chiamata già in corso', [
+               ({'flight': 'download', 'result': 'executed'}, DOWNLOAD_FLIGHTS.executed),
+               ({'flight': 'download', 'result': 'coalesced'}, DOWNLOAD_FLIGHTS.coalesced),
+               ({'flight': 'download', 'result': 'timeout'}, DOWNLOAD_FLIGHTS.timed_out),
+               ({'flight': 'parse', 'result': 'executed'}, PARSE_FLIGHTS.executed),
+               ({'flight': 'parse', 'result': 'coalesced'}, PARSE_FLIGHTS.coalesced),
+           ])
+    yield ('calendar_prewarm_total', 'counter', 'Preriscaldamento dei calendari filtrati', [
+        ({'result': result}, count) for result, count in sorted(PREWARM_STATS.items())
+    ])
+    yield ('calendar_stale_responses_total', 'counter',
+           'Risposte servite con una copia non aggiornata del calendario originale', [
+               ({'reason': reason}, count) for reason, count in sorted(STALE_RESPONSE_STATS.items())
+           ])
+    admission = RENDER_LIMITER.stats()
+    yield ('calendar_render_active', 'gauge',
+           'Elaborazioni (parsing, filtraggio, serializzazione) in corso', [(None, admission['active'])])
+    yield ('calendar_render_queue_depth', 'gauge',
+           'Richieste in attesa del controllo di ammissione', [(None, admission['waiting'])])
+    yield ('calendar_render_admissions_total', 'counter',
+           'Esiti del controllo di ammissione delle elaborazioni', [
+               ({'result': 'admitted'}, admission['admitted']),
+               ({'result': 'queued'}, admission['queued']),
+               ({'result': 'shed'}, admission['shed']),
+               ({'result': 'timeout'}, admission['timed_out']),
+           ])
+    breakers = circuit_breaker_stats()
+    yield ('calendar_upstream_circuit_open', 'gauge',
+           'Interruttore del server remoto aperto (1) o chiuso (0)', [
+               ({'host': host}, int(stats['state'] != 'closed'))
+               for host, stats in sorted(breakers.items())
+           ])
+    yield ('calendar_upstream_circuit_rejected_total', 'counter',
+           'Download rifiutati con l\'interruttore aperto', [
+               ({'host': host}, stats['rejected']) for host, stats in sorted(breakers.items())
+           ])
+
+METRICS.register_collector(cache_metrics)
+
+@app.route('/metrics')
+def metrics():
+    """Metriche in formato testuale Prometheus"""
+    return app.response_class(METRICS.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/health')
 def health():
     """Health check"""
-    return {'status': 'ok'}, 200
+    return {
+        'status': 'ok',
+        'cache': {
+            'calendars': len(CALENDAR_CACHE),
+            'parsed': len(PARSED_CACHE),
+            'rendered': RENDERED_CACHE.stats(),
+            'download_flights': DOWNLOAD_FLIGHTS.stats(),
+            'parse_flights': PARSE_FLIGHTS.stats(),
+            'sessions': SESSION_STORE.stats(),
+            'prewarm': dict(PREWARM_STATS, tracked=sum(len(s) for s in SERVED_SELECTIONS.values()))
+        },
+        'render_admission': RENDER_LIMITER.stats(),
+        'upstream': {
+            'circuit_breakers': circuit_breaker_stats(),
+            'stale_responses': dict(STALE_RESPONSE_STATS)
+        },
+        'profiling': PROFILER.stats()
+    }, 200
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
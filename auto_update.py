@@ -8,8 +8,10 @@ il calendario sempre aggiornato
 import os
 import sys
 import json
+import logging
 from datetime import datetime, timedelta
 from calendar_manager import UniversityCalendarManager
+from tracing import current_trace, log_event, request_trace
 
 
 def load_config(config_file="calendar_config.json"):
@@ -60,22 +62,43 @@ def auto_update_calendar(calendar_url, force=False, verbose=True):
     Returns:
         True se il calendario è stato aggiornato, False altrimenti
     """
+    # Stesso formato di tracce delle richieste dell'app (download, parsing, filtraggio)
+    with request_trace('auto_update', url=calendar_url, force=force) as trace:
+        updated = _auto_update_calendar(calendar_url, force, verbose)
+        trace.set(updated=updated)
+        return updated
+
+
+def report_status(message, verbose=True, **fields):
+    """Registra un messaggio di stato dell'aggiornamento (solo in modalità dettagliata)"""
     if verbose:
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Controllo aggiornamenti calendario...")
+        log_event(message, **fields)
+
+
+def report_error(message, **fields):
+    """Registra un errore dell'aggiornamento (anche in modalità silenziosa) e lo associa alla traccia"""
+    log_event(message, logging.ERROR, **fields)
+    trace = current_trace()
+    if trace is not None:
+        # Traccia scritta anche se non campionata
+        trace.error = message
+
+
+def _auto_update_calendar(calendar_url, force=False, verbose=True):
+    """Controllo e aggiornamento del calendario (vedi auto_update_calendar)"""
+    report_status("Controllo aggiornamenti calendario", verbose, url=calendar_url)
     
     # Carica la configurazione esistente
     config = load_config()
     
     if not config or not config.get("selected_courses"):
-        if verbose:
-            print("Errore: Nessuna configurazione trovata.")
-            print("Esegui prima: python calendar_manager.py <URL_CALENDARIO>")
+        report_error("Nessuna configurazione trovata: esegui prima "
+                     "python calendar_manager.py <URL_CALENDARIO>")
         return False
     
     # Controlla se è il momento di aggiornare
     if not should_check_for_updates(config, force):
-        if verbose:
-            print("Aggiornamento non necessario (controllato di recente).")
+        report_status("Aggiornamento non necessario (controllato di recente)", verbose)
         return False
     
     # Crea il manager e controlla aggiornamenti
@@ -86,22 +109,20 @@ def auto_update_calendar(calendar_url, force=False, verbose=True):
         # Scarica e verifica il calendario
         calendar_data = manager.download_calendar()
         if not calendar_data:
-            if verbose:
-                print("Errore: Impossibile scaricare il calendario.")
+            report_error("Impossibile scaricare il calendario", url=calendar_url)
             return False
         
         # Calcola l'hash e confronta
         current_hash = manager.calculate_hash(calendar_data)
         
         if config.get("calendar_hash") != current_hash:
-            if verbose:
-                print("Aggiornamento rilevato! Aggiornamento del calendario filtrato...")
+            report_status("Aggiornamento rilevato: aggiornamento del calendario filtrato", verbose,
+                          calendar_hash=current_hash)
             
             # Parsifica e crea il calendario filtrato
             calendar = manager.parse_calendar(calendar_data)
             if not calendar:
-                if verbose:
-                    print("Errore: Impossibile parsificare il calendario.")
+                report_error("Impossibile parsificare il calendario", url=calendar_url)
                 return False
             
             # Crea il calendario filtrato
@@ -118,12 +139,10 @@ def auto_update_calendar(calendar_url, force=False, verbose=True):
             manager.config = config
             manager.save_config()
             
-            if verbose:
-                print("Calendario aggiornato con successo!")
+            report_status("Calendario aggiornato con successo", verbose)
             return True
         else:
-            if verbose:
-                print("Nessun aggiornamento necessario.")
+            report_status("Nessun aggiornamento necessario", verbose)
             
             # Aggiorna solo il timestamp
             config["last_update"] = datetime.now().isoformat()
@@ -132,8 +151,7 @@ def auto_update_calendar(calendar_url, force=False, verbose=True):
             return False
             
     except Exception as e:
-        if verbose:
-            print(f"Errore durante l'aggiornamento: {e}")
+        report_error("Errore durante l'aggiornamento", url=calendar_url, error=str(e))
         return False
 
 
@@ -176,7 +194,7 @@ python auto_update.py "{calendar_url}" >> calendar_update.log 2>&1
         print(f"   */30 * * * * {script_path}")
         
     except Exception as e:
-        print(f"Errore nella creazione dello script cron: {e}")
+        log_event("Errore nella creazione dello script cron", logging.ERROR, error=str(e))
 
 
 def main():
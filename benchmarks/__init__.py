@@ -0,0 +1,4 @@
+"""
+Benchmark del gestore calendario (eseguire dalla cartella del progetto:
+python -m benchmarks.bench_calendar --help)
+"""
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Benchmark delle fasi di elaborazione del calendario
+Misura separatamente parsing, estrazione dei corsi, filtraggio e
+serializzazione su calendari sintetici di varie dimensioni e salva i
+risultati in JSON per confrontare esecuzioni diverse.
+
+Esempio:
+    python -m benchmarks.bench_calendar --events 500 5000 20000 --output bench.json
+    python -m benchmarks.bench_calendar --events 5000 --compare bench.json
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calendar_manager import UniversityCalendarManager
+from benchmarks.synthetic_ics import course_names, generate_calendar
+
+
+def measure(fn: Callable, repeat: int) -> Dict:
+    """
+    Misura una fase: tempi su repeat esecuzioni e picco di memoria su una esecuzione separata
+
+    Returns:
+        Dizionario con 'best_s', 'mean_s' e 'peak_bytes'
+    """
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+
+        # Il tracciamento della memoria rallenta l'esecuzione: non entra nei tempi
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'best_s': min(timings),
+        'mean_s': sum(timings) / len(timings),
+        'peak_bytes': peak
+    }
+
+
+def run_benchmarks(events: int, courses: int, selected: int, repeat: int, seed: int = 0) -> List[Dict]:
+    """
+    Esegue tutte le fasi su un calendario sintetico
+
+    Args:
+        events: Numero di VEVENT del calendario
+        courses: Numero di corsi distinti
+        selected: Numero di corsi selezionati per il filtraggio
+        repeat: Ripetizioni di ogni fase
+        seed: Seme del generatore
+
+    Returns:
+        Un risultato per fase
+    """
+    data = generate_calendar(events=events, courses=courses, seed=seed)
+    selection = course_names(courses, seed)[:selected]
+    manager = UniversityCalendarManager("https://example.com/benchmark.ics")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        calendar = manager.parse_calendar(data)
+        index = manager.build_course_index(calendar)
+        summaries = [str(component.get('summary', '')) for component in calendar.walk('VEVENT')]
+        filtered = manager.create_filtered_calendar(calendar, selection, index)
+        scanned = manager.scan_calendar(data)
+    filtered_events = sum(len(index.get(course, ())) for course in selection)
+
+    # fase -> (funzione, eventi elaborati)
+    stages = {
+        'parse_calendar': (lambda: manager.parse_calendar(data), events),
+        'build_course_index': (lambda: manager.build_course_index(calendar), events),
+        'extract_courses': (lambda: manager.extract_courses(calendar, index), events),
+        'extract_course_name': (
+            lambda: [manager.extract_course_name(summary, '') for summary in summaries], events
+        ),
+        'create_filtered_calendar': (
+            lambda: manager.create_filtered_calendar(calendar, selection, index), filtered_events
+        ),
+        'to_ical': (lambda: filtered.to_ical(), filtered_events),
+        'iter_filtered_calendar': (
+            lambda: b''.join(manager.iter_filtered_calendar(calendar, selection, index)),
+            filtered_events
+        ),
+        'scan_calendar': (lambda: manager.scan_calendar(data), events),
+        'iter_filtered_ics': (
+            lambda: b''.join(manager.iter_filtered_ics(scanned, selection)), filtered_events
+        ),
+    }
+
+    results = []
+    for stage, (fn, processed) in stages.items():
+        result = measure(fn, repeat)
+        results.append({
+            'stage': stage,
+            'events': events,
+            'courses': courses,
+            'selected': len(selection),
+            'processed_events': processed,
+            'input_bytes': len(data.encode('utf-8')),
+            'repeat': repeat,
+            **result,
+            'events_per_s': processed / result['best_s'] if result['best_s'] else None
+        })
+    return results
+
+
+def environment() -> Dict:
+    """Informazioni sull'ambiente di esecuzione, per confrontare i risultati"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'git_commit': commit
+    }
+
+
+def compare(results: List[Dict], baseline: List[Dict]) -> List[str]:
+    """Confronta i tempi migliori con quelli di un'esecuzione precedente"""
+    previous = {(r['stage'], r['events'], r['courses']): r for r in baseline}
+    lines = []
+    for result in results:
+        before = previous.get((result['stage'], result['events'], result['courses']))
+        if before is None:
+            continue
+        speedup = before['best_s'] / result['best_s'] if result['best_s'] else float('inf')
+        lines.append(f"{result['stage']:<26} {result['events']:>7} eventi  "
+                     f"{before['best_s'] * 1000:10.2f} ms -> {result['best_s'] * 1000:10.2f} ms  "
+                     f"x{speedup:.2f}")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del gestore calendario")
+    parser.add_argument('--events', type=int, nargs='+', default=[500, 5000],
+                        help="Numero di VEVENT dei calendari sintetici (più valori: più esecuzioni)")
+    parser.add_argument('--courses', type=int, default=300, help="Numero di corsi distinti")
+    parser.add_argument('--selected', type=int, default=8, help="Corsi selezionati nel filtraggio")
+    parser.add_argument('--repeat', type=int, default=3, help="Ripetizioni di ogni fase")
+    parser.add_argument('--seed', type=int, default=0, help="Seme del generatore")
+    parser.add_argument('--output', help="File JSON dei risultati (altrimenti stdout)")
+    parser.add_argument('--compare', help="File JSON di un'esecuzione precedente da confrontare")
+    args = parser.parse_args(argv)
+
+    results = []
+    for events in args.events:
+        print(f"Calendario sintetico: {events} eventi, {args.courses} corsi", file=sys.stderr)
+        results.extend(run_benchmarks(events, args.courses, args.selected, args.repeat, args.seed))
+
+    report = {'environment': environment(), 'parameters': vars(args), 'results': results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    for result in results:
+        print(f"{result['stage']:<26} {result['events']:>7} eventi  {result['best_s'] * 1000:10.2f} ms  "
+              f"{result['events_per_s'] or 0:12.0f} eventi/s  "
+              f"{result['peak_bytes'] / 1024 / 1024:8.1f} MiB", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        print("\nConfronto con " + args.compare, file=sys.stderr)
+        for line in compare(results, baseline):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+"""
+Test di carico degli endpoint con un server Cineca simulato in locale
+Un server di prova serve calendari sintetici (con latenza, ETag, 304 ed
+errori configurabili); un client concorrente simula N iscritti con
+selezioni di corsi realistiche contro l'app Flask, i gestori serverless
+di api/ oppure un server già avviato (ad esempio gunicorn).
+
+Esempio:
+    python -m benchmarks.load_test --target flask --subscribers 200 --requests 2000
+    python -m benchmarks.load_test --target serverless --latency 0.2 --output load.json
+    python -m benchmarks.load_test --target url --url http://127.0.0.1:5001
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_calendar import environment
+from benchmarks.synthetic_ics import course_names, generate_calendar
+
+
+class StubUpstream:
+    """
+    Server locale che sostituisce Cineca
+
+    Serve /feed/<n>.ics con latenza e tasso di errore configurabili, risponde
+    304 alle richieste condizionali e, se richiesto, pubblica periodicamente
+    una nuova versione (modificando un solo evento).
+    """
+
+    def __init__(self, feeds: int = 2, events: int = 2000, courses: int = 200,
+                 latency: float = 0.05, failure_rate: float = 0.0,
+                 change_every: float = 0, seed: int = 0):
+        self.feeds = feeds
+        self.events = events
+        self.courses = courses
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.change_every = change_every
+        self.seed = seed
+        self.counters = {'requests': 0, 'full': 0, 'not_modified': 0, 'failures': 0, 'bytes': 0}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._versions = {}
+        self._started = time.time()
+        self._base = {i: generate_calendar(events, courses, self.feed_seed(i)) for i in range(feeds)}
+        self._server = None
+
+    def feed_seed(self, feed: int) -> int:
+        """Seme del calendario sintetico di un feed"""
+        return self.seed + feed * 1000
+
+    def feed_courses(self, feed: int) -> List[str]:
+        """Corsi del feed"""
+        return course_names(self.courses, self.feed_seed(feed))
+
+    def feed_url(self, feed: int) -> str:
+        """URL del feed sul server di prova"""
+        return f"http://127.0.0.1:{self._server.server_port}/feed/{feed}.ics"
+
+    def version(self) -> int:
+        """Versione corrente dei calendari"""
+        if not self.change_every:
+            return 0
+        return int((time.time() - self._started) / self.change_every)
+
+    def body(self, feed: int, version: int) -> bytes:
+        """Calendario del feed alla versione data"""
+        key = (feed, version)
+        if key not in self._versions:
+            seconds = version % 86400
+            stamp = f"DTSTAMP:20240901T{seconds // 3600:02d}{seconds // 60 % 60:02d}{seconds % 60:02d}Z"
+            data = self._base[feed].replace('DTSTAMP:20240901T000000Z', stamp, 1)
+            self._versions[key] = data.encode('utf-8')
+        return self._versions[key]
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.counters[key] += value
+
+    def start(self):
+        """Avvia il server in un thread"""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub._count(requests=1)
+                if stub.latency:
+                    time.sleep(stub.latency)
+                try:
+                    feed = int(self.path.rsplit('/', 1)[-1].split('.')[0])
+                except ValueError:
+                    feed = -1
+                if feed not in stub._base:
+                    self.send_error(404)
+                    return
+                with stub._lock:
+                    failed = stub._rng.random() < stub.failure_rate
+                if failed:
+                    stub._count(failures=1)
+                    self.send_error(503)
+                    return
+
+                version = stub.version()
+                etag = f'"{feed}-{version}"'
+                last_modified = formatdate(stub._started + version * (stub.change_every or 0),
+                                           usegmt=True)
+                if self.headers.get('If-None-Match') == etag:
+                    stub._count(not_modified=1)
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                body = stub.body(feed, version)
+                stub._count(full=1, bytes=len(body))
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/calendar; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.send_header('Last-Modified', last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Ferma il server"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self):
+        """Contatori delle richieste ricevute"""
+        with self._lock:
+            return dict(self.counters)
+
+
+def _serve_in_thread(server):
+    """Avvia un server HTTP in un thread e ne restituisce l'URL di base"""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def _no_log(handler, format, *args):
+    """Disattiva il log di ogni richiesta, che falserebbe le latenze misurate"""
+
+
+class FlaskTarget:
+    """App Flask (app.py) avviata in questo processo con il server di sviluppo multi-thread"""
+
+    name = 'flask'
+
+    def __init__(self):
+        import logging
+        import tempfile
+        from werkzeug.serving import make_server
+        import app as app_module
+        from session_store import SessionFileStore
+        # Il log di ogni richiesta falserebbe le latenze misurate
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.app_module = app_module
+        # I file generati da analyze/generate finiscono in una cartella temporanea,
+        # non nella cartella delle sessioni del repository
+        self._session_dir = tempfile.TemporaryDirectory(prefix='load-test-sessions-')
+        store = app_module.SESSION_STORE
+        self._saved = (app_module.UPLOAD_FOLDER, app_module.app.config['UPLOAD_FOLDER'], store)
+        app_module.UPLOAD_FOLDER = self._session_dir.name
+        app_module.app.config['UPLOAD_FOLDER'] = self._session_dir.name
+        app_module.SESSION_STORE = SessionFileStore(
+            self._session_dir.name, max_bytes=store.max_bytes, max_entries=store.max_entries,
+            ttl=store.ttl, sweep_interval=store.sweep_interval
+        )
+        self._server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        self.base_url = _serve_in_thread(self._server)
+        self.endpoints = {name: self.base_url + path for name, path in (
+            ('ical', '/api/ical'),
+            ('analyze', '/api/analyze_calendar'),
+            ('generate', '/api/generate_calendar'),
+        )}
+
+    def cache_stats(self) -> Dict:
+        return requests.get(self.base_url + '/health', timeout=10).json()['cache']
+
+    def stop(self):
+        self._server.shutdown()
+        (self.app_module.UPLOAD_FOLDER, self.app_module.app.config['UPLOAD_FOLDER'],
+         self.app_module.SESSION_STORE) = self._saved
+        self._session_dir.cleanup()
+
+
+class UrlTarget(FlaskTarget):
+    """Server già avviato (ad esempio gunicorn), con le stesse rotte dell'app Flask"""
+
+    name = 'url'
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+        self.endpoints = {name: self.base_url + path for name, path in (
+            ('ical', '/api/ical'),
+            ('analyze', '/api/analyze_calendar'),
+            ('generate', '/api/generate_calendar'),
+        )}
+
+    def stop(self):
+        pass
+
+
+class ServerlessTarget:
+    """Gestori serverless di api/, ciascuno sul proprio server HTTP locale"""
+
+    name = 'serverless'
+
+    def __init__(self):
+        from api import generate_calendar as generate_module
+        from api import ical as ical_module
+        self.ical_module = ical_module
+        self._servers = []
+        urls = {}
+        for module_name, module in (('ical', ical_module), ('generate', generate_module)):
+            quiet_handler = type('QuietHandler', (module.handler,), {'log_message': _no_log})
+            server = ThreadingHTTPServer(('127.0.0.1', 0), quiet_handler)
+            server.daemon_threads = True
+            self._servers.append(server)
+            urls[module_name] = _serve_in_thread(server)
+        # L'analisi è il gestore di generazione senza corsi selezionati
+        self.endpoints = {
+            'ical': urls['ical'] + '/api/ical',
+            'analyze': urls['generate'] + '/api/generate_calendar',
+            'generate': urls['generate'] + '/api/generate_calendar',
+        }
+
+    def cache_stats(self) -> Dict:
+        return {'rendered': self.ical_module.RENDERED_CACHE.stats()}
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+
+
+def zipf_selection(rng: random.Random, courses: List[str], size: int, exponent: float) -> List[str]:
+    """Sceglie size corsi distinti, i più popolari con probabilità maggiore (distribuzione di Zipf)"""
+    weights = [1 / (rank + 1) ** exponent for rank in range(len(courses))]
+    selection = set()
+    while len(selection) < min(size, len(courses)):
+        selection.add(rng.choices(courses, weights)[0])
+    return sorted(selection)
+
+
+def build_subscribers(stub: StubUpstream, count: int, min_courses: int, max_courses: int,
+                      exponent: float, rng: random.Random) -> List[Dict]:
+    """Iscritti simulati: ognuno segue un feed con la sua selezione di corsi"""
+    popular_courses = {}
+    for feed in range(stub.feeds):
+        # Ordine di popolarità diverso per ogni feed, ma riproducibile
+        ranked = stub.feed_courses(feed)
+        random.Random(stub.feed_seed(feed)).shuffle(ranked)
+        popular_courses[feed] = ranked
+
+    subscribers = []
+    for i in range(count):
+        feed = min(int(rng.paretovariate(1.5)) - 1, stub.feeds - 1)
+        selection = zipf_selection(rng, popular_courses[feed],
+                                   rng.randint(min_courses, max_courses), exponent)
+        cfg = json.dumps({'session_id': f'load-{i}', 'url': stub.feed_url(feed), 'corsi': selection},
+                         separators=(',', ':'))
+        subscribers.append({
+            'feed': feed,
+            'url': stub.feed_url(feed),
+            'selection': selection,
+            'cfg': base64.urlsafe_b64encode(cfg.encode('utf-8')).decode('ascii').rstrip('='),
+            'etag': None
+        })
+    return subscribers
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Percentile (interpolazione lineare) di una lista già ordinata"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+class LoadClient:
+    """Client concorrente che registra latenza ed esito di ogni richiesta"""
+
+    def __init__(self, target, subscribers: List[Dict], revalidate: float,
+                 accept_encoding: str, timeout: float):
+        self.target = target
+        self.subscribers = subscribers
+        self.revalidate = revalidate
+        self.accept_encoding = accept_encoding
+        self.timeout = timeout
+        self.samples = []  # (endpoint, secondi, status)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _timed(self, endpoint: str, method: str, url: str, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self._session().request(method, url, timeout=self.timeout, **kwargs)
+            response.content
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 'error'
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.samples.append((endpoint, elapsed, status))
+        return response
+
+    def subscriber_poll(self, subscriber: Dict, rng: random.Random):
+        """Un client di calendario che aggiorna l'iscrizione (spesso con If-None-Match)"""
+        headers = {'Accept-Encoding': self.accept_encoding}
+        if subscriber['etag'] and rng.random() < self.revalidate:
+            headers['If-None-Match'] = subscriber['etag']
+        response = self._timed('ical', 'GET', self.target.endpoints['ical'],
+                               params={'cfg': subscriber['cfg']}, headers=headers)
+        if response is not None and response.headers.get('ETag'):
+            subscriber['etag'] = response.headers['ETag']
+
+    def interactive_session(self, subscriber: Dict):
+        """Il percorso dell'interfaccia web: analisi e generazione del calendario filtrato"""
+        response = self._timed('analyze', 'POST', self.target.endpoints['analyze'],
+                               json={'calendar_url': subscriber['url']})
+        if response is None or response.status_code != 200:
+            return
+        session_id = response.json().get('session_id')
+        self._timed('generate', 'POST', self.target.endpoints['generate'], json={
+            'session_id': session_id,
+            'calendar_url': subscriber['url'],
+            'selected_courses': subscriber['selection']
+        })
+
+    def run(self, operations: int, concurrency: int, interactive: float, seed: int) -> float:
+        """
+        Esegue le operazioni con concurrency richieste in parallelo
+
+        Returns:
+            Durata complessiva in secondi
+        """
+        plan_rng = random.Random(seed)
+        plan = [(plan_rng.choice(self.subscribers), plan_rng.random() < interactive, seed + i)
+                for i in range(operations)]
+
+        def execute(step):
+            subscriber, is_interactive, step_seed = step
+            if is_interactive:
+                self.interactive_session(subscriber)
+            else:
+                self.subscriber_poll(subscriber, random.Random(step_seed))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(execute, plan))
+        return time.perf_counter() - start
+
+    def report(self, duration: float) -> Dict:
+        """Latenze per endpoint (ms), esiti e throughput"""
+        endpoints = {}
+        for name in sorted({endpoint for endpoint, _, _ in self.samples}):
+            samples = [(elapsed, status) for endpoint, elapsed, status in self.samples
+                       if endpoint == name]
+            latencies = sorted(elapsed * 1000 for elapsed, _ in samples)
+            statuses = {}
+            for _, status in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            endpoints[name] = {
+                'requests': len(samples),
+                'status': statuses,
+                'errors': sum(count for status, count in statuses.items()
+                              if status == 'error' or int(status) >= 500),
+                'mean_ms': sum(latencies) / len(latencies),
+                'p50_ms': percentile(latencies, 0.50),
+                'p95_ms': percentile(latencies, 0.95),
+                'p99_ms': percentile(latencies, 0.99),
+                'max_ms': latencies[-1]
+            }
+        return {
+            'duration_s': duration,
+            'requests': len(self.samples),
+            'throughput_rps': len(self.samples) / duration if duration else None,
+            'endpoints': endpoints
+        }
+
+
+def hit_ratios(before: Dict, after: Dict) -> Dict:
+    """Rapporto di successo delle cache nell'intervallo misurato"""
+    ratios = {}
+    rendered_before, rendered_after = before.get('rendered', {}), after.get('rendered', {})
+    hits = rendered_after.get('hits', 0) - rendered_before.get('hits', 0)
+    misses = rendered_after.get('misses', 0) - rendered_before.get('misses', 0)
+    ratios['rendered'] = hits / (hits + misses) if hits + misses else None
+    for flights in ('download_flights', 'parse_flights'):
+        if flights in after:
+            executed = after[flights]['executed'] - before.get(flights, {}).get('executed', 0)
+            coalesced = after[flights]['coalesced'] - before.get(flights, {}).get('coalesced', 0)
+            ratios[flights.replace('_flights', '_coalesced')] = (
+                coalesced / (executed + coalesced) if executed + coalesced else None
+            )
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test di carico degli endpoint del calendario")
+    parser.add_argument('--target', choices=('flask', 'serverless', 'url'), default='flask')
+    parser.add_argument('--url', help="URL di base del server per --target url")
+    parser.add_argument('--subscribers', type=int, default=100, help="Numero di iscritti simulati")
+    parser.add_argument('--requests', type=int, default=1000, help="Numero di operazioni")
+    parser.add_argument('--concurrency', type=int, default=16, help="Richieste in parallelo")
+    parser.add_argument('--interactive', type=float, default=0.05,
+                        help="Frazione di operazioni analisi + generazione (il resto: /api/ical)")
+    parser.add_argument('--revalidate', type=float, default=0.8,
+                        help="Probabilità che un iscritto invii If-None-Match")
+    parser.add_argument('--accept-encoding', default='gzip', help="Accept-Encoding dei client")
+    parser.add_argument('--feeds', type=int, default=2, help="Calendari originali simulati")
+    parser.add_argument('--events', type=int, default=2000, help="VEVENT per calendario")
+    parser.add_argument('--courses', type=int, default=200, help="Corsi per calendario")
+    parser.add_argument('--min-courses', type=int, default=3, help="Corsi minimi per iscritto")
+    parser.add_argument('--max-courses', type=int, default=8, help="Corsi massimi per iscritto")
+    parser.add_argument('--zipf', type=float, default=1.1, help="Esponente della popolarità dei corsi")
+    parser.add_argument('--latency', type=float, default=0.05, help="Latenza del server simulato (s)")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Frazione di risposte 503")
+    parser.add_argument('--change-every', type=float, default=0,
+                        help="Secondi tra due versioni dei calendari (0: mai)")
+    parser.add_argument('--timeout', type=float, default=60, help="Timeout delle richieste (s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="File JSON dei risultati (altrimenti stdout)")
+    args = parser.parse_args(argv)
+
+    if args.target == 'url' and not args.url:
+        parser.error("--target url richiede --url")
+
+    stub = StubUpstream(args.feeds, args.events, args.courses, args.latency,
+                        args.failure_rate, args.change_every, args.seed).start()
+    if args.target == 'flask':
+        target = FlaskTarget()
+    elif args.target == 'serverless':
+        target = ServerlessTarget()
+    else:
+        target = UrlTarget(args.url)
+
+    try:
+        rng = random.Random(args.seed)
+        subscribers = build_subscribers(stub, args.subscribers, args.min_courses,
+                                        args.max_courses, args.zipf, rng)
+        client = LoadClient(target, subscribers, args.revalidate, args.accept_encoding, args.timeout)
+        before = target.cache_stats()
+        duration = client.run(args.requests, args.concurrency, args.interactive, args.seed)
+        after = target.cache_stats()
+    finally:
+        target.stop()
+        stub.stop()
+
+    report = {
+        'environment': environment(),
+        'parameters': vars(args),
+        'target': target.name,
+        **client.report(duration),
+        'upstream': stub.stats(),
+        'cache_hit_ratios': hit_ratios(before, after),
+        'cache': after
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    for name, stats in report['endpoints'].items():
+        print(f"{name:<10} {stats['requests']:>6} richieste  p50 {stats['p50_ms']:8.1f} ms  "
+              f"p95 {stats['p95_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms  "
+              f"errori {stats['errors']}", file=sys.stderr)
+    print(f"throughput {report['throughput_rps']:.1f} richieste/s, "
+          f"richieste al server simulato {report['upstream']['requests']}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Generatore di calendari sintetici in stile Cineca (UNITO)
+Produce feed ICS realistici di dimensione configurabile: corsi nel formato
+"SIGLA - NOME", turni tra parentesi, descrizioni lunghe e righe ripiegate
+secondo la RFC 5545, per misurare i percorsi di parsing e filtraggio.
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+_WORDS = [
+    'ALGORITMI', 'STRUTTURE', 'DATI', 'LINGUAGGI', 'FORMALI', 'TRADUTTORI', 'ANALISI',
+    'MATEMATICA', 'DISCRETA', 'SISTEMI', 'OPERATIVI', 'RETI', 'CALCOLATORI', 'BASI',
+    'PROGRAMMAZIONE', 'FISICA', 'CHIMICA', 'ECONOMIA', 'DIRITTO', 'PRIVATO', 'STATISTICA',
+    'ARCHITETTURA', 'SICUREZZA', 'INTELLIGENZA', 'ARTIFICIALE', 'LOGICA', 'GEOMETRIA'
+]
+_CONNECTORS = ['E', 'DI', 'DEI', 'PER', 'DELLE']
+_ROOMS = ['Aula Magna', 'Aula A', 'Aula B', 'Aula 1', 'Aula 2', 'Laboratorio Dijkstra',
+          'Laboratorio Turing', 'Aula Seminari']
+_BUILDINGS = ['Corso Svizzera 185', 'Via Verdi 8', 'Via Pessinetto 12', 'Palazzo Nuovo']
+
+VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Rome",
+    "BEGIN:STANDARD",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "END:STANDARD",
+    "BEGIN:DAYLIGHT",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "END:DAYLIGHT",
+    "END:VTIMEZONE",
+]
+
+
+def fold_line(line: str, limit: int = 75) -> List[str]:
+    """
+    Ripiega una riga di contenuto a limit ottetti (RFC 5545, sezione 3.1)
+
+    Returns:
+        Righe fisiche; le continuazioni iniziano con uno spazio
+    """
+    raw = line.encode('utf-8')
+    if len(raw) <= limit:
+        return [line]
+
+    lines = []
+    start = 0
+    width = limit
+    while start < len(raw):
+        end = min(start + width, len(raw))
+        # Non spezzare un carattere UTF-8 a metà
+        while end < len(raw) and (raw[end] & 0xC0) == 0x80:
+            end -= 1
+        chunk = raw[start:end].decode('utf-8')
+        lines.append(chunk if not lines else ' ' + chunk)
+        start = end
+        width = limit - 1
+    return lines
+
+
+def _escape(text: str) -> str:
+    """Escape dei valori TEXT"""
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def generate_courses(count: int, rng: random.Random) -> List[str]:
+    """Genera count corsi distinti nel formato "SIGLA - NOME COMPLETO" """
+    courses = []
+    seen = set()
+    while len(courses) < count:
+        words = rng.sample(_WORDS, rng.randint(2, 4))
+        if len(words) > 2:
+            words.insert(rng.randint(1, len(words) - 1), rng.choice(_CONNECTORS))
+        name = ' '.join(words)
+        if name in seen:
+            continue
+        sigla = ''.join(word[0] for word in words if word not in _CONNECTORS)
+        if sigla in seen:
+            sigla = f"{sigla}{len(courses)}"
+        seen.update((sigla, name))
+        courses.append(f"{sigla} - {name}")
+    return courses
+
+
+def generate_calendar(events: int = 5000, courses: int = 200, seed: int = 0,
+                      description_words: int = 40) -> str:
+    """
+    Genera un calendario ICS sintetico in stile Cineca
+
+    Args:
+        events: Numero di VEVENT
+        courses: Numero di corsi distinti
+        seed: Seme del generatore (stesso seme, stesso calendario)
+        description_words: Lunghezza media delle descrizioni, in parole
+
+    Returns:
+        Calendario ICS (righe CRLF, ripiegate a 75 ottetti)
+    """
+    rng = random.Random(seed)
+    course_names = generate_courses(courses, rng)
+    start_of_term = datetime(2024, 9, 23, 8, 0)
+    stamp = '20240901T000000Z'
+
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Cineca//University Planner//IT",
+        "CALSCALE:GREGORIAN",
+        "X-WR-CALNAME:Calendario lezioni",
+        "X-WR-TIMEZONE:Europe/Rome",
+    ]
+    lines.extend(VTIMEZONE)
+
+    for i in range(events):
+        course = course_names[i % courses]
+        start = start_of_term + timedelta(days=rng.randint(0, 110), hours=rng.randint(0, 9))
+        end = start + timedelta(hours=rng.choice((1, 2, 3)))
+        summary = course
+        if rng.random() < 0.4:
+            summary += f" (Turno {rng.choice('ABC')}, T{rng.randint(1, 4)})"
+        location = f"{rng.choice(_ROOMS)}, {rng.choice(_BUILDINGS)}"
+        description = ' '.join(
+            rng.choice(_WORDS).lower() for _ in range(rng.randint(description_words // 2,
+                                                                   description_words * 3 // 2))
+        )
+        description = f"Docente: Prof. {rng.choice(_WORDS).title()}\nNote: {description} - più info sul portale"
+
+        event = [
+            "BEGIN:VEVENT",
+            f"UID:{i:08d}-{seed}@unito.cineca.it",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;TZID=Europe/Rome:{start:%Y%m%dT%H%M%S}",
+            f"DTEND;TZID=Europe/Rome:{end:%Y%m%dT%H%M%S}",
+            f"SUMMARY:{_escape(summary)}",
+            f"LOCATION:{_escape(location)}",
+            f"DESCRIPTION:{_escape(description)}",
+            "STATUS:CONFIRMED",
+            "END:VEVENT",
+        ]
+        for line in event:
+            lines.extend(fold_line(line))
+
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def course_names(courses: int = 200, seed: int = 0) -> List[str]:
+    """Corsi del calendario generato con gli stessi parametri (senza generarlo)"""
+    return generate_courses(courses, random.Random(seed))
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Cache in memoria dei calendari filtrati già serializzati
+Evita di ripetere parsing, filtraggio e serializzazione per le
+combinazioni di corsi richieste più spesso dagli iscritti.
+"""
+
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Brotli è opzionale: senza il modulo vengono prodotte solo le varianti gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Codifiche precompresse disponibili, in ordine di preferenza
+SUPPORTED_ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def canonical_selection(selected_courses: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Restituisce la forma canonica di una selezione di corsi
+
+    Args:
+        selected_courses: Lista dei corsi selezionati (anche con duplicati)
+
+    Returns:
+        Tupla ordinata e senza duplicati, utilizzabile come chiave
+    """
+    return tuple(sorted(set(selected_courses)))
+
+
+def calendar_etag(calendar_hash: str, selection: Tuple[str, ...]) -> str:
+    """
+    Calcola il validatore (ETag) di un calendario filtrato
+
+    Dipende solo dalla versione del calendario originale e dalla selezione
+    canonica, quindi è noto prima di parsificare o serializzare.
+    """
+    key = calendar_hash + '\n' + '\n'.join(selection)
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def variant_etag(etag: str, encoding: str) -> str:
+    """ETag di una variante compressa (rappresentazioni diverse hanno ETag diversi)"""
+    return etag if encoding == 'identity' else f'{etag}-{encoding}'
+
+
+def compress_variants(data: bytes) -> Dict[str, bytes]:
+    """
+    Produce le varianti precompresse di un calendario serializzato
+
+    Returns:
+        Dizionario codifica -> byte ('identity', 'gzip' e, se disponibile, 'br')
+    """
+    variants = {
+        'identity': data,
+        'gzip': gzip.compress(data, compresslevel=9, mtime=0)
+    }
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=9)
+    return variants
+
+
+def choose_encoding(accept_encoding: Optional[str], available: Iterable[str]) -> str:
+    """
+    Sceglie la variante da inviare in base all'intestazione Accept-Encoding
+
+    Args:
+        accept_encoding: Valore di Accept-Encoding della richiesta
+        available: Codifiche disponibili
+
+    Returns:
+        'br', 'gzip' oppure 'identity'
+    """
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+
+    best, best_weight = 'identity', 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if encoding in available and weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class RenderedCalendar:
+    """
+    Calendario filtrato serializzato, con le sue varianti precompresse
+
+    Conserva i validatori (ETag e Last-Modified) con cui è stato servito la
+    prima volta: restano invariati finché i byte non cambiano, anche tra
+    versioni diverse del calendario originale.
+    """
+
+    __slots__ = ('variants', 'size', 'etag', 'last_modified')
+
+    def __init__(self, variants: Dict[str, bytes], etag: Optional[str] = None,
+                 last_modified: Optional[float] = None):
+        self.variants = variants
+        self.size = sum(len(body) for body in variants.values())
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @classmethod
+    def from_ics(cls, data: bytes, etag: Optional[str] = None,
+                 last_modified: Optional[float] = None) -> 'RenderedCalendar':
+        """Crea il calendario comprimendo una volta sola i byte ICS"""
+        return cls(compress_variants(data), etag, last_modified)
+
+    def __len__(self):
+        return self.size
+
+
+class RenderedCalendarCache:
+    """
+    Cache LRU dei calendari filtrati, limitata per dimensione totale
+
+    I valori sono byte ICS o RenderedCalendar (la dimensione conta tutte le varianti).
+
+    Le voci sono indicizzate da (hash del calendario originale, selezione
+    canonica): quando il calendario originale cambia, le voci della
+    versione precedente vengono invalidate.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: Dimensione massima complessiva delle voci in cache
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rekeyed = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, calendar_hash: str, selection: Tuple[str, ...]):
+        """Restituisce il valore in cache per la chiave data, o None"""
+        key = (calendar_hash, selection)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, calendar_hash: str, selection: Tuple[str, ...], data):
+        """Salva il calendario serializzato, eliminando le voci meno recenti se necessario"""
+        if len(data) > self.max_bytes:
+            return
+
+        key = (calendar_hash, selection)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.total_bytes -= len(previous)
+
+            self._entries[key] = data
+            self.total_bytes += len(data)
+
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, calendar_hash: str) -> int:
+        """
+        Elimina tutte le voci relative a una versione del calendario originale
+
+        Returns:
+            Numero di voci eliminate
+        """
+        with self._lock:
+            stale_keys = [key for key in self._entries if key[0] == calendar_hash]
+            for key in stale_keys:
+                self.total_bytes -= len(self._entries.pop(key))
+            return len(stale_keys)
+
+    def selections(self, calendar_hash: str) -> List[Tuple[str, ...]]:
+        """Selezioni in cache per una versione del calendario originale"""
+        with self._lock:
+            return [key[1] for key in self._entries if key[0] == calendar_hash]
+
+    def rekey(self, old_hash: str, new_hash: str,
+              keep: Callable[[Tuple[str, ...]], bool]) -> int:
+        """
+        Sposta alla nuova versione del calendario originale le voci ancora valide
+
+        Args:
+            old_hash: Hash della versione precedente
+            new_hash: Hash della nuova versione
+            keep: Restituisce True per le selezioni i cui byte non cambiano
+
+        Returns:
+            Numero di voci spostate (le altre della versione precedente vengono eliminate)
+        """
+        with self._lock:
+            moved = 0
+            for key in [key for key in self._entries if key[0] == old_hash]:
+                data = self._entries.pop(key)
+                new_key = (new_hash, key[1])
+                if keep(key[1]) and new_key not in self._entries:
+                    self._entries[new_key] = data
+                    moved += 1
+                else:
+                    self.total_bytes -= len(data)
+            self.rekeyed += moved
+            return moved
+
+    def clear(self):
+        """Svuota la cache"""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """Statistiche di utilizzo della cache"""
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'rekeyed': self.rekeyed
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Flight:
+    """Chiamata in corso condivisa tra più richiedenti"""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Raggruppa le chiamate concorrenti con la stessa chiave
+
+    Solo il primo richiedente esegue la funzione; gli altri attendono e
+    ricevono lo stesso risultato (o la stessa eccezione), al più fino alla
+    propria scadenza.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self.timed_out = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, wait_until: Optional[float] = None, **kwargs):
+        """
+        Esegue fn(*args, **kwargs) una sola volta per le chiamate concorrenti con la stessa chiave
+
+        Args:
+            wait_until: Scadenza (time.monotonic()) dell'attesa di una chiamata già in corso
+
+        Raises:
+            TimeoutError: Se la chiamata in corso non termina entro wait_until
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            timeout = None if wait_until is None else max(0.0, wait_until - time.monotonic())
+            if not flight.event.wait(timeout):
+                with self._lock:
+                    self.timed_out += 1
+                raise TimeoutError(f'Chiamata in corso non terminata entro la scadenza: {key}')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def stats(self):
+        """Contatori di chiamate eseguite, raggruppate e scadute in attesa"""
+        return {'executed': self.executed, 'coalesced': self.coalesced, 'timed_out': self.timed_out}
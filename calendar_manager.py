@@ -9,13 +9,285 @@ import requests
 import json
 import os
 import hashlib
+import re
+import sys
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional, Iterator, Tuple
+from urllib.parse import urlparse
 from icalendar import Calendar, Event
+from icalendar.prop import vDDDTypes
+from requests.adapters import HTTPAdapter
+from requests.compat import chardet
 import pickle
 
+import logging
+
+from metrics import UPSTREAM_BYTES, UPSTREAM_RESPONSES
+from resilience import CircuitBreaker
+from tracing import log_event, record_stage, stage
+
+
+# Sessione HTTP condivisa: riusa le connessioni (e gli handshake TLS) tra i download
+_HTTP_SESSION = None
+_HTTP_SESSION_LOCK = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Restituisce la sessione HTTP condivisa, creandola alla prima chiamata"""
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None:
+        with _HTTP_SESSION_LOCK:
+            if _HTTP_SESSION is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _HTTP_SESSION = session
+    return _HTTP_SESSION
+
+
+# Tempi massimi del download, ben sotto il timeout dei worker di gunicorn (30 secondi):
+# connessione e singola lettura, e durata complessiva (anche senza scadenza della richiesta)
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 15))
+UPSTREAM_TOTAL_TIMEOUT = float(os.environ.get('UPSTREAM_TOTAL_TIMEOUT', 20))
+# Budget minimo (secondi) per iniziare un download entro la scadenza della richiesta
+UPSTREAM_MIN_BUDGET = 0.5
+# Blocchi piccoli: la scadenza complessiva viene controllata dopo ogni blocco
+UPSTREAM_CHUNK_SIZE = 16 * 1024
+
+# Interruttori per server remoto: dopo UPSTREAM_FAILURE_THRESHOLD errori consecutivi
+# del server (connessione fallita o timeout) i download verso quel server vengono
+# rifiutati subito per UPSTREAM_RESET_TIMEOUT secondi. Le risposte di errore (es. 5xx)
+# riguardano il singolo calendario: più calendari condividono lo stesso server
+# e un calendario rotto non deve bloccare gli altri
+UPSTREAM_FAILURE_THRESHOLD = int(os.environ.get('UPSTREAM_FAILURE_THRESHOLD', 5))
+UPSTREAM_RESET_TIMEOUT = float(os.environ.get('UPSTREAM_RESET_TIMEOUT', 60))
+_CIRCUIT_BREAKERS: Dict[str, CircuitBreaker] = {}
+_CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """Restituisce l'interruttore del server di url, creandolo alla prima chiamata"""
+    host = urlparse(url).netloc.lower()
+    with _CIRCUIT_BREAKERS_LOCK:
+        breaker = _CIRCUIT_BREAKERS.get(host)
+        if breaker is None:
+            breaker = _CIRCUIT_BREAKERS[host] = CircuitBreaker(
+                UPSTREAM_FAILURE_THRESHOLD, UPSTREAM_RESET_TIMEOUT)
+        return breaker
+
+
+def circuit_breaker_stats() -> Dict[str, dict]:
+    """Stato e contatori degli interruttori, per server remoto"""
+    with _CIRCUIT_BREAKERS_LOCK:
+        breakers = dict(_CIRCUIT_BREAKERS)
+    return {host: breaker.stats() for host, breaker in breakers.items()}
+
+
+class UpstreamDeadlineExceeded(requests.Timeout):
+    """Download non completato entro la scadenza complessiva"""
+
+
+def upstream_deadline(deadline: Optional[float] = None) -> float:
+    """
+    Scadenza complessiva del download
+
+    Args:
+        deadline: Scadenza della richiesta (time.monotonic()), o None
+
+    Returns:
+        La più vicina tra la scadenza della richiesta e UPSTREAM_TOTAL_TIMEOUT da ora
+    """
+    limit = time.monotonic() + UPSTREAM_TOTAL_TIMEOUT
+    return limit if deadline is None else min(deadline, limit)
+
+
+def upstream_timeout(deadline: float) -> Optional[Tuple[float, float]]:
+    """
+    Timeout (connessione, lettura) del download, limitati dal tempo rimasto
+
+    requests li applica a ogni singola operazione sul socket: la durata
+    complessiva è controllata da read_upstream_body.
+
+    Args:
+        deadline: Scadenza complessiva del download (time.monotonic())
+
+    Returns:
+        Coppia di timeout, o None se il tempo rimasto non basta per un download
+    """
+    remaining = deadline - time.monotonic()
+    if remaining < UPSTREAM_MIN_BUDGET:
+        return None
+    return (min(UPSTREAM_CONNECT_TIMEOUT, remaining), min(UPSTREAM_READ_TIMEOUT, remaining))
+
+
+def read_upstream_body(response: requests.Response, deadline: float) -> bytes:
+    """
+    Legge a blocchi il corpo di una risposta in streaming entro la scadenza complessiva
+
+    Un server che invia i dati molto lentamente non può superare la scadenza
+    (oltre la lettura di un blocco) anche se ogni lettura rispetta il timeout.
+
+    Raises:
+        UpstreamDeadlineExceeded: Se la scadenza viene superata
+    """
+    chunks = []
+    for chunk in response.iter_content(UPSTREAM_CHUNK_SIZE):
+        chunks.append(chunk)
+        if time.monotonic() > deadline:
+            raise UpstreamDeadlineExceeded(f'Download non completato entro la scadenza: {response.url}')
+    return b''.join(chunks)
+
+
+def decode_upstream_body(response: requests.Response, content: bytes) -> str:
+    """Decodifica il corpo come response.text (codifica dalle intestazioni, altrimenti rilevata)"""
+    encoding = response.encoding or chardet.detect(content)['encoding'] or 'utf-8'
+    try:
+        return str(content, encoding, errors='replace')
+    except LookupError:
+        return str(content, 'utf-8', errors='replace')
+
+
+# Scanner veloce: individua i blocchi VEVENT nel testo senza costruire l'albero icalendar
+_VEVENT_RE = re.compile(r'^BEGIN:VEVENT\r?\n.*?^END:VEVENT\r?$\n?', re.M | re.S)
+_FOLDED_LINE_RE = re.compile(r'\r?\n[ \t]')
+_TEXT_ESCAPE_RE = re.compile(r'\\([\\;,nN])')
+_SCANNED_PROPERTIES = ('SUMMARY', 'UID', 'LOCATION', 'DTSTART', 'DTEND')
+
+# Intestazione e chiusura dei calendari filtrati (come prodotti da create_filtered_calendar)
+FILTERED_CALENDAR_HEADER = (b'BEGIN:VCALENDAR\r\nVERSION:2.0\r\n'
+                            b'PRODID:-//CalendarUni//Filtered Calendar//EN\r\n')
+FILTERED_CALENDAR_FOOTER = b'END:VCALENDAR\r\n'
+
+
+class EventRecord:
+    """
+    Evento di un corso in forma compatta
+
+    Conserva solo i campi necessari (senza il componente icalendar, così
+    l'albero del calendario può essere liberato); corso, summary e luogo,
+    ripetuti su molti eventi, sono stringhe internate.
+    """
+
+    __slots__ = ('course', 'summary', 'description', 'location', 'start', 'end')
+
+    def __init__(self, course: str, summary: str, description: str, location: str, start, end):
+        self.course = sys.intern(course)
+        self.summary = sys.intern(summary)
+        self.description = description
+        self.location = sys.intern(location)
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"EventRecord({self.course!r}, {self.start!r})"
+
+
+class ScannedEvent:
+    """Evento letto dallo scanner veloce: solo le proprietà necessarie e i byte originali"""
+
+    __slots__ = ('uid', 'summary', 'location', 'dtstart', 'dtend', 'raw')
+
+    def __init__(self, raw: bytes):
+        self.uid = ''
+        self.summary = ''
+        self.location = ''
+        self.dtstart = None
+        self.dtend = None
+        self.raw = raw
+
+
+class ScannedCalendar:
+    """Calendario letto dallo scanner veloce, con l'indice dei corsi"""
+
+    __slots__ = ('events', 'index')
+
+    def __init__(self, events: List[ScannedEvent], index: Dict[str, List[ScannedEvent]]):
+        self.events = events
+        self.index = index
+
+
+def _split_content_line(line: str):
+    """Divide una content line ICS in (nome, parametri, valore)"""
+    head, sep, value = line.partition(':')
+    if '"' in head:
+        # I parametri tra virgolette possono contenere ':'
+        in_quotes = False
+        for i, char in enumerate(line):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif char == ':' and not in_quotes:
+                head, sep, value = line[:i], ':', line[i + 1:]
+                break
+    if not sep:
+        return None, '', ''
+    name, _, params = head.partition(';')
+    return name.upper(), params, value
+
+
+def _unescape_text(value: str) -> str:
+    """Rimuove gli escape dei valori TEXT (\\, \\; \\n \\\\)"""
+    return _TEXT_ESCAPE_RE.sub(
+        lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value
+    )
+
+
+def _component_datetime(component, name):
+    """DTSTART/DTEND di un componente parsificato nella forma dello scanner (parametri, valore)"""
+    prop = component.get(name)
+    if prop is None:
+        return None
+    tzid = prop.params.get('TZID')
+    return f'TZID={tzid}' if tzid else '', prop.to_ical().decode('utf-8')
+
+
+def _scanned_datetime(raw_value):
+    """Converte un DTSTART/DTEND letto dallo scanner in date/datetime"""
+    if raw_value is None:
+        return None
+    params, value = raw_value
+    tzid = None
+    for param in params.split(';'):
+        key, _, param_value = param.partition('=')
+        if key.upper() == 'TZID':
+            tzid = param_value.strip('"')
+    try:
+        return vDDDTypes.from_ical(value, timezone=tzid)
+    except Exception:
+        return vDDDTypes.from_ical(value)
+
+
+def iter_merged_calendar(parts) -> Iterator[bytes]:
+    """
+    Genera a blocchi un unico calendario con gli eventi di più calendari filtrati
+
+    Args:
+        parts: Terne (manager, indice dei corsi, selezione canonica), una per calendario
+
+    Yields:
+        Intestazione VCALENDAR, un blocco per ogni VEVENT (senza UID ripetuti), chiusura
+    """
+    yield FILTERED_CALENDAR_HEADER
+    seen = set()
+    for manager, course_index, selection in parts:
+        for uid, event in manager.iter_selected_events(course_index, selection):
+            if uid:
+                if uid in seen:
+                    continue
+                seen.add(uid)
+            yield event
+    yield FILTERED_CALENDAR_FOOTER
+
 
 class UniversityCalendarManager:
+    # Ultimo contenuto scaricato per ogni URL con i suoi validatori (ETag / Last-Modified),
+    # condivisi tra le istanze per fare richieste condizionali e servire l'ultima copia valida
+    _upstream_state: Dict[str, Dict] = {}
+    _upstream_state_lock = threading.Lock()
+
     def __init__(self, calendar_url: str, config_file: str = "calendar_config.json"):
         """
         Inizializza il gestore del calendario universitario
@@ -29,6 +301,9 @@ class UniversityCalendarManager:
         self.cache_file = "calendar_cache.pkl"
         self.filtered_calendar_file = "filtered_calendar.ics"
         
+        # Esito dell'ultimo download (hash, validatori, se non modificato)
+        self.last_download = None
+        
         # Carica la configurazione esistente
         self.config = self.load_config()
         
@@ -54,21 +329,128 @@ class UniversityCalendarManager:
         with open(self.config_file, 'w', encoding='utf-8') as f:
             json.dump(self.config, f, indent=2, ensure_ascii=False)
     
-    def download_calendar(self) -> str:
+    def download_calendar(self, deadline: Optional[float] = None) -> str:
         """
         Scarica il calendario dall'URL fornito
         
+        Se il server ha già fornito ETag o Last-Modified per questo URL,
+        la richiesta è condizionale: con una risposta 304 viene restituito
+        il contenuto già scaricato, senza trasferirlo né ricalcolarne l'hash.
+        Con l'interruttore del server aperto (troppi errori consecutivi) o
+        senza tempo sufficiente entro la scadenza il download non viene tentato;
+        il download dura al più UPSTREAM_TOTAL_TIMEOUT secondi (o fino alla scadenza).
+        L'esito è disponibile in self.last_download.
+        
+        Args:
+            deadline: Scadenza della richiesta (time.monotonic()); limita il download
+        
         Returns:
-            Contenuto del calendario come stringa
+            Contenuto del calendario come stringa, o None
         """
+        breaker = get_circuit_breaker(self.calendar_url)
+        deadline = upstream_deadline(deadline)
+        timeout = upstream_timeout(deadline)
+        if timeout is None:
+            UPSTREAM_RESPONSES.inc(status='deadline')
+            log_event("Download del calendario saltato: tempo esaurito", logging.WARNING,
+                      url=self.calendar_url)
+            return None
+        if not breaker.allow():
+            UPSTREAM_RESPONSES.inc(status='circuit_open')
+            log_event("Download del calendario saltato: interruttore aperto", logging.WARNING,
+                      url=self.calendar_url)
+            return None
+
         try:
-            print(f"Scaricando calendario da: {self.calendar_url}")
-            response = requests.get(self.calendar_url, timeout=30)
-            response.raise_for_status()
-            return response.text
+            with self._upstream_state_lock:
+                cached = self._upstream_state.get(self.calendar_url)
+
+            headers = {}
+            if cached:
+                if cached.get('etag'):
+                    headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'):
+                    headers['If-Modified-Since'] = cached['last_modified']
+
+            with stage('download', url=self.calendar_url, conditional=bool(headers)) as download:
+                response = get_http_session().get(self.calendar_url, headers=headers,
+                                                  timeout=timeout, stream=True)
+                try:
+                    download.set(status=response.status_code)
+                    UPSTREAM_RESPONSES.inc(status=response.status_code)
+                    response.raise_for_status()
+                    content = b'' if response.status_code == 304 else read_upstream_body(response, deadline)
+                finally:
+                    response.close()
+            breaker.record_success()
+
+            if response.status_code == 304 and cached:
+                self.last_download = dict(cached, not_modified=True)
+                return cached['data']
+
+            calendar_data = decode_upstream_body(response, content)
+            UPSTREAM_BYTES.inc(len(content))
+            download.set(bytes=len(content))
+
+            with stage('hash'):
+                calendar_hash = self.calculate_hash(calendar_data)
+            state = {
+                'data': calendar_data,
+                'hash': calendar_hash,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
+            # Ultimo contenuto valido, anche senza validatori: serve come copia
+            # non aggiornata se i download successivi falliscono
+            with self._upstream_state_lock:
+                self._upstream_state[self.calendar_url] = state
+
+            self.last_download = dict(state, not_modified=False)
+            return calendar_data
         except requests.RequestException as e:
-            print(f"Errore durante il download del calendario: {e}")
+            response = getattr(e, 'response', None)
+            # Contano per l'interruttore solo timeout ed errori di connessione: se il
+            # server ha risposto (anche con 5xx per questo calendario) è raggiungibile
+            if response is None:
+                breaker.record_failure()
+                if not isinstance(e, UpstreamDeadlineExceeded):
+                    UPSTREAM_RESPONSES.inc(status='error')
+            else:
+                breaker.record_success()
+            log_event("Errore durante il download del calendario", logging.WARNING,
+                      url=self.calendar_url, error=str(e))
+            return None
+        finally:
+            # Richiesta di prova terminata senza esito (eccezione inattesa): la libera
+            breaker.release_trial()
+    
+    def last_good_calendar(self) -> Optional[str]:
+        """
+        Ultimo contenuto scaricato con successo per questo URL, o None
+
+        Usato per servire una copia non aggiornata quando il download fallisce.
+        """
+        with self._upstream_state_lock:
+            cached = self._upstream_state.get(self.calendar_url)
+        if cached is None:
             return None
+        self.last_download = dict(cached, not_modified=True)
+        return cached['data']
+    
+    def remember_upstream(self, calendar_data: str, calendar_hash: str,
+                          etag: str = None, last_modified: str = None):
+        """
+        Registra un contenuto già scaricato (es. da un altro processo) e i suoi validatori,
+        così il prossimo download di questo URL può essere condizionale e, se fallisce,
+        resta disponibile l'ultima copia valida
+        """
+        with self._upstream_state_lock:
+            self._upstream_state[self.calendar_url] = {
+                'data': calendar_data,
+                'hash': calendar_hash,
+                'etag': etag,
+                'last_modified': last_modified
+            }
     
     def parse_calendar(self, calendar_data: str) -> Calendar:
         """
@@ -81,48 +463,301 @@ class UniversityCalendarManager:
             Oggetto Calendar parsificato
         """
         try:
-            return Calendar.from_ical(calendar_data)
+            with stage('parse', bytes=len(calendar_data)):
+                return Calendar.from_ical(calendar_data)
         except Exception as e:
-            print(f"Errore durante il parsing del calendario: {e}")
+            log_event("Errore durante il parsing del calendario", logging.WARNING,
+                      url=self.calendar_url, error=str(e))
             return None
     
-    def extract_courses(self, calendar: Calendar) -> Dict[str, List[Dict]]:
+    def scan_calendar(self, calendar_data: str) -> Optional[ScannedCalendar]:
+        """
+        Legge il calendario con lo scanner veloce
+        
+        Individua i blocchi VEVENT, ne ricompone le righe spezzate ed estrae
+        solo SUMMARY, UID, LOCATION, DTSTART e DTEND, conservando i byte
+        originali dell'evento per riusarli nei calendari filtrati.
+        Calendar.from_ical (parse_calendar) resta il percorso completo.
+        
+        Args:
+            calendar_data: Dati del calendario in formato stringa
+            
+        Returns:
+            ScannedCalendar con eventi e indice dei corsi, oppure None
+        """
+        if 'BEGIN:VCALENDAR' not in calendar_data:
+            log_event("Errore durante la scansione del calendario: VCALENDAR mancante",
+                      logging.WARNING, url=self.calendar_url)
+            return None
+        
+        # La scansione costruisce anche l'indice dei corsi: conta come parsing
+        start = time.perf_counter()
+        events = []
+        index = {}
+        
+        for match in _VEVENT_RE.finditer(calendar_data):
+            raw = match.group(0)
+            if '\r\n' not in raw:
+                raw = raw.replace('\n', '\r\n')
+            if not raw.endswith('\n'):
+                raw += '\r\n'
+            event = ScannedEvent(raw.encode('utf-8'))
+            
+            # Solo le proprietà dell'evento, non quelle dei sotto-componenti (es. VALARM)
+            depth = 0
+            for line in _FOLDED_LINE_RE.sub('', match.group(0)).splitlines():
+                if line.startswith('BEGIN:'):
+                    depth += 1
+                elif line.startswith('END:'):
+                    depth -= 1
+                elif depth == 1 and line.startswith(_SCANNED_PROPERTIES):
+                    name, params, value = _split_content_line(line)
+                    if name == 'SUMMARY':
+                        event.summary = _unescape_text(value)
+                    elif name == 'UID':
+                        event.uid = value
+                    elif name == 'LOCATION':
+                        event.location = _unescape_text(value)
+                    elif name == 'DTSTART':
+                        event.dtstart = (params, value)
+                    elif name == 'DTEND':
+                        event.dtend = (params, value)
+            
+            events.append(event)
+            course_name = sys.intern(self.extract_course_name(event.summary, ''))
+            if course_name not in index:
+                index[course_name] = []
+            index[course_name].append(event)
+        
+        record_stage('parse', time.perf_counter() - start, bytes=len(calendar_data),
+                     events=len(events), scanner=True)
+        return ScannedCalendar(events, index)
+    
+    def compact_calendar(self, calendar: Calendar) -> ScannedCalendar:
+        """
+        Converte il calendario parsificato nella forma compatta dello scanner veloce
+        
+        Ogni VEVENT viene serializzato una volta sola e conservato come byte, con
+        le sole proprietà usate per indice e corsi: l'albero icalendar (componenti,
+        proprietà, fusi orari) può essere liberato subito dopo.
+        
+        Args:
+            calendar: Oggetto Calendar (vedi parse_calendar)
+            
+        Returns:
+            ScannedCalendar con eventi e indice dei corsi, come scan_calendar
+        """
+        start = time.perf_counter()
+        events = []
+        index = {}
+        
+        for component in calendar.walk('VEVENT'):
+            event = ScannedEvent(component.to_ical())
+            event.uid = str(component.get('uid', ''))
+            event.summary = str(component.get('summary', ''))
+            event.location = sys.intern(str(component.get('location', '')))
+            event.dtstart = _component_datetime(component, 'dtstart')
+            event.dtend = _component_datetime(component, 'dtend')
+            
+            events.append(event)
+            course_name = sys.intern(self.extract_course_name(event.summary, ''))
+            if course_name not in index:
+                index[course_name] = []
+            index[course_name].append(event)
+        
+        # Costruisce l'indice serializzando gli eventi: conta come indicizzazione
+        record_stage('index', time.perf_counter() - start, courses=len(index), events=len(events))
+        return ScannedCalendar(events, index)
+    
+    def extract_scanned_courses(self, scanned: ScannedCalendar) -> Dict[str, List[EventRecord]]:
+        """
+        Estrae i corsi da un calendario letto con lo scanner veloce
+        
+        Args:
+            scanned: Calendario restituito da scan_calendar
+            
+        Returns:
+            Dizionario con i corsi e i relativi eventi
+        """
+        courses = {}
+        for course_name, events in scanned.index.items():
+            courses[course_name] = [
+                EventRecord(
+                    course_name,
+                    event.summary,
+                    '',
+                    event.location,
+                    _scanned_datetime(event.dtstart),
+                    _scanned_datetime(event.dtend)
+                )
+                for event in events
+            ]
+        return courses
+    
+    def iter_filtered_ics(self, scanned: ScannedCalendar,
+                          selected_courses: List[str]) -> Iterator[bytes]:
+        """
+        Genera il calendario filtrato a blocchi, riusando i byte originali degli eventi
+        
+        Args:
+            scanned: Calendario restituito da scan_calendar
+            selected_courses: Lista dei corsi da includere
+            
+        Yields:
+            Intestazione VCALENDAR, un blocco per ogni VEVENT, chiusura
+        """
+        yield FILTERED_CALENDAR_HEADER
+        
+        # Gli eventi non vengono riserializzati: tutto il tempo è filtraggio
+        # (escluso il tempo in cui il chiamante consuma i blocchi)
+        events_added = 0
+        elapsed = 0.0
+        start = time.perf_counter()
+        for course_name in sorted(set(selected_courses)):
+            for event in scanned.index.get(course_name, ()):
+                elapsed += time.perf_counter() - start
+                yield event.raw
+                start = time.perf_counter()
+                events_added += 1
+        elapsed += time.perf_counter() - start
+        record_stage('filter', elapsed, events=events_added)
+        
+        yield FILTERED_CALENDAR_FOOTER
+    
+    def create_filtered_ics(self, scanned: ScannedCalendar,
+                            selected_courses: List[str]) -> bytes:
+        """
+        Crea il calendario filtrato riusando i byte originali degli eventi
+        
+        Args:
+            scanned: Calendario restituito da scan_calendar
+            selected_courses: Lista dei corsi da includere
+            
+        Returns:
+            Calendario filtrato serializzato in formato ICS
+        """
+        return b''.join(self.iter_filtered_ics(scanned, selected_courses))
+    
+    def iter_selected_events(self, course_index: Dict[str, list],
+                             selected_courses: List[str]) -> Iterator[Tuple[str, bytes]]:
+        """
+        Genera gli eventi serializzati dei corsi selezionati, con il loro UID
+        
+        Args:
+            course_index: Indice dei corsi (componenti VEVENT o eventi dello scanner veloce)
+            selected_courses: Lista dei corsi da includere
+            
+        Yields:
+            Coppie (UID, byte del VEVENT) nello stesso ordine del calendario filtrato
+        """
+        serialize_time = 0.0
+        for course_name in sorted(set(selected_courses)):
+            for event in course_index.get(course_name, ()):
+                if isinstance(event, ScannedEvent):
+                    yield event.uid, event.raw
+                else:
+                    start = time.perf_counter()
+                    data = event.to_ical()
+                    serialize_time += time.perf_counter() - start
+                    yield str(event.get('uid', '')), data
+        record_stage('serialize', serialize_time)
+    
+    def build_course_index(self, calendar: Calendar) -> Dict[str, List[Event]]:
+        """
+        Costruisce l'indice dei corsi del calendario
+        
+        Args:
+            calendar: Oggetto Calendar
+            
+        Returns:
+            Dizionario nome corso -> eventi (componenti VEVENT) in ordine di calendario
+        """
+        start = time.perf_counter()
+        index = {}
+        
+        for component in calendar.walk('VEVENT'):
+            summary = str(component.get('summary', ''))
+            course_name = sys.intern(self.extract_course_name(summary, ''))
+            
+            if course_name not in index:
+                index[course_name] = []
+            index[course_name].append(component)
+        
+        record_stage('index', time.perf_counter() - start, courses=len(index))
+        return index
+    
+    def event_fingerprints(self, course_index: Dict[str, list]) -> Dict[str, Tuple[Tuple[str, str], ...]]:
+        """
+        Calcola l'impronta degli eventi di ogni corso
+        
+        Args:
+            course_index: Indice dei corsi (componenti VEVENT o eventi dello scanner veloce)
+            
+        Returns:
+            Dizionario nome corso -> coppie (UID, hash del contenuto del VEVENT)
+            nell'ordine in cui gli eventi finiscono nel calendario filtrato
+        """
+        fingerprints = {}
+        for course_name, events in course_index.items():
+            pairs = []
+            for event in events:
+                if isinstance(event, ScannedEvent):
+                    uid, raw = event.uid, event.raw
+                else:
+                    uid, raw = str(event.get('uid', '')), event.to_ical()
+                pairs.append((uid, hashlib.md5(raw).hexdigest()))
+            fingerprints[course_name] = tuple(pairs)
+        return fingerprints
+    
+    def changed_courses(self, old_fingerprints: Dict[str, tuple],
+                        new_fingerprints: Dict[str, tuple]) -> Set[str]:
+        """
+        Confronta due versioni del calendario evento per evento
+        
+        Args:
+            old_fingerprints: Impronte della versione precedente (vedi event_fingerprints)
+            new_fingerprints: Impronte della nuova versione
+            
+        Returns:
+            Corsi con eventi aggiunti, rimossi, modificati o riordinati
+        """
+        return {
+            course_name
+            for course_name in old_fingerprints.keys() | new_fingerprints.keys()
+            if old_fingerprints.get(course_name) != new_fingerprints.get(course_name)
+        }
+    
+    def extract_courses(self, calendar: Calendar,
+                        course_index: Dict[str, List[Event]] = None) -> Dict[str, List[EventRecord]]:
         """
         Estrae tutti i corsi dal calendario
         
         Args:
             calendar: Oggetto Calendar
+            course_index: Indice dei corsi già costruito (opzionale)
             
         Returns:
-            Dizionario con i corsi e i relativi eventi
+            Dizionario con i corsi e i relativi eventi (EventRecord)
         """
+        if course_index is None:
+            course_index = self.build_course_index(calendar)
+        
         courses = {}
         
-        for component in calendar.walk():
-            if component.name == "VEVENT":
-                # Estrai informazioni dell'evento
-                summary = str(component.get('summary', ''))
-                description = str(component.get('description', ''))
-                location = str(component.get('location', ''))
-                start_time = component.get('dtstart').dt
-                end_time = component.get('dtend').dt
-                
-                # Estrai il nome del corso (di solito è nella summary)
-                course_name = self.extract_course_name(summary, description)
-                
-                if course_name not in courses:
-                    courses[course_name] = []
-                
-                event_info = {
-                    'summary': summary,
-                    'description': description,
-                    'location': location,
-                    'start': start_time,
-                    'end': end_time,
-                    'component': component
-                }
-                
-                courses[course_name].append(event_info)
+        for course_name, components in course_index.items():
+            events = []
+            for component in components:
+                # Estrai informazioni dell'evento (senza tenere il componente)
+                events.append(EventRecord(
+                    course_name,
+                    str(component.get('summary', '')),
+                    str(component.get('description', '')),
+                    str(component.get('location', '')),
+                    component.get('dtstart').dt,
+                    component.get('dtend').dt
+                ))
+            
+            courses[course_name] = events
         
         return courses
     
@@ -158,7 +793,29 @@ class UniversityCalendarManager:
         
         return course_name.strip()
     
-    def display_available_courses(self, courses: Dict[str, List[Dict]]):
+    def summarize_courses(self, courses: Dict[str, List[EventRecord]]) -> List[Dict]:
+        """
+        Riassume i corsi per l'interfaccia web
+        
+        Args:
+            courses: Dizionario dei corsi (vedi extract_courses) o indice dei
+                corsi con gli eventi compatti (vedi scan_calendar)
+            
+        Returns:
+            Lista ordinata per nome di dizionari con nome, numero di eventi e luogo
+        """
+        summary = [
+            {
+                'name': course_name,
+                'events_count': len(events),
+                'location': events[0].location if events and events[0].location else 'N/A'
+            }
+            for course_name, events in courses.items()
+        ]
+        summary.sort(key=lambda x: x['name'])
+        return summary
+    
+    def display_available_courses(self, courses: Dict[str, List[EventRecord]]):
         """
         Mostra tutti i corsi disponibili
         
@@ -176,7 +833,7 @@ class UniversityCalendarManager:
         
         print(f"\nTotale: {len(sorted_courses)} corsi trovati")
     
-    def select_courses_interactive(self, courses: Dict[str, List[Dict]]) -> List[str]:
+    def select_courses_interactive(self, courses: Dict[str, List[EventRecord]]) -> List[str]:
         """
         Permette all'utente di selezionare i corsi di interesse
         
@@ -245,18 +902,25 @@ class UniversityCalendarManager:
                 print(f"Formato non valido. Riprova. ({e})")
     
     def create_filtered_calendar(self, original_calendar: Calendar, 
-                                selected_courses: List[str]) -> Calendar:
+                                selected_courses: List[str],
+                                course_index: Dict[str, List[Event]] = None) -> Calendar:
         """
         Crea un nuovo calendario con solo i corsi selezionati
         
         Args:
             original_calendar: Calendario originale
             selected_courses: Lista dei corsi da includere
+            course_index: Indice dei corsi già costruito (opzionale); se
+                presente il filtraggio non scorre tutto il calendario
             
         Returns:
             Nuovo calendario filtrato
         """
+        if course_index is None:
+            course_index = self.build_course_index(original_calendar)
+        
         # Crea un nuovo calendario
+        start = time.perf_counter()
         filtered_cal = Calendar()
         
         # Aggiungi le proprietà di base del calendario
@@ -265,20 +929,49 @@ class UniversityCalendarManager:
         
         # Aggiungi solo gli eventi dei corsi selezionati
         events_added = 0
-        for component in original_calendar.walk():
-            if component.name == "VEVENT":
-                summary = str(component.get('summary', ''))
-                course_name = self.extract_course_name(summary, '')
-                
-                if course_name in selected_courses:
-                    # Crea una copia pulita dell'evento
-                    new_event = component.copy()
-                    filtered_cal.add_component(new_event)
-                    events_added += 1
+        for course_name in sorted(set(selected_courses)):
+            for component in course_index.get(course_name, ()):
+                # Crea una copia pulita dell'evento
+                filtered_cal.add_component(component.copy())
+                events_added += 1
         
-        print(f"Eventi aggiunti al calendario filtrato: {events_added}")
+        record_stage('filter', time.perf_counter() - start, events=events_added)
         return filtered_cal
     
+    def iter_filtered_calendar(self, original_calendar: Calendar,
+                               selected_courses: List[str],
+                               course_index: Dict[str, List[Event]] = None) -> Iterator[bytes]:
+        """
+        Genera il calendario filtrato serializzato a blocchi, senza costruirlo in memoria
+        
+        Produce gli stessi byte di create_filtered_calendar(...).to_ical().
+        
+        Args:
+            original_calendar: Calendario originale
+            selected_courses: Lista dei corsi da includere
+            course_index: Indice dei corsi già costruito (opzionale)
+            
+        Yields:
+            Intestazione VCALENDAR, un blocco per ogni VEVENT, chiusura
+        """
+        if course_index is None:
+            course_index = self.build_course_index(original_calendar)
+        
+        yield FILTERED_CALENDAR_HEADER
+        
+        events_added = 0
+        serialize_time = 0.0
+        for course_name in sorted(set(selected_courses)):
+            for component in course_index.get(course_name, ()):
+                start = time.perf_counter()
+                data = component.to_ical()
+                serialize_time += time.perf_counter() - start
+                yield data
+                events_added += 1
+        record_stage('serialize', serialize_time, events=events_added)
+        
+        yield FILTERED_CALENDAR_FOOTER
+    
     def save_filtered_calendar(self, filtered_calendar: Calendar):
         """
         Salva il calendario filtrato su file
@@ -308,7 +1001,10 @@ class UniversityCalendarManager:
         if not calendar_data:
             return False
         
-        current_hash = self.calculate_hash(calendar_data)
+        if self.last_download:
+            current_hash = self.last_download['hash']
+        else:
+            current_hash = self.calculate_hash(calendar_data)
         
         if self.config.get("calendar_hash") != current_hash:
             print("Rilevato aggiornamento nel calendario!")
@@ -337,8 +1033,9 @@ class UniversityCalendarManager:
             print("Impossibile parsificare il calendario.")
             return
         
-        # Estrai i corsi
-        courses = self.extract_courses(calendar)
+        # Estrai i corsi (l'indice serve anche per il filtraggio)
+        course_index = self.build_course_index(calendar)
+        courses = self.extract_courses(calendar, course_index)
         if not courses:
             print("Nessun corso trovato nel calendario.")
             return
@@ -354,7 +1051,7 @@ class UniversityCalendarManager:
             self.save_config()
             
             # Crea e salva il calendario filtrato
-            filtered_calendar = self.create_filtered_calendar(calendar, selected_courses)
+            filtered_calendar = self.create_filtered_calendar(calendar, selected_courses, course_index)
             self.save_filtered_calendar(filtered_calendar)
             
             print(f"\nProcesso completato! Calendario filtrato con {len(selected_courses)} corsi.")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Metriche dell'applicazione in formato testuale Prometheus
+Tempi delle fasi di elaborazione (download, hash, parsing, indice, filtraggio,
+serializzazione, compressione), esiti e byte delle risposte del calendario
+originale e contatori delle cache, senza dipendenze esterne.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Tuple
+
+# Limiti degli intervalli degli istogrammi dei tempi (secondi)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape_label(value: str) -> str:
+    """Escape dei valori delle etichette"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    """Etichette di un campione: {nome="valore",...}"""
+    parts = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    """Valore di un campione (interi senza decimali)"""
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Contatore monotono, eventualmente suddiviso per etichette"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """Incrementa il contatore per le etichette date"""
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        """Valore corrente per le etichette date"""
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in values]
+
+
+class Histogram:
+    """
+    Istogramma a intervalli fissi, eventualmente suddiviso per etichette
+
+    Ogni osservazione costa una ricerca binaria e un incremento sotto lock:
+    trascurabile rispetto alle fasi misurate.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # etichette -> [conteggi per intervallo..., somma]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """Registra un'osservazione per le etichette date"""
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Misura la durata del blocco with"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        """Numero di osservazioni per le etichette date"""
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts = self._values.get(key)
+            return sum(counts[:-1]) if counts else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Insieme delle metriche esportate
+
+    Le metriche dello stato delle cache sono lette solo al momento
+    dell'esportazione (collector), senza costi sul percorso delle richieste.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Counter:
+        """Crea e registra un contatore"""
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Crea e registra un istogramma"""
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple]]):
+        """
+        Registra una funzione letta a ogni esportazione
+
+        Args:
+            collector: Restituisce terne (nome, tipo, aiuto, campioni) dove i
+                campioni sono coppie (etichette, valore)
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Tutte le metriche in formato testuale Prometheus"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+
+        for collector in collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    labels = labels or {}
+                    names = tuple(labels)
+                    lines.append(f'{name}{_format_labels(names, tuple(labels[n] for n in names))} '
+                                 f'{_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'calendar_stage_seconds',
+    'Durata delle fasi di elaborazione del calendario',
+    labels=('stage',)
+)
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    'calendar_upstream_responses_total',
+    'Risposte del calendario originale per codice di stato (error: richiesta fallita)',
+    labels=('status',)
+)
+UPSTREAM_BYTES = REGISTRY.counter(
+    'calendar_upstream_bytes_total',
+    'Byte scaricati dal calendario originale'
+)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Registra la durata di una fase di elaborazione"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
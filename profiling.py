@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Profilazione su richiesta delle richieste lente
+Attiva solo se configurata: le richieste con il flag di profilazione (o
+campionate a caso) vengono eseguite sotto cProfile e, se superano la soglia
+di latenza, il profilo (pstats) viene salvato in una cartella a rotazione
+insieme a endpoint, durata, dimensione della selezione e del calendario originale.
+"""
+
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from flask import current_app, g, request
+
+from tracing import log_event
+
+# Flag della richiesta: intestazione o parametro della query
+PROFILE_HEADER = 'X-Profile'
+PROFILE_QUERY_PARAM = 'profile'
+
+
+class RequestProfiler:
+    """
+    Profilatore delle richieste con soglia di latenza e cartella a rotazione
+    """
+
+    def __init__(self, directory: str, enabled: bool = False, threshold: float = 0.5,
+                 sample_rate: float = 0.0, max_files: int = 50, token: Optional[str] = None):
+        """
+        Args:
+            directory: Cartella dei profili salvati
+            enabled: Se False le richieste non vengono mai profilate
+            threshold: Durata minima (secondi) delle richieste di cui salvare il profilo
+            sample_rate: Frazione delle richieste profilate anche senza flag
+            max_files: Numero massimo di profili conservati (i più vecchi vengono eliminati)
+            token: Se impostato, il flag deve avere questo valore
+        """
+        self.directory = directory
+        self.enabled = enabled
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        self.token = token
+        self.profiled = 0
+        self.saved = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def requested(self) -> bool:
+        """True se la richiesta corrente va profilata (flag o campionamento)"""
+        if not self.enabled:
+            return False
+        flag = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_QUERY_PARAM)
+        if flag:
+            return flag == self.token if self.token else flag not in ('0', 'false')
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def profile(self, fn: Callable) -> Callable:
+        """Decoratore delle view Flask da profilare su richiesta"""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not self.requested():
+                return fn(*args, **kwargs)
+
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Un altro profilatore è già attivo in questo thread
+                with self._lock:
+                    self.skipped += 1
+                return fn(*args, **kwargs)
+
+            g.profile_info = {}
+            start = time.perf_counter()
+            try:
+                response = fn(*args, **kwargs)
+            finally:
+                profiler.disable()
+
+            return self._finish(profiler, start, fn.__name__, response)
+
+        return wrapper
+
+    def _finish(self, profiler: cProfile.Profile, start: float, endpoint: str, result):
+        """Salva il profilo a fine elaborazione (le risposte profilate non sono inviate a blocchi)"""
+        info = dict(g.profile_info, path=request.path)
+        response = current_app.make_response(result)
+        self._save(profiler, time.perf_counter() - start, endpoint, info)
+        return response
+
+    def _save(self, profiler: cProfile.Profile, elapsed: float, endpoint: str, info: Dict):
+        """Salva profilo e metadati se la richiesta ha superato la soglia"""
+        with self._lock:
+            self.profiled += 1
+        if elapsed < self.threshold:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.time():.6f}-{endpoint}-{int(elapsed * 1000)}ms"
+        path = os.path.join(self.directory, name)
+        try:
+            profiler.dump_stats(path + '.prof')
+            with open(path + '.json', 'w', encoding='utf-8') as f:
+                json.dump(dict(info, endpoint=endpoint, elapsed_ms=round(elapsed * 1000, 3),
+                               timestamp=time.time()), f)
+        except OSError as e:
+            log_event("Errore durante il salvataggio del profilo", logging.ERROR,
+                      path=path, error=str(e))
+            return
+
+        with self._lock:
+            self.saved += 1
+            self._rotate()
+
+    def _rotate(self):
+        """Elimina i profili più vecchi oltre max_files (chiamare con il lock)"""
+        try:
+            profiles = sorted(name for name in os.listdir(self.directory) if name.endswith('.prof'))
+        except OSError:
+            return
+        for name in profiles[:max(0, len(profiles) - self.max_files)]:
+            base = name[:-len('.prof')]
+            for suffix in ('.prof', '.json'):
+                try:
+                    os.remove(os.path.join(self.directory, base + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        """Configurazione e contatori della profilazione"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'threshold_ms': self.threshold * 1000,
+                'sample_rate': self.sample_rate,
+                'profiled': self.profiled,
+                'saved': self.saved,
+                'skipped': self.skipped
+            }
+
+
+def annotate_profile(**info):
+    """Aggiunge informazioni (es. dimensione della selezione) al profilo della richiesta corrente"""
+    profile_info = g.get('profile_info')
+    if profile_info is not None:
+        profile_info.update(info)
+
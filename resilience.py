@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Protezione dal sovraccarico e dagli errori del server remoto
+Interruttore (circuit breaker) per server remoto, così un server in errore
+non trattiene i worker fino al timeout, e controllo di ammissione che
+limita le elaborazioni costose concorrenti rifiutando subito quelle in eccesso.
+"""
+
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    Interruttore per un server remoto
+
+    Dopo failure_threshold errori consecutivi l'interruttore si apre e le
+    richieste vengono rifiutate subito per reset_timeout secondi; poi passa
+    una sola richiesta di prova (semiaperto): se riesce l'interruttore si
+    chiude, altrimenti si riapre.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60):
+        """
+        Args:
+            failure_threshold: Errori consecutivi che aprono l'interruttore
+            reset_timeout: Secondi prima della richiesta di prova
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self.trips = 0
+        self._trial_owner = None  # thread della richiesta di prova in corso
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Stato corrente: 'closed', 'open' o 'half_open'"""
+        return self._state(time.monotonic())
+
+    def _state(self, now: float) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if now - self.opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow(self) -> bool:
+        """True se la richiesta può essere inviata (nello stato semiaperto: una sola alla volta)"""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._trial_owner is None:
+                self._trial_owner = threading.get_ident()
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """Richiesta riuscita: chiude l'interruttore"""
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_owner = None
+
+    def record_failure(self):
+        """Richiesta fallita: apre l'interruttore oltre la soglia (o se la prova fallisce)"""
+        with self._lock:
+            self.failures += 1
+            trial = self._trial_owner is not None
+            if trial or self.failures >= self.failure_threshold:
+                if self.opened_at is None or trial:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+                self._trial_owner = None
+
+    def release_trial(self):
+        """
+        Libera la richiesta di prova del thread corrente se è terminata senza esito
+        (es. eccezione inattesa), così una richiesta successiva può riprovare;
+        senza effetto se il thread corrente non ha una prova in corso
+        """
+        with self._lock:
+            if self._trial_owner == threading.get_ident():
+                self._trial_owner = None
+
+    def stats(self):
+        """Stato e contatori dell'interruttore"""
+        with self._lock:
+            return {
+                'state': self._state(time.monotonic()),
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'trips': self.trips
+            }
+
+
+class AdmissionRejected(Exception):
+    """Elaborazione rifiutata dal controllo di ammissione (posti e coda pieni)"""
+
+
+class AdmissionLimiter:
+    """
+    Limite di concorrenza con una piccola coda di attesa
+
+    Al più max_concurrent chiamanti lavorano insieme; fino a max_queue altri
+    attendono (al più queue_timeout secondi) e gli altri vengono rifiutati
+    subito, così il lavoro in eccesso non si accumula nei thread del worker.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queue: int = 4, queue_timeout: float = 2.0):
+        """
+        Args:
+            max_concurrent: Chiamanti ammessi contemporaneamente
+            max_queue: Chiamanti in attesa di un posto
+            queue_timeout: Attesa massima (secondi) in coda
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> bool:
+        """
+        Occupa un posto, attendendo in coda se necessario
+
+        Returns:
+            True se il chiamante è ammesso (va poi chiamato release), False se rifiutato
+        """
+        with self._condition:
+            if self.active < self.max_concurrent and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                return False
+
+            self.waiting += 1
+            self.queued += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        """Libera un posto e sveglia il primo chiamante in coda"""
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        """Posti occupati, coda e contatori di ammissioni e rifiuti"""
+        with self._condition:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed': self.shed,
+                'timed_out': self.timed_out
+            }
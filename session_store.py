@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Archivio dei file temporanei delle sessioni (calendari analizzati e filtrati)
+Limita la cartella per numero di file e dimensione totale, elimina i file
+scaduti (TTL) e, oltre il limite, quelli usati meno di recente (LRU).
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from tracing import log_event
+
+
+class SessionFileStore:
+    """
+    Cartella di file temporanei con limiti di dimensione, TTL ed eliminazione LRU
+
+    L'indice in memoria evita di interrogare il filesystem a ogni lettura.
+    Ogni scrittura (e la pulizia periodica) rilegge la cartella, così i limiti
+    valgono per tutti i processi che la condividono, non per ciascun worker.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024,
+                 max_entries: int = 1000, ttl: int = 24 * 60 * 60,
+                 sweep_interval: int = 10 * 60):
+        """
+        Args:
+            directory: Cartella dei file temporanei
+            max_bytes: Dimensione massima complessiva dei file (di tutti i processi)
+            max_entries: Numero massimo di file (di tutti i processi)
+            ttl: Secondi dopo l'ultimo accesso oltre i quali un file viene eliminato
+            sweep_interval: Secondi tra due pulizie della cartella
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.total_bytes = 0
+        self.expired = 0
+        self.evictions = 0
+        self.sweeps = 0
+        self._entries = OrderedDict()  # nome -> (dimensione, ultimo accesso)
+        self._lock = threading.Lock()
+        self._sweeper = None
+        os.makedirs(directory, exist_ok=True)
+        self.sweep()
+
+    def path(self, name: str) -> str:
+        """Percorso del file nella cartella (solo il nome, senza sottocartelle)"""
+        return os.path.join(self.directory, os.path.basename(name))
+
+    def write_chunks(self, name: str, chunks: Iterable[bytes]):
+        """Salva un file a blocchi, eliminando i file in eccesso (anche degli altri processi)"""
+        path = self.path(name)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.writelines(chunks)
+        os.replace(tmp_path, path)
+
+        # Le scritture sono rare (generazione di un file da scaricare): rileggere
+        # la cartella costa poco e applica i limiti a tutta la cartella condivisa
+        self.sweep()
+
+    def get_path(self, name: str) -> Optional[str]:
+        """
+        Restituisce il percorso del file se esiste e non è scaduto (aggiornandone l'accesso)
+
+        Returns:
+            Percorso del file, oppure None
+        """
+        name = os.path.basename(name)
+        path = self.path(name)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(name)
+        if entry is None:
+            # File scritto da un altro processo: lo aggiunge all'indice
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            entry = (stat.st_size, stat.st_mtime)
+
+        if now - entry[1] >= self.ttl:
+            self._remove(name)
+            with self._lock:
+                self.expired += 1
+            return None
+
+        try:
+            # L'ora di modifica è l'ultimo accesso, visibile agli altri processi
+            os.utime(path, (now, now))
+        except OSError:
+            self._remove(name)
+            return None
+
+        with self._lock:
+            self._add(name, entry[0], now)
+        return path
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """
+        Rilegge la cartella, elimina i file scaduti e quelli oltre i limiti
+
+        Returns:
+            Numero di file eliminati
+        """
+        now = now or time.time()
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith('.tmp'):
+                    # Scrittura interrotta: il file parziale viene eliminato allo scadere del TTL
+                    if now - stat.st_mtime >= self.ttl:
+                        self._unlink(entry.name)
+                    continue
+                found.append((entry.name, stat.st_size, stat.st_mtime))
+
+        with self._lock:
+            known = self._entries
+            self._entries = OrderedDict()
+            self.total_bytes = 0
+            expired = []
+            files = [(name, size, max(mtime, known.get(name, (0, 0))[1]))
+                     for name, size, mtime in found]
+            # Indice in ordine di ultimo accesso (i meno recenti per primi)
+            for name, size, last_access in sorted(files, key=lambda item: item[2]):
+                if now - last_access >= self.ttl:
+                    expired.append(name)
+                else:
+                    self._add(name, size, last_access)
+            self.expired += len(expired)
+            evicted = self._evict_over_budget()
+            self.sweeps += 1
+
+        for name in expired:
+            self._unlink(name)
+        return len(expired) + evicted
+
+    def start_sweeper(self):
+        """Avvia il thread di pulizia periodica (una volta sola)"""
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(
+                    target=self._sweeper_loop, name='session-sweeper', daemon=True
+                )
+                self._sweeper.start()
+
+    def _sweeper_loop(self):
+        """Ciclo del thread di pulizia"""
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                log_event("Errore durante la pulizia dei file temporanei", logging.ERROR,
+                          directory=self.directory, error=str(e))
+
+    def _add(self, name: str, size: int, last_access: float):
+        """Aggiorna l'indice (chiamare con il lock)"""
+        previous = self._entries.pop(name, None)
+        if previous is not None:
+            self.total_bytes -= previous[0]
+        self._entries[name] = (size, last_access)
+        self.total_bytes += size
+
+    def _evict_over_budget(self) -> int:
+        """Elimina i file usati meno di recente oltre i limiti (chiamare con il lock)"""
+        evicted = 0
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self.total_bytes > self.max_bytes):
+            name, (size, _) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self._unlink(name)
+            evicted += 1
+        self.evictions += evicted
+        return evicted
+
+    def _remove(self, name: str):
+        """Elimina un file e la sua voce nell'indice"""
+        with self._lock:
+            previous = self._entries.pop(name, None)
+            if previous is not None:
+                self.total_bytes -= previous[0]
+        self._unlink(name)
+
+    def _unlink(self, name: str):
+        """Elimina un file (già eliminato da un altro processo: nessun errore)"""
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        """Occupazione e contatori di eliminazione"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'sweeps': self.sweeps
+            }
+
+    def __len__(self):
+        return len(self._entries)
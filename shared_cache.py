@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Cache condivisa tra i worker (SQLite su disco locale)
+Permette a più processi gunicorn sullo stesso nodo di condividere i
+calendari scaricati, i relativi validatori e i calendari filtrati già
+serializzati, senza moltiplicare download e parsing.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from calendar_cache import RenderedCalendar
+
+# Versione dello schema (2: varianti compresse, 3: validatori dei calendari filtrati)
+SCHEMA_VERSION = 3
+
+# Colonne aggiunte a rendered dopo la prima versione: le righe già salvate restano
+# valide (senza varianti compresse o validatori, ricalcolati dall'app)
+RENDERED_MIGRATIONS = (('gzip', 'BLOB'), ('br', 'BLOB'), ('etag', 'TEXT'), ('last_modified', 'REAL'))
+
+
+class SharedCalendarStore:
+    """
+    Archivio SQLite condiviso tra processi
+
+    Ogni scrittura avviene in una transazione (atomica per tutti i worker);
+    il database usa il journal WAL così le letture non bloccano le scritture.
+    """
+
+    def __init__(self, directory: str, max_rendered_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            directory: Cartella in cui creare il database condiviso
+            max_rendered_bytes: Dimensione massima dei calendari filtrati salvati
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, 'calendar_cache.sqlite3')
+        self.max_rendered_bytes = max_rendered_bytes
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connessione SQLite del thread corrente"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        """Crea le tabelle o aggiorna quelle di versioni precedenti dello schema"""
+        conn = self._connection()
+        # Transazione esclusiva in scrittura: con più worker che partono insieme
+        # un solo processo alla volta controlla e aggiorna lo schema
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS upstream (
+                    cache_key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    changed_at REAL NOT NULL,
+                    timestamp REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rendered (
+                    calendar_hash TEXT NOT NULL,
+                    selection TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    gzip BLOB,
+                    br BLOB,
+                    etag TEXT,
+                    last_modified REAL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    PRIMARY KEY (calendar_hash, selection)
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS rendered_created ON rendered (created)')
+
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCHEMA_VERSION:
+                columns = {row[1] for row in conn.execute('PRAGMA table_info(rendered)')}
+                for column, column_type in RENDERED_MIGRATIONS:
+                    if column not in columns:
+                        conn.execute(f'ALTER TABLE rendered ADD COLUMN {column} {column_type}')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def get_upstream(self, cache_key: str) -> Optional[Dict]:
+        """Restituisce il calendario originale salvato per la chiave, o None"""
+        row = self._connection().execute(
+            'SELECT url, data, hash, etag, last_modified, changed_at, timestamp '
+            'FROM upstream WHERE cache_key = ?', (cache_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        url, data, calendar_hash, etag, last_modified, changed_at, timestamp = row
+        return {
+            'data': data,
+            'hash': calendar_hash,
+            'etag': etag,
+            'last_modified': last_modified,
+            'changed_at': changed_at,
+            'timestamp': timestamp,
+            'url': url
+        }
+
+    def get_upstream_timestamp(self, cache_key: str) -> Optional[float]:
+        """Istante dell'ultimo download salvato per la chiave (senza leggere il contenuto)"""
+        row = self._connection().execute(
+            'SELECT timestamp FROM upstream WHERE cache_key = ?', (cache_key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_upstream(self, cache_key: str, entry: Dict):
+        """Salva il calendario originale e i suoi validatori"""
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO upstream '
+                '(cache_key, url, data, hash, etag, last_modified, changed_at, timestamp) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (cache_key, entry['url'], entry['data'], entry['hash'], entry.get('etag'),
+                 entry.get('last_modified'), entry['changed_at'], entry['timestamp'])
+            )
+
+    def get_rendered(self, calendar_hash: str,
+                     selection: Tuple[str, ...]) -> Optional[RenderedCalendar]:
+        """Restituisce il calendario filtrato salvato (con le varianti compresse), o None"""
+        row = self._connection().execute(
+            'SELECT data, gzip, br, etag, last_modified FROM rendered '
+            'WHERE calendar_hash = ? AND selection = ?',
+            (calendar_hash, json.dumps(selection))
+        ).fetchone()
+        if row is None:
+            return None
+        variants = {'identity': bytes(row[0])}
+        for encoding, body in (('gzip', row[1]), ('br', row[2])):
+            if body is not None:
+                variants[encoding] = bytes(body)
+        return RenderedCalendar(variants, row[3], row[4])
+
+    def put_rendered(self, calendar_hash: str, selection: Tuple[str, ...],
+                     rendered: RenderedCalendar):
+        """Salva un calendario filtrato, eliminando i più vecchi oltre il limite di dimensione"""
+        variants = rendered.variants
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO rendered '
+                '(calendar_hash, selection, data, gzip, br, etag, last_modified, size, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (calendar_hash, json.dumps(selection), sqlite3.Binary(variants['identity']),
+                 variants.get('gzip'), variants.get('br'), rendered.etag, rendered.last_modified,
+                 rendered.size, time.time())
+            )
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM rendered').fetchone()[0]
+            if total > self.max_rendered_bytes:
+                self._prune_rendered(conn, total - self.max_rendered_bytes)
+
+    def _prune_rendered(self, conn: sqlite3.Connection, excess: int):
+        """Elimina i calendari filtrati più vecchi fino a liberare almeno excess byte"""
+        freed = 0
+        rows = conn.execute('SELECT rowid, size FROM rendered ORDER BY created').fetchall()
+        stale = []
+        for rowid, size in rows:
+            if freed >= excess:
+                break
+            stale.append((rowid,))
+            freed += size
+        conn.executemany('DELETE FROM rendered WHERE rowid = ?', stale)
+
+    def has_rendered(self, calendar_hash: str) -> bool:
+        """True se ci sono calendari filtrati salvati per la versione data"""
+        row = self._connection().execute(
+            'SELECT 1 FROM rendered WHERE calendar_hash = ? LIMIT 1', (calendar_hash,)
+        ).fetchone()
+        return row is not None
+
+    def rekey_rendered(self, old_hash: str, new_hash: str,
+                       keep: Callable[[Tuple[str, ...]], bool]) -> int:
+        """
+        Sposta alla nuova versione i calendari filtrati ancora validi ed elimina gli altri
+
+        Returns:
+            Numero di calendari filtrati spostati
+        """
+        with self._connection() as conn:
+            rows = conn.execute(
+                'SELECT selection FROM rendered WHERE calendar_hash = ?', (old_hash,)
+            ).fetchall()
+            kept = [(new_hash, old_hash, selection) for (selection,) in rows
+                    if keep(tuple(json.loads(selection)))]
+            conn.executemany(
+                'UPDATE OR REPLACE rendered SET calendar_hash = ? '
+                'WHERE calendar_hash = ? AND selection = ?', kept
+            )
+            conn.execute('DELETE FROM rendered WHERE calendar_hash = ?', (old_hash,))
+        return len(kept)
+
+    def delete_rendered(self, calendar_hash: str):
+        """Elimina i calendari filtrati di una versione del calendario originale"""
+        with self._connection() as conn:
+            conn.execute('DELETE FROM rendered WHERE calendar_hash = ?', (calendar_hash,))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Archivio delle iscrizioni ai calendari filtrati
+Ogni iscrizione (uno o più calendari originali, ciascuno con i suoi corsi
+selezionati) ha un ID breve derivato dal suo contenuto: selezioni identiche
+condividono lo stesso ID e lo stesso link /api/ical/<id>.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from calendar_cache import canonical_selection
+
+SUBSCRIPTION_ID_LENGTH = 16
+
+# Versione dello schema (2: colonna feeds per le iscrizioni a più calendari)
+SCHEMA_VERSION = 2
+
+
+class SubscriptionFeed:
+    """Calendario originale di un'iscrizione, con la sua selezione canonica"""
+
+    __slots__ = ('url', 'courses', 'selection', 'cache_key')
+
+    def __init__(self, url: str, courses: Iterable[str]):
+        self.url = url
+        self.courses = frozenset(courses)
+        self.selection = canonical_selection(self.courses)
+        self.cache_key = hashlib.md5(url.encode()).hexdigest()
+
+
+class Subscription:
+    """Iscrizione già canonicalizzata, pronta per servire il calendario"""
+
+    __slots__ = ('id', 'feeds')
+
+    def __init__(self, subscription_id: str, feeds: Iterable[Tuple[str, Iterable[str]]]):
+        self.id = subscription_id
+        self.feeds = tuple(SubscriptionFeed(url, courses) for url, courses in canonical_feeds(feeds))
+
+    def __repr__(self):
+        return f"Subscription({self.id!r}, {len(self.feeds)} calendari)"
+
+
+def canonical_feeds(feeds: Iterable[Tuple[str, Iterable[str]]]) -> List[Tuple[str, Tuple[str, ...]]]:
+    """
+    Restituisce la forma canonica dei calendari di un'iscrizione
+
+    Returns:
+        Coppie (URL, selezione canonica) ordinate per URL; le selezioni
+        dello stesso URL ripetuto vengono unite
+    """
+    merged = {}
+    for url, courses in feeds:
+        merged.setdefault(url, set()).update(courses)
+    return [(url, canonical_selection(courses)) for url, courses in sorted(merged.items())]
+
+
+def feeds_subscription_id(feeds: Iterable[Tuple[str, Iterable[str]]]) -> str:
+    """Calcola l'ID breve di un'iscrizione a partire dal suo contenuto canonico"""
+    canonical = canonical_feeds(feeds)
+    if len(canonical) == 1:
+        url, selection = canonical[0]
+        payload = [url, list(selection)]
+    else:
+        payload = [[url, list(selection)] for url, selection in canonical]
+    payload = json.dumps(payload, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:SUBSCRIPTION_ID_LENGTH]
+
+
+class SubscriptionStore:
+    """
+    Archivio SQLite delle iscrizioni
+
+    Il database va tenuto su un volume persistente: i link /api/ical/<id>
+    funzionano solo finché l'iscrizione è presente.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Percorso del database SQLite (creato al primo utilizzo)
+        """
+        self.path = path
+        self._local = threading.local()
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Connessione SQLite del thread corrente (crea lo schema al primo utilizzo)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS subscriptions (
+                        id TEXT PRIMARY KEY,
+                        url TEXT NOT NULL,
+                        courses TEXT NOT NULL,
+                        created REAL NOT NULL
+                    )
+                """)
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version < 2:
+                    # Iscrizioni a più calendari: [[url, corsi], ...] (NULL per un solo calendario)
+                    columns = [row[1] for row in conn.execute('PRAGMA table_info(subscriptions)')]
+                    if 'feeds' not in columns:
+                        conn.execute('ALTER TABLE subscriptions ADD COLUMN feeds TEXT')
+                    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self._local.conn = conn
+        return conn
+
+    def create_feeds(self, feeds: Iterable[Tuple[str, Iterable[str]]]) -> Subscription:
+        """
+        Registra un'iscrizione a uno o più calendari, ciascuno con i suoi corsi
+        (o restituisce quella esistente con lo stesso contenuto)
+
+        Args:
+            feeds: Coppie (URL del calendario originale, corsi selezionati)
+
+        Returns:
+            Iscrizione con il suo ID breve
+        """
+        canonical = canonical_feeds(feeds)
+        if not canonical:
+            raise ValueError("Iscrizione senza calendari")
+
+        sub_id = feeds_subscription_id(canonical)
+        url, selection = canonical[0]
+        feeds_json = json.dumps(canonical) if len(canonical) > 1 else None
+        with self._connection() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO subscriptions (id, url, courses, feeds, created) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (sub_id, url, json.dumps(selection), feeds_json, time.time())
+            )
+        subscription = Subscription(sub_id, canonical)
+        with self._lock:
+            self._subscriptions[sub_id] = subscription
+        return subscription
+
+    @staticmethod
+    def _from_row(sub_id: str, url: str, courses: str, feeds: Optional[str]) -> Subscription:
+        """Ricostruisce l'iscrizione da una riga del database"""
+        if feeds:
+            return Subscription(sub_id, json.loads(feeds))
+        return Subscription(sub_id, [(url, json.loads(courses))])
+
+    def get(self, sub_id: str) -> Optional[Subscription]:
+        """Restituisce l'iscrizione con l'ID dato, o None"""
+        with self._lock:
+            subscription = self._subscriptions.get(sub_id)
+        if subscription is not None:
+            return subscription
+
+        row = self._connection().execute(
+            'SELECT url, courses, feeds FROM subscriptions WHERE id = ?', (sub_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        subscription = self._from_row(sub_id, *row)
+        with self._lock:
+            self._subscriptions[sub_id] = subscription
+        return subscription
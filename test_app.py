@@ -5,6 +5,7 @@ Test suite per l'applicazione calendario universitario
 
 import unittest
 import json
+import logging
 import os
 import tempfile
 from datetime import datetime
@@ -14,8 +15,29 @@ import sys
 # Aggiungi il percorso del progetto per importare i moduli
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from icalendar import Calendar
+import calendar_manager
 from calendar_manager import UniversityCalendarManager
 from auto_update import load_config, should_check_for_updates, auto_update_calendar
+from calendar_cache import (
+    RenderedCalendar, RenderedCalendarCache, SingleFlight, canonical_selection, choose_encoding
+)
+from resilience import CircuitBreaker
+from subscription_store import feeds_subscription_id
+
+
+def upstream_response(status_code=200, body='', headers=None):
+    """Risposta simulata del calendario originale, letta in streaming"""
+    import requests
+    content = body.encode('utf-8')
+    response = Mock(status_code=status_code, headers=headers or {}, encoding='utf-8',
+                    url='https://example.com/calendar.ics')
+    response.iter_content.side_effect = lambda chunk_size: iter(
+        [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+    )
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(response=response)
+    return response
 
 
 class TestUniversityCalendarManager(unittest.TestCase):
@@ -25,25 +47,175 @@ class TestUniversityCalendarManager(unittest.TestCase):
         """Setup per ogni test"""
         self.test_url = "https://example.com/calendar.ics"
         self.manager = UniversityCalendarManager(self.test_url)
+        UniversityCalendarManager._upstream_state.clear()
+        calendar_manager._CIRCUIT_BREAKERS.clear()
 
     def tearDown(self):
         """Pulizia dopo ogni test"""
+        UniversityCalendarManager._upstream_state.clear()
+        calendar_manager._CIRCUIT_BREAKERS.clear()
         # Rimuovi file di test se esistono
         for filename in ["calendar_config.json", "calendar_cache.pkl", "filtered_calendar.ics"]:
             if os.path.exists(filename):
                 os.remove(filename)
 
-    @patch('requests.get')
-    def test_download_calendar_success(self, mock_get):
+    @patch('calendar_manager.get_http_session')
+    def test_download_calendar_success(self, mock_session):
         """Test download calendario riuscito"""
-        mock_response = Mock()
-        mock_response.text = "BEGIN:VCALENDAR\nEND:VCALENDAR"
-        mock_response.raise_for_status.return_value = None
-        mock_get.return_value = mock_response
+        mock_response = upstream_response(body="BEGIN:VCALENDAR\nEND:VCALENDAR")
+        mock_session.return_value.get.return_value = mock_response
 
         result = self.manager.download_calendar()
         self.assertEqual(result, "BEGIN:VCALENDAR\nEND:VCALENDAR")
-        mock_get.assert_called_once_with(self.test_url, timeout=30)
+        mock_session.return_value.get.assert_called_once_with(
+            self.test_url, headers={},
+            timeout=(calendar_manager.UPSTREAM_CONNECT_TIMEOUT, calendar_manager.UPSTREAM_READ_TIMEOUT),
+            stream=True
+        )
+        mock_response.close.assert_called_once()
+
+    @patch('calendar_manager.get_http_session')
+    def test_download_calendar_conditional(self, mock_session):
+        """Test richiesta condizionale con risposta 304"""
+        first = upstream_response(body="BEGIN:VCALENDAR\nEND:VCALENDAR", headers={
+            'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 10:00:00 GMT'
+        })
+        not_modified = upstream_response(304)
+        mock_session.return_value.get.side_effect = [first, not_modified]
+
+        first_data = self.manager.download_calendar()
+        first_hash = self.manager.last_download['hash']
+        with patch.object(self.manager, 'calculate_hash') as mock_hash:
+            second_data = self.manager.download_calendar()
+            mock_hash.assert_not_called()
+
+        self.assertEqual(first_data, second_data)
+        self.assertTrue(self.manager.last_download['not_modified'])
+        self.assertEqual(self.manager.last_download['hash'], first_hash)
+        _, kwargs = mock_session.return_value.get.call_args
+        self.assertEqual(kwargs['headers'], {
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Mon, 01 Jan 2024 10:00:00 GMT'
+        })
+
+    @patch('calendar_manager.get_http_session')
+    def test_download_calendar_deadline(self, mock_session):
+        """Test timeout limitati dalla scadenza della richiesta"""
+        import time
+        mock_session.return_value.get.return_value = upstream_response(
+            body="BEGIN:VCALENDAR\nEND:VCALENDAR")
+
+        self.assertIsNone(self.manager.download_calendar(deadline=time.monotonic()))
+        mock_session.return_value.get.assert_not_called()
+
+        self.manager.download_calendar(deadline=time.monotonic() + 2)
+        connect, read = mock_session.return_value.get.call_args.kwargs['timeout']
+        self.assertLessEqual(connect, 2)
+        self.assertLessEqual(read, 2)
+
+    @patch('calendar_manager.UPSTREAM_CHUNK_SIZE', 8)
+    @patch('calendar_manager.get_http_session')
+    def test_download_calendar_total_deadline(self, mock_session):
+        """Test download interrotto oltre la scadenza complessiva anche se ogni lettura è puntuale"""
+        import time
+        from metrics import UPSTREAM_RESPONSES
+        trickle = upstream_response(body="BEGIN:VCALENDAR\nEND:VCALENDAR")
+
+        def slow_chunks(chunk_size):
+            for _ in range(10):
+                time.sleep(0.2)
+                yield b'X' * chunk_size
+
+        trickle.iter_content.side_effect = slow_chunks
+        mock_session.return_value.get.return_value = trickle
+        errors_before = UPSTREAM_RESPONSES.value(status='error')
+
+        start = time.monotonic()
+        self.assertIsNone(self.manager.download_calendar(deadline=start + 0.6))
+
+        self.assertLess(time.monotonic() - start, 1.5)
+        trickle.close.assert_called_once()
+        self.assertEqual(calendar_manager.circuit_breaker_stats()['example.com']['failures'], 1)
+        self.assertEqual(UPSTREAM_RESPONSES.value(status='error'), errors_before)
+
+    @patch('calendar_manager.UPSTREAM_RESET_TIMEOUT', 0)
+    @patch('calendar_manager.UPSTREAM_FAILURE_THRESHOLD', 1)
+    @patch('calendar_manager.get_http_session')
+    def test_circuit_breaker_trial_released_on_unexpected_error(self, mock_session):
+        """Test richiesta di prova liberata se termina con un'eccezione inattesa"""
+        import requests
+        mock_session.return_value.get.side_effect = [
+            requests.ConnectionError('down'),
+            RuntimeError('bug'),
+            upstream_response(body="BEGIN:VCALENDAR\nEND:VCALENDAR"),
+        ]
+
+        self.assertIsNone(self.manager.download_calendar())
+        with self.assertRaises(RuntimeError):
+            self.manager.download_calendar()
+        self.assertEqual(self.manager.download_calendar(), "BEGIN:VCALENDAR\nEND:VCALENDAR")
+
+        self.assertEqual(mock_session.return_value.get.call_count, 3)
+        self.assertEqual(calendar_manager.circuit_breaker_stats()['example.com']['state'], 'closed')
+
+    @patch('calendar_manager.UPSTREAM_FAILURE_THRESHOLD', 1)
+    @patch('calendar_manager.get_http_session')
+    def test_broken_feed_does_not_open_host_breaker(self, mock_session):
+        """Test errori 5xx di un calendario senza effetto sugli altri calendari dello stesso server"""
+        mock_session.return_value.get.side_effect = [
+            upstream_response(500),
+            upstream_response(body="BEGIN:VCALENDAR\nEND:VCALENDAR"),
+        ]
+
+        self.assertIsNone(self.manager.download_calendar())
+        other = UniversityCalendarManager("https://example.com/other.ics")
+        self.assertEqual(other.download_calendar(), "BEGIN:VCALENDAR\nEND:VCALENDAR")
+        self.assertEqual(calendar_manager.circuit_breaker_stats()['example.com']['state'], 'closed')
+
+    @patch('calendar_manager.get_http_session')
+    def test_last_good_calendar_without_validators(self, mock_session):
+        """Test ultima copia valida disponibile anche se il server non invia ETag né Last-Modified"""
+        import requests
+        mock_session.return_value.get.side_effect = [
+            upstream_response(body="BEGIN:VCALENDAR\nEND:VCALENDAR"),
+            requests.ConnectionError('down'),
+        ]
+
+        self.manager.download_calendar()
+        self.assertIsNone(self.manager.download_calendar())
+
+        self.assertEqual(self.manager.last_good_calendar(), "BEGIN:VCALENDAR\nEND:VCALENDAR")
+        self.assertEqual(self.manager.last_download['hash'],
+                         self.manager.calculate_hash("BEGIN:VCALENDAR\nEND:VCALENDAR"))
+        _, kwargs = mock_session.return_value.get.call_args
+        self.assertEqual(kwargs['headers'], {})
+
+    @patch('calendar_manager.UPSTREAM_FAILURE_THRESHOLD', 2)
+    @patch('calendar_manager.get_http_session')
+    def test_download_calendar_circuit_breaker(self, mock_session):
+        """Test download rifiutati subito dopo errori consecutivi del server"""
+        import requests
+        mock_session.return_value.get.side_effect = requests.ConnectionError('down')
+
+        for _ in range(4):
+            self.assertIsNone(self.manager.download_calendar())
+
+        self.assertEqual(mock_session.return_value.get.call_count, 2)
+        stats = calendar_manager.circuit_breaker_stats()['example.com']
+        self.assertEqual(stats['state'], 'open')
+        self.assertEqual(stats['rejected'], 2)
+
+    @patch('calendar_manager.get_http_session')
+    def test_last_good_calendar(self, mock_session):
+        """Test ultima copia valida disponibile dopo un download fallito"""
+        import requests
+        first = upstream_response(body="BEGIN:VCALENDAR\nEND:VCALENDAR", headers={'ETag': '"v1"'})
+        mock_session.return_value.get.side_effect = [first, requests.Timeout('slow')]
+
+        self.assertIsNone(self.manager.last_good_calendar())
+        data = self.manager.download_calendar()
+        self.assertIsNone(self.manager.download_calendar())
+        self.assertEqual(self.manager.last_good_calendar(), data)
 
     @patch.object(UniversityCalendarManager, 'download_calendar')
     def test_download_calendar_failure(self, mock_download):
@@ -86,6 +258,92 @@ END:VCALENDAR"""
         result = self.manager.extract_course_name(summary, "")
         self.assertEqual(result, "MATEMATICA")
 
+    def test_create_filtered_calendar_with_index(self):
+        """Test filtraggio tramite indice dei corsi"""
+        calendar_data = """BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VEVENT
+SUMMARY:LFT - LINGUAGGI FORMALI E TRADUTTORI (Turno A)
+DTSTART:20240101T100000
+DTEND:20240101T110000
+END:VEVENT
+BEGIN:VEVENT
+SUMMARY:MATEMATICA
+DTSTART:20240102T100000
+DTEND:20240102T110000
+END:VEVENT
+BEGIN:VEVENT
+SUMMARY:LFT - LINGUAGGI FORMALI E TRADUTTORI
+DTSTART:20240103T100000
+DTEND:20240103T110000
+END:VEVENT
+END:VCALENDAR"""
+        calendar = self.manager.parse_calendar(calendar_data)
+        index = self.manager.build_course_index(calendar)
+        self.assertEqual(len(index["LFT - LINGUAGGI FORMALI E TRADUTTORI"]), 2)
+
+        with patch.object(self.manager, 'build_course_index') as mock_index:
+            filtered = self.manager.create_filtered_calendar(
+                calendar, ["LFT - LINGUAGGI FORMALI E TRADUTTORI", "INESISTENTE"], index
+            )
+            mock_index.assert_not_called()
+
+        summaries = [str(e.get('summary')) for e in filtered.walk('VEVENT')]
+        self.assertEqual(len(summaries), 2)
+        self.assertTrue(all(s.startswith('LFT') for s in summaries))
+
+    def test_iter_filtered_calendar_matches_to_ical(self):
+        """Test generazione a blocchi identica a create_filtered_calendar().to_ical()"""
+        calendar_data = """BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VEVENT
+SUMMARY:LFT - LINGUAGGI FORMALI E TRADUTTORI
+DESCRIPTION:Una descrizione abbastanza lunga da dover essere spezzata su più righe nel file ICS
+DTSTART:20240101T100000
+DTEND:20240101T110000
+END:VEVENT
+BEGIN:VEVENT
+SUMMARY:MATEMATICA
+DTSTART:20240102T100000
+DTEND:20240102T110000
+END:VEVENT
+END:VCALENDAR"""
+        calendar = self.manager.parse_calendar(calendar_data)
+        selection = ["LFT - LINGUAGGI FORMALI E TRADUTTORI", "MATEMATICA"]
+
+        chunks = list(self.manager.iter_filtered_calendar(calendar, selection))
+        expected = self.manager.create_filtered_calendar(calendar, selection).to_ical()
+
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(b''.join(chunks), expected)
+
+    def test_extract_courses_compact_records(self):
+        """Test eventi estratti come record compatti senza componente"""
+        calendar_data = """BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VEVENT
+SUMMARY:LFT - LINGUAGGI FORMALI E TRADUTTORI
+LOCATION:Aula Magna
+DTSTART:20240101T100000
+DTEND:20240101T110000
+END:VEVENT
+BEGIN:VEVENT
+SUMMARY:LFT - LINGUAGGI FORMALI E TRADUTTORI
+LOCATION:Aula Magna
+DTSTART:20240108T100000
+DTEND:20240108T110000
+END:VEVENT
+END:VCALENDAR"""
+        calendar = self.manager.parse_calendar(calendar_data)
+        events = self.manager.extract_courses(calendar)["LFT - LINGUAGGI FORMALI E TRADUTTORI"]
+
+        self.assertEqual(len(events), 2)
+        self.assertFalse(hasattr(events[0], '__dict__'))
+        self.assertFalse(hasattr(events[0], 'component'))
+        self.assertIs(events[0].location, events[1].location)
+        self.assertIs(events[0].course, events[1].course)
+        self.assertEqual(events[1].start, datetime(2024, 1, 8, 10, 0))
+
     def test_calculate_hash(self):
         """Test calcolo hash"""
         data = "test data"
@@ -182,10 +440,13 @@ class TestAutoUpdate(unittest.TestCase):
         mock_manager = Mock()
         mock_manager_class.return_value = mock_manager
 
-        # Simula mancanza configurazione
-        with patch('auto_update.load_config', return_value=None):
+        # Simula mancanza configurazione: l'errore viene registrato anche in modalità silenziosa
+        with patch('auto_update.load_config', return_value=None), \
+                patch('auto_update.log_event') as mock_log:
             result = auto_update_calendar("https://example.com/calendar.ics", verbose=False)
             self.assertFalse(result)
+        mock_log.assert_called_once()
+        self.assertEqual(mock_log.call_args[0][1], logging.ERROR)
 
     @patch('calendar_manager.UniversityCalendarManager')
     def test_auto_update_calendar_download_failure(self, mock_manager_class):
@@ -229,6 +490,1610 @@ class TestFlaskApp(unittest.TestCase):
         self.assertIn('supported_formats', data)
 
 
+class CalendarAppTestCase(unittest.TestCase):
+    """Base dei test dell'app con calendario di prova e cache svuotate a ogni test"""
+
+    CALENDAR_DATA = """BEGIN:VCALENDAR
+VERSION:2.0
+BEGIN:VEVENT
+UID:evt-1
+SUMMARY:LFT - LINGUAGGI FORMALI E TRADUTTORI
+DTSTART:20240101T100000
+DTEND:20240101T110000
+END:VEVENT
+BEGIN:VEVENT
+UID:evt-2
+SUMMARY:ASD - ALGORITMI E STRUTTURE DATI
+DTSTART:20240102T100000
+DTEND:20240102T110000
+END:VEVENT
+END:VCALENDAR"""
+
+    def setUp(self):
+        """Setup per ogni test"""
+        import app as app_module
+        self.app_module = app_module
+        self.client = app_module.app.test_client()
+        app_module.PARSED_CACHE.clear()
+        app_module.CALENDAR_CACHE.clear()
+        app_module.RENDERED_CACHE.clear()
+        app_module.SERVED_SELECTIONS.clear()
+        app_module.SERVED_MERGED_SELECTIONS.clear()
+        app_module.MERGED_VERSIONS.clear()
+        calendar_manager._CIRCUIT_BREAKERS.clear()
+        self.manager = UniversityCalendarManager("https://example.com/calendar.ics")
+
+    def tearDown(self):
+        """Pulizia dopo ogni test"""
+        self.app_module.PARSED_CACHE.clear()
+        self.app_module.CALENDAR_CACHE.clear()
+        self.app_module.RENDERED_CACHE.clear()
+        self.app_module.SERVED_SELECTIONS.clear()
+        self.app_module.SERVED_MERGED_SELECTIONS.clear()
+        self.app_module.MERGED_VERSIONS.clear()
+        calendar_manager._CIRCUIT_BREAKERS.clear()
+
+    def _cache_calendar(self, url="https://example.com/calendar.ics"):
+        """Inserisce il calendario di test in CALENDAR_CACHE come se fosse stato scaricato"""
+        cache_key = self.app_module.hashlib.md5(url.encode()).hexdigest()
+        self.app_module.CALENDAR_CACHE[cache_key] = {
+            'data': self.CALENDAR_DATA,
+            'hash': self.manager.calculate_hash(self.CALENDAR_DATA),
+            'changed_at': 1704103200.0,
+            'timestamp': self.app_module.time.time(),
+            'url': url
+        }
+        return url
+
+    def _ical_path(self, url, corsi, refresh=False):
+        """Costruisce l'URL /api/ical con la configurazione codificata"""
+        import base64
+        cfg = base64.urlsafe_b64encode(json.dumps({
+            'session_id': 'abc', 'url': url, 'corsi': corsi
+        }).encode()).decode().rstrip('=')
+        return f'/api/ical?cfg={cfg}' + ('&refresh=true' if refresh else '')
+
+
+class TestParsedCalendarCache(CalendarAppTestCase):
+    """Test per la cache dei calendari parsificati"""
+
+    def test_same_content_parsed_once(self):
+        """Test parsing unico per la stessa versione del calendario"""
+        with patch.object(UniversityCalendarManager, 'parse_calendar',
+                          wraps=self.manager.parse_calendar) as mock_parse:
+            first = self.app_module.get_parsed_calendar(self.manager, self.CALENDAR_DATA)
+            second = self.app_module.get_parsed_calendar(self.manager, self.CALENDAR_DATA)
+
+        self.assertIs(first, second)
+        self.assertEqual(mock_parse.call_count, 1)
+
+    def test_parsed_cache_is_bounded(self):
+        """Test limite sul numero di versioni parsificate"""
+        with patch.object(self.app_module, 'PARSED_CACHE_MAX_ENTRIES', 2):
+            for i in range(3):
+                data = self.CALENDAR_DATA.replace('evt-1', f'evt-{i + 10}')
+                self.app_module.get_parsed_calendar(self.manager, data)
+
+        self.assertEqual(len(self.app_module.PARSED_CACHE), 2)
+
+    def test_parsed_entry_keeps_only_compact_events(self):
+        """Test voce parsificata senza componenti icalendar, con lo stesso output del percorso completo"""
+        from calendar_manager import ScannedEvent
+        selection = ['LFT - LINGUAGGI FORMALI E TRADUTTORI']
+        with patch.object(self.app_module, 'FAST_ICS_SCANNER', False):
+            parsed = self.app_module.get_parsed_calendar(self.manager, self.CALENDAR_DATA)
+
+        self.assertNotIn('calendar', parsed)
+        self.assertTrue(all(isinstance(event, ScannedEvent)
+                            for events in parsed['index'].values() for event in events))
+        calendar = self.manager.parse_calendar(self.CALENDAR_DATA)
+        self.assertEqual(self.app_module.render_filtered_calendar(self.manager, parsed, selection),
+                         b''.join(self.manager.iter_filtered_calendar(calendar, selection)))
+        self.assertEqual(self.app_module.get_courses(self.manager, parsed),
+                         self.manager.summarize_courses(self.manager.extract_courses(calendar)))
+
+    def test_serve_ical_reuses_parsed_calendar(self):
+        """Test riuso del calendario parsificato tra richieste iCal"""
+        url = self._cache_calendar()
+        path = self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+
+        with patch.object(UniversityCalendarManager, 'parse_calendar',
+                          wraps=self.manager.parse_calendar) as mock_parse:
+            for _ in range(3):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b'LINGUAGGI FORMALI', response.data)
+                self.assertNotIn(b'ALGORITMI', response.data)
+
+        self.assertEqual(mock_parse.call_count, 1)
+
+    def test_serve_ical_reuses_rendered_output(self):
+        """Test riuso dell'output serializzato per selezioni equivalenti"""
+        url = self._cache_calendar()
+        selections = [
+            ['LFT - LINGUAGGI FORMALI E TRADUTTORI', 'ASD - ALGORITMI E STRUTTURE DATI'],
+            ['ASD - ALGORITMI E STRUTTURE DATI', 'LFT - LINGUAGGI FORMALI E TRADUTTORI',
+             'ASD - ALGORITMI E STRUTTURE DATI'],
+        ]
+
+        with patch.object(UniversityCalendarManager, 'iter_filtered_ics',
+                          wraps=self.manager.iter_filtered_ics) as mock_filter:
+            bodies = []
+            for corsi in selections:
+                bodies.append(self.client.get(self._ical_path(url, corsi)).data)
+
+        self.assertEqual(mock_filter.call_count, 1)
+        self.assertEqual(bodies[0], bodies[1])
+
+    def test_serve_ical_conditional_request(self):
+        """Test risposta 304 senza parsing con If-None-Match / If-Modified-Since"""
+        url = self._cache_calendar()
+        path = self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        first = self.client.get(path)
+        etag = first.headers['ETag']
+        last_modified = first.headers['Last-Modified']
+        self.assertEqual(last_modified, 'Mon, 01 Jan 2024 10:00:00 GMT')
+
+        self.app_module.RENDERED_CACHE.clear()
+        self.app_module.PARSED_CACHE.clear()
+        with patch.object(UniversityCalendarManager, 'parse_calendar') as mock_parse:
+            by_etag = self.client.get(path, headers={'If-None-Match': etag})
+            by_date = self.client.get(path, headers={'If-Modified-Since': last_modified})
+            mock_parse.assert_not_called()
+
+        self.assertEqual(by_etag.status_code, 304)
+        self.assertEqual(by_date.status_code, 304)
+        self.assertEqual(by_etag.headers['ETag'], etag)
+
+        other = self.client.get(self._ical_path(url, ['ASD - ALGORITMI E STRUTTURE DATI']),
+                                headers={'If-None-Match': etag})
+        self.assertEqual(other.status_code, 200)
+
+
+    def test_serve_ical_stale_while_revalidate(self):
+        """Test copia scaduta servita subito con aggiornamento in background"""
+        url = self._cache_calendar()
+        cache_key = self.app_module.hashlib.md5(url.encode()).hexdigest()
+        self.app_module.CALENDAR_CACHE[cache_key]['timestamp'] -= self.app_module.CACHE_DURATION + 60
+
+        with patch.object(self.app_module, 'schedule_refresh') as mock_refresh, \
+                patch.object(self.app_module, 'download_and_cache_calendar') as mock_download:
+            response = self.client.get(self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI']))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'LINGUAGGI FORMALI', response.data)
+        mock_refresh.assert_called_once_with(url, cache_key, force=False)
+        mock_download.assert_not_called()
+
+    def test_serve_ical_refresh_param_revalidates_async(self):
+        """Test parametro refresh=true con riconvalida asincrona"""
+        url = self._cache_calendar()
+        cache_key = self.app_module.hashlib.md5(url.encode()).hexdigest()
+
+        stats = dict(self.app_module.CALENDAR_CACHE_STATS)
+
+        with patch.object(self.app_module, 'schedule_refresh') as mock_refresh:
+            response = self.client.get(
+                self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI'], refresh=True)
+            )
+
+        self.assertEqual(response.status_code, 200)
+        mock_refresh.assert_called_once_with(url, cache_key, force=True)
+        # Copia recente: riconvalida forzata, non copia scaduta
+        self.assertEqual(self.app_module.CALENDAR_CACHE_STATS['revalidations'], stats['revalidations'] + 1)
+        self.assertEqual(self.app_module.CALENDAR_CACHE_STATS['stale'], stats['stale'])
+
+    def test_refresh_hot_calendars(self):
+        """Test aggiornamento anticipato solo dei calendari caldi in scadenza"""
+        now = self.app_module.time.time()
+        expiring = now - self.app_module.CACHE_DURATION + 60
+        entries = {
+            'hot-expiring': {'timestamp': expiring, 'last_access': now},
+            'cold-expiring': {'timestamp': expiring, 'last_access': 0},
+            'hot-fresh': {'timestamp': now, 'last_access': now},
+        }
+        for key, entry in entries.items():
+            self.app_module.CALENDAR_CACHE[key] = dict(entry, url=f'https://example.com/{key}')
+
+        with patch.object(self.app_module, 'schedule_refresh', return_value=True) as mock_refresh:
+            scheduled = self.app_module.refresh_hot_calendars(now)
+
+        self.assertEqual(scheduled, 1)
+        mock_refresh.assert_called_once_with('https://example.com/hot-expiring', 'hot-expiring')
+
+    def test_prewarm_served_selections_on_change(self):
+        """Test rigenerazione delle selezioni servite quando il calendario cambia"""
+        url = self._cache_calendar()
+        cache_key = self.app_module.hashlib.md5(url.encode()).hexdigest()
+        selection = ('LFT - LINGUAGGI FORMALI E TRADUTTORI',)
+        self.client.get(self._ical_path(url, list(selection))).data
+
+        previous = self.app_module.CALENDAR_CACHE[cache_key]
+        new_data = self.CALENDAR_DATA.replace('20240101T100000', '20240101T120000')
+        new_entry = dict(previous, data=new_data, hash=self.manager.calculate_hash(new_data))
+        # Nella richiesta la nuova versione viene solo installata: niente parsing né confronto
+        with patch.object(self.app_module.PREWARM_EXECUTOR, 'submit') as mock_submit, \
+                patch.object(UniversityCalendarManager, 'parse_calendar') as mock_parse:
+            self.app_module.store_calendar_entry(cache_key, new_entry)
+            mock_parse.assert_not_called()
+
+        self.assertIs(self.app_module.CALENDAR_CACHE[cache_key], new_entry)
+        mock_submit.assert_called_once_with(self.app_module._handle_version_change,
+                                            cache_key, previous, new_entry, [selection], [])
+        self.assertEqual(self.app_module.prewarm_selections(cache_key, new_entry, [selection]), 1)
+
+        with patch.object(self.app_module, 'iter_filtered_calendar') as mock_render:
+            response = self.client.get(self._ical_path(url, list(selection)))
+            mock_render.assert_not_called()
+        self.assertIn(b'20240101T120000', response.data)
+
+    def test_analyze_then_generate_parses_once(self):
+        """Test analisi e generazione con un solo parsing, dalla cache dei calendari"""
+        url = self._cache_calendar()
+        with patch.object(UniversityCalendarManager, 'download_calendar') as mock_download, \
+                patch.object(UniversityCalendarManager, 'parse_calendar',
+                             wraps=self.manager.parse_calendar) as mock_parse:
+            analysis = json.loads(self.client.post('/api/analyze_calendar',
+                                                   json={'calendar_url': url}).data)
+            generated = json.loads(self.client.post('/api/generate_calendar', json={
+                'session_id': analysis['session_id'],
+                'calendar_url': url,
+                'selected_courses': ['LFT - LINGUAGGI FORMALI E TRADUTTORI']
+            }).data)
+            mock_download.assert_not_called()
+
+        self.assertEqual(mock_parse.call_count, 1)
+        self.assertEqual(analysis['session_id'], self.manager.calculate_hash(self.CALENDAR_DATA))
+        self.assertTrue(generated['success'])
+
+        download_id = generated['download_url'].rsplit('/', 1)[-1]
+        self.addCleanup(self.app_module.SESSION_STORE._remove, f'{download_id}_filtered.ics')
+        download = self.client.get(generated['download_url'])
+        self.assertEqual(download.status_code, 200)
+        self.assertIn(b'evt-1', download.data)
+        self.assertNotIn(b'evt-2', download.data)
+        download.close()
+
+        # Sessione non più in memoria: stessa versione dalla cache dei calendari
+        self.app_module.PARSED_CACHE.clear()
+        with patch.object(UniversityCalendarManager, 'parse_calendar',
+                          wraps=self.manager.parse_calendar) as mock_parse:
+            regenerated = self.client.post('/api/generate_calendar', json={
+                'session_id': analysis['session_id'],
+                'calendar_url': url,
+                'selected_courses': ['ASD - ALGORITMI E STRUTTURE DATI']
+            })
+        self.assertEqual(regenerated.status_code, 200)
+        self.assertEqual(mock_parse.call_count, 1)
+        regenerated_id = json.loads(regenerated.data)['download_url'].rsplit('/', 1)[-1]
+        self.addCleanup(self.app_module.SESSION_STORE._remove, f'{regenerated_id}_filtered.ics')
+        download = self.client.get(f'/download/{regenerated_id}')
+        self.assertIn(b'evt-2', download.data)
+        self.assertNotIn(b'evt-1', download.data)
+        download.close()
+
+    def test_session_of_replaced_version_expires(self):
+        """Test sessione di una versione non più corrente: nessuna sostituzione silenziosa"""
+        url = self._cache_calendar()
+        session_id = self.manager.calculate_hash(self.CALENDAR_DATA)
+        new_data = self.CALENDAR_DATA.replace('20240101T100000', '20240101T120000')
+        cache_key = self.app_module.hashlib.md5(url.encode()).hexdigest()
+        self.app_module.CALENDAR_CACHE[cache_key].update(
+            data=new_data, hash=self.manager.calculate_hash(new_data))
+        request = {'session_id': session_id, 'calendar_url': url,
+                   'selected_courses': ['LFT - LINGUAGGI FORMALI E TRADUTTORI']}
+
+        generated = self.client.post('/api/generate_calendar', json=request)
+        linked = self.client.post('/api/create_permanent_link', json=request)
+        unknown = self.client.post('/api/create_permanent_link', json=dict(request, session_id='unknown'))
+
+        for response in (generated, linked, unknown):
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data)['error'], 'Sessione scaduta')
+        self.assertTrue(self.app_module.is_known_session(
+            self.manager.calculate_hash(new_data), url))
+
+    def test_unchanged_selections_survive_upstream_change(self):
+        """Test filtrati dei corsi non modificati riusati con gli stessi byte e validatori"""
+        url = self._cache_calendar()
+        cache_key = self.app_module.hashlib.md5(url.encode()).hexdigest()
+        lft = self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        asd = self._ical_path(url, ['ASD - ALGORITMI E STRUTTURE DATI'])
+        before = {path: self.client.get(path) for path in (lft, asd)}
+        for response in before.values():
+            response.data
+
+        # Nuova versione: cambia solo una lezione di ASD
+        new_data = self.CALENDAR_DATA.replace('20240102T100000', '20240102T140000')
+        new_entry = dict(self.app_module.CALENDAR_CACHE[cache_key], data=new_data,
+                         hash=self.manager.calculate_hash(new_data), changed_at=1704200000.0)
+        with patch.object(self.app_module.PREWARM_EXECUTOR, 'submit') as mock_submit:
+            self.app_module.store_calendar_entry(cache_key, new_entry)
+        # Esegue il lavoro programmato in background
+        mock_submit.call_args[0][0](*mock_submit.call_args[0][1:])
+
+        with patch.object(self.app_module, 'iter_filtered_calendar') as mock_render:
+            unchanged = self.client.get(lft)
+            revalidated = self.client.get(lft, headers={'If-None-Match': before[lft].headers['ETag']})
+            mock_render.assert_not_called()
+        self.assertEqual(unchanged.data, before[lft].data)
+        self.assertEqual(unchanged.headers['ETag'], before[lft].headers['ETag'])
+        self.assertEqual(unchanged.headers['Last-Modified'], before[lft].headers['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        changed = self.client.get(asd)
+        self.assertIn(b'20240102T140000', changed.data)
+        self.assertNotEqual(changed.headers['ETag'], before[asd].headers['ETag'])
+
+    def test_merged_selections_follow_upstream_change(self):
+        """Test calendari uniti riusati o preriscaldati quando cambia uno dei calendari originali"""
+        import base64
+        url = self._cache_calendar()
+        other_url = self._cache_calendar("https://example.com/other.ics")
+        cache_key = self.app_module.hashlib.md5(url.encode()).hexdigest()
+
+        def merged_path(courses):
+            cfg = base64.urlsafe_b64encode(json.dumps({'session_id': 'abc', 'feeds': [
+                {'url': url, 'corsi': courses},
+                {'url': other_url, 'corsi': ['LFT - LINGUAGGI FORMALI E TRADUTTORI']}
+            ]}).encode()).decode().rstrip('=')
+            return f'/api/ical?cfg={cfg}'
+
+        lft = merged_path(['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        asd = merged_path(['ASD - ALGORITMI E STRUTTURE DATI'])
+        before = {path: self.client.get(path) for path in (lft, asd)}
+        for response in before.values():
+            response.data
+
+        new_data = self.CALENDAR_DATA.replace('20240102T100000', '20240102T140000')
+        new_entry = dict(self.app_module.CALENDAR_CACHE[cache_key], data=new_data,
+                         hash=self.manager.calculate_hash(new_data))
+        prewarmed = self.app_module.PREWARM_STATS['rendered']
+        with patch.object(self.app_module.PREWARM_EXECUTOR, 'submit') as mock_submit:
+            self.app_module.store_calendar_entry(cache_key, new_entry)
+        mock_submit.call_args[0][0](*mock_submit.call_args[0][1:])
+
+        self.assertEqual(self.app_module.PREWARM_STATS['rendered'] - prewarmed, 1)
+
+        with patch.object(self.app_module, 'iter_merged_calendar') as mock_render:
+            unchanged = self.client.get(lft)
+            changed = self.client.get(asd)
+            mock_render.assert_not_called()
+        self.assertEqual(unchanged.data, before[lft].data)
+        self.assertEqual(unchanged.headers['ETag'], before[lft].headers['ETag'])
+        self.assertIn(b'20240102T140000', changed.data)
+        self.assertNotEqual(changed.headers['ETag'], before[asd].headers['ETag'])
+
+    def test_generated_calendar_keeps_ical_validators(self):
+        """Test filtrato generato per il download servito dal link iCal con gli stessi validatori"""
+        url = self._cache_calendar()
+        selection = ['LFT - LINGUAGGI FORMALI E TRADUTTORI']
+        generated = json.loads(self.client.post('/api/generate_calendar', json={
+            'session_id': self.manager.calculate_hash(self.CALENDAR_DATA),
+            'calendar_url': url,
+            'selected_courses': selection
+        }).data)
+        download_id = generated['download_url'].rsplit('/', 1)[-1]
+        self.addCleanup(self.app_module.SESSION_STORE._remove, f'{download_id}_filtered.ics')
+
+        with patch.object(self.app_module, 'iter_filtered_calendar') as mock_render:
+            response = self.client.get(self._ical_path(url, selection))
+            mock_render.assert_not_called()
+        self.assertEqual(response.headers['ETag'], f'"{download_id}"')
+        self.assertEqual(response.last_modified.timestamp(), 1704103200.0)
+
+    def test_changed_courses_from_event_diff(self):
+        """Test corsi modificati individuati confrontando UID e contenuto degli eventi"""
+        new_data = self.CALENDAR_DATA.replace('UID:evt-2', 'UID:evt-2b')
+        old = self.manager.event_fingerprints(
+            self.manager.build_course_index(self.manager.parse_calendar(self.CALENDAR_DATA)))
+        new = self.manager.event_fingerprints(
+            self.manager.build_course_index(self.manager.parse_calendar(new_data)))
+        scanned = self.manager.event_fingerprints(self.manager.scan_calendar(new_data).index)
+
+        self.assertEqual(self.manager.changed_courses(old, old), set())
+        self.assertEqual(self.manager.changed_courses(old, new), {'ASD - ALGORITMI E STRUTTURE DATI'})
+        self.assertEqual([uid for uid, _ in scanned['ASD - ALGORITMI E STRUTTURE DATI']], ['evt-2b'])
+
+    def test_prewarm_skips_stale_selections(self):
+        """Test selezioni non servite di recente escluse dal preriscaldamento"""
+        now = self.app_module.time.time()
+        self.app_module.record_served_selection('key', ('A',), now - self.app_module.PREWARM_WINDOW)
+        self.app_module.record_served_selection('key', ('B',), now)
+
+        self.assertEqual(self.app_module.recent_selections('key', now), [('B',)])
+        self.assertEqual(self.app_module.recent_selections('other', now), [])
+
+
+    def test_serve_ical_precompressed_variants(self):
+        """Test varianti precompresse scelte in base ad Accept-Encoding"""
+        import gzip
+        url = self._cache_calendar()
+        path = self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        plain = self.client.get(path, headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertIn(b'LINGUAGGI FORMALI', plain.data)
+
+        with patch('calendar_cache.gzip.compress') as mock_compress:
+            compressed = self.client.get(path, headers={'Accept-Encoding': 'gzip, deflate'})
+            mock_compress.assert_not_called()
+
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        self.assertNotEqual(compressed.headers['ETag'], plain.headers['ETag'])
+
+        revalidated = self.client.get(path, headers={'Accept-Encoding': 'gzip',
+                                                     'If-None-Match': plain.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+
+class TestRenderedCalendarCache(unittest.TestCase):
+    """Test per la cache dei calendari filtrati serializzati"""
+
+    def test_choose_encoding(self):
+        """Test negoziazione della codifica"""
+        self.assertEqual(choose_encoding('gzip, deflate', {'identity', 'gzip'}), 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0', {'identity', 'gzip'}), 'identity')
+        self.assertEqual(choose_encoding('*', {'identity', 'gzip'}), 'gzip')
+        self.assertEqual(choose_encoding(None, {'identity', 'gzip'}), 'identity')
+        self.assertEqual(choose_encoding('gzip', {'identity'}), 'identity')
+
+    def test_rendered_calendar_variants(self):
+        """Test varianti compresse prodotte una volta sola"""
+        import gzip
+        data = b'BEGIN:VCALENDAR\r\n' + b'BEGIN:VEVENT\r\nEND:VEVENT\r\n' * 100
+        rendered = RenderedCalendar.from_ics(data)
+
+        self.assertEqual(rendered.variants['identity'], data)
+        self.assertEqual(gzip.decompress(rendered.variants['gzip']), data)
+        self.assertLess(len(rendered.variants['gzip']), len(data))
+        self.assertEqual(len(rendered), sum(len(v) for v in rendered.variants.values()))
+
+    def test_canonical_selection(self):
+        """Test forma canonica della selezione"""
+        self.assertEqual(canonical_selection(['B', 'A', 'B']), ('A', 'B'))
+
+    def test_evicts_least_recently_used_by_bytes(self):
+        """Test eliminazione LRU in base alla dimensione totale"""
+        cache = RenderedCalendarCache(max_bytes=10)
+        cache.put('h', ('A',), b'aaaa')
+        cache.put('h', ('B',), b'bbbb')
+        cache.get('h', ('A',))
+        cache.put('h', ('C',), b'cccc')
+
+        self.assertEqual(cache.get('h', ('A',)), b'aaaa')
+        self.assertIsNone(cache.get('h', ('B',)))
+        self.assertEqual(cache.total_bytes, 8)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_rekey_keeps_unchanged_selections(self):
+        """Test voci ancora valide spostate alla nuova versione"""
+        cache = RenderedCalendarCache(max_bytes=100)
+        cache.put('old', ('A',), RenderedCalendar({'identity': b'aaa'}, etag='e1', last_modified=1.0))
+        cache.put('old', ('B',), b'bbb')
+
+        self.assertEqual(cache.rekey('old', 'new', lambda selection: 'B' not in selection), 1)
+        self.assertEqual(cache.get('new', ('A',)).etag, 'e1')
+        self.assertIsNone(cache.get('new', ('B',)))
+        self.assertEqual(cache.selections('old'), [])
+        self.assertEqual(cache.total_bytes, 3)
+
+    def test_invalidate_upstream_version(self):
+        """Test invalidazione delle voci di una versione precedente"""
+        cache = RenderedCalendarCache(max_bytes=100)
+        cache.put('old', ('A',), b'old')
+        cache.put('new', ('A',), b'new')
+
+        self.assertEqual(cache.invalidate('old'), 1)
+        self.assertIsNone(cache.get('old', ('A',)))
+        self.assertEqual(cache.get('new', ('A',)), b'new')
+        self.assertEqual(cache.total_bytes, 3)
+
+
+class TestFastIcsScanner(unittest.TestCase):
+    """Test di parità tra scanner veloce e Calendar.from_ical"""
+
+    CALENDAR_DATA = "\r\n".join([
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Cineca//UP//IT",
+        "BEGIN:VTIMEZONE",
+        "TZID:Europe/Rome",
+        "BEGIN:STANDARD",
+        "DTSTART:19701025T030000",
+        "TZOFFSETFROM:+0200",
+        "TZOFFSETTO:+0100",
+        "END:STANDARD",
+        "END:VTIMEZONE",
+        "BEGIN:VEVENT",
+        "UID:evt-1@unito",
+        "SUMMARY:LFT - LINGUAGGI FORMALI E TRADUTTORI (Turno A\\, T1)",
+        "DESCRIPTION:Lezione con una descrizione molto lunga che viene spezzata su ",
+        " più righe secondo la RFC 5545",
+        "LOCATION:Aula Magna\\, Corso Svizzera 185",
+        "DTSTART;TZID=Europe/Rome:20240101T100000",
+        "DTEND;TZID=Europe/Rome:20240101T120000",
+        "BEGIN:VALARM",
+        "ACTION:DISPLAY",
+        "DESCRIPTION:Promemoria",
+        "TRIGGER:-PT15M",
+        "END:VALARM",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "UID:evt-2@unito",
+        "SUMMARY:ASD - ALGORITMI E STRUTTURE DATI - LABORA",
+        " TORIO",
+        "LOCATION:Laboratorio Dijkstra",
+        "DTSTART;TZID=Europe/Rome:20240102T140000",
+        "DTEND;TZID=Europe/Rome:20240102T160000",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "UID:evt-3@unito",
+        "SUMMARY:MATEMATICA DISCRETA",
+        "DTSTART;VALUE=DATE:20240103",
+        "DTEND;VALUE=DATE:20240104",
+        "END:VEVENT",
+        "BEGIN:VEVENT",
+        "UID:evt-4@unito",
+        "SUMMARY:LFT - LINGUAGGI FORMALI E TRADUTTORI",
+        "LOCATION:Aula 1",
+        "DTSTART:20240104T090000Z",
+        "DTEND:20240104T110000Z",
+        "END:VEVENT",
+        "END:VCALENDAR",
+        ""
+    ])
+
+    def setUp(self):
+        """Setup per ogni test"""
+        self.manager = UniversityCalendarManager("https://example.com/calendar.ics")
+        self.calendar = self.manager.parse_calendar(self.CALENDAR_DATA)
+        self.scanned = self.manager.scan_calendar(self.CALENDAR_DATA)
+
+    def _events(self, ics_bytes):
+        """Eventi di un calendario serializzato, in forma confrontabile"""
+        calendar = Calendar.from_ical(ics_bytes)
+        return sorted(
+            (str(e.get('uid')), str(e.get('summary')), e.get('dtstart').dt.isoformat())
+            for e in calendar.walk('VEVENT')
+        )
+
+    def test_courses_parity(self):
+        """Test stessi corsi, luoghi e orari con i due percorsi"""
+        expected = self.manager.extract_courses(self.calendar)
+        scanned = self.manager.extract_scanned_courses(self.scanned)
+
+        self.assertEqual(sorted(expected), sorted(scanned))
+        for course_name, events in expected.items():
+            self.assertEqual(
+                [(e.summary, e.location, e.start, e.end) for e in events],
+                [(e.summary, e.location, e.start, e.end) for e in scanned[course_name]]
+            )
+
+    def test_filtered_output_parity(self):
+        """Test stessi eventi nei calendari filtrati con i due percorsi"""
+        selections = [
+            ["LFT - LINGUAGGI FORMALI E TRADUTTORI"],
+            ["ASD - ALGORITMI E STRUTTURE DATI - LABORATORIO", "MATEMATICA DISCRETA"],
+            list(self.manager.build_course_index(self.calendar)),
+            ["INESISTENTE"],
+        ]
+        for selection in selections:
+            expected = self.manager.create_filtered_calendar(self.calendar, selection).to_ical()
+            fast = self.manager.create_filtered_ics(self.scanned, selection)
+            self.assertEqual(self._events(expected), self._events(fast))
+
+    def test_filtered_output_reuses_original_bytes(self):
+        """Test riuso dei byte originali dell'evento (con sotto-componenti)"""
+        fast = self.manager.create_filtered_ics(self.scanned, ["LFT - LINGUAGGI FORMALI E TRADUTTORI"])
+        self.assertIn(b"BEGIN:VALARM", fast)
+        self.assertIn(b" pi\xc3\xb9 righe", fast)
+        self.assertTrue(fast.endswith(b"END:VCALENDAR\r\n"))
+
+    def test_scan_invalid_calendar(self):
+        """Test scansione di dati non validi"""
+        self.assertIsNone(self.manager.scan_calendar("INVALID DATA"))
+
+    def test_app_uses_fast_scanner(self):
+        """Test calendario iCal servito tramite scanner veloce"""
+        import app as app_module
+        app_module.PARSED_CACHE.clear()
+        app_module.RENDERED_CACHE.clear()
+        try:
+            with patch.object(app_module, 'FAST_ICS_SCANNER', True), \
+                    patch.object(UniversityCalendarManager, 'parse_calendar') as mock_parse:
+                parsed = app_module.get_parsed_calendar(self.manager, self.CALENDAR_DATA)
+                data = app_module.render_filtered_calendar(
+                    self.manager, parsed, ["MATEMATICA DISCRETA"]
+                )
+                mock_parse.assert_not_called()
+        finally:
+            app_module.PARSED_CACHE.clear()
+
+        self.assertEqual([e[0] for e in self._events(data)], ['evt-3@unito'])
+
+
+class TestSharedCalendarStore(unittest.TestCase):
+    """Test per la cache condivisa tra i worker"""
+
+    CALENDAR_DATA = CalendarAppTestCase.CALENDAR_DATA
+
+    def setUp(self):
+        """Setup per ogni test"""
+        import app as app_module
+        from shared_cache import SharedCalendarStore
+        self.app_module = app_module
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SharedCalendarStore(self.tmpdir.name, max_rendered_bytes=10)
+        for cache in (app_module.CALENDAR_CACHE, app_module.PARSED_CACHE):
+            cache.clear()
+        app_module.RENDERED_CACHE.clear()
+        self.url = "https://example.com/calendar.ics"
+        self.cache_key = app_module.hashlib.md5(self.url.encode()).hexdigest()
+        self.manager = UniversityCalendarManager(self.url)
+
+    def tearDown(self):
+        """Pulizia dopo ogni test"""
+        for cache in (self.app_module.CALENDAR_CACHE, self.app_module.PARSED_CACHE):
+            cache.clear()
+        self.app_module.RENDERED_CACHE.clear()
+        UniversityCalendarManager._upstream_state.clear()
+        self.tmpdir.cleanup()
+
+    def _shared_entry(self, timestamp):
+        """Voce come salvata da un altro worker"""
+        return {
+            'data': self.CALENDAR_DATA,
+            'hash': self.manager.calculate_hash(self.CALENDAR_DATA),
+            'etag': '"v1"',
+            'last_modified': None,
+            'changed_at': 1704103200.0,
+            'timestamp': timestamp,
+            'url': self.url
+        }
+
+    def test_upstream_roundtrip(self):
+        """Test salvataggio e lettura del calendario originale"""
+        entry = self._shared_entry(123.0)
+        self.store.put_upstream(self.cache_key, entry)
+
+        self.assertEqual(self.store.get_upstream(self.cache_key), entry)
+        self.assertEqual(self.store.get_upstream_timestamp(self.cache_key), 123.0)
+        self.assertIsNone(self.store.get_upstream('missing'))
+
+    def test_rendered_pruned_and_invalidated(self):
+        """Test limite di dimensione e invalidazione dei filtrati condivisi"""
+        self.store.put_rendered('h1', ('A',), RenderedCalendar({'identity': b'aaaaaa'}))
+        self.store.put_rendered('h2', ('B',), RenderedCalendar({'identity': b'bbbbbb'}))
+        self.assertIsNone(self.store.get_rendered('h1', ('A',)))
+        self.assertEqual(self.store.get_rendered('h2', ('B',)).variants, {'identity': b'bbbbbb'})
+
+        self.store.delete_rendered('h2')
+        self.assertIsNone(self.store.get_rendered('h2', ('B',)))
+
+    def test_rendered_rekeyed_with_validators(self):
+        """Test filtrati condivisi spostati alla nuova versione con i loro validatori"""
+        self.store.max_rendered_bytes = 1000
+        self.store.put_rendered('h1', ('A',), RenderedCalendar({'identity': b'a'}, '"e1"', 5.0))
+        self.store.put_rendered('h1', ('B',), RenderedCalendar({'identity': b'b'}))
+
+        self.assertEqual(self.store.rekey_rendered('h1', 'h2', lambda sel: sel == ('A',)), 1)
+        moved = self.store.get_rendered('h2', ('A',))
+        self.assertEqual((moved.variants, moved.etag, moved.last_modified),
+                         ({'identity': b'a'}, '"e1"', 5.0))
+        self.assertIsNone(self.store.get_rendered('h2', ('B',)))
+        self.assertFalse(self.store.has_rendered('h1'))
+
+    def test_old_schema_migrated_without_losing_rendered(self):
+        """Test aggiornamento di un database della prima versione senza perdere i filtrati"""
+        import sqlite3
+        from shared_cache import SharedCalendarStore, SCHEMA_VERSION
+        directory = os.path.join(self.tmpdir.name, 'old')
+        os.makedirs(directory)
+        conn = sqlite3.connect(os.path.join(directory, 'calendar_cache.sqlite3'))
+        conn.execute('CREATE TABLE rendered (calendar_hash TEXT NOT NULL, selection TEXT NOT NULL, '
+                     'data BLOB NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, '
+                     'PRIMARY KEY (calendar_hash, selection))')
+        conn.execute('INSERT INTO rendered VALUES (?, ?, ?, ?, ?)',
+                     ('h1', json.dumps(['A']), b'a', 1, 1.0))
+        conn.commit()
+        conn.close()
+
+        store = SharedCalendarStore(directory)
+        # Un secondo worker che apre lo stesso database non ripete la migrazione
+        SharedCalendarStore(directory)
+
+        kept = store.get_rendered('h1', ('A',))
+        self.assertEqual((kept.variants, kept.etag, kept.last_modified),
+                         ({'identity': b'a'}, None, None))
+        version = store._connection().execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, SCHEMA_VERSION)
+        store.put_rendered('h2', ('B',), RenderedCalendar({'identity': b'b', 'gzip': b'z'}, '"e"', 2.0))
+        self.assertEqual(store.get_rendered('h2', ('B',)).variants, {'identity': b'b', 'gzip': b'z'})
+
+    def test_worker_adopts_shared_calendar(self):
+        """Test calendario scaricato da un altro worker usato senza download"""
+        self.store.put_upstream(self.cache_key, self._shared_entry(self.app_module.time.time()))
+        self.store.put_rendered(self.manager.calculate_hash(self.CALENDAR_DATA),
+                                ('MATEMATICA',), RenderedCalendar({'identity': b'shared',
+                                                                   'gzip': b'gz'}))
+
+        with patch.object(self.app_module, 'SHARED_STORE', self.store), \
+                patch.object(UniversityCalendarManager, 'download_calendar') as mock_download:
+            entry = self.app_module.download_and_cache_calendar(self.url, self.cache_key)
+            data = self.app_module.get_rendered_calendar(entry['hash'], ('MATEMATICA',))
+            mock_download.assert_not_called()
+
+        self.assertEqual(self.app_module.CALENDAR_CACHE[self.cache_key]['data'], self.CALENDAR_DATA)
+        self.assertEqual(UniversityCalendarManager._upstream_state[self.url]['etag'], '"v1"')
+        self.assertEqual(data.variants, {'identity': b'shared', 'gzip': b'gz'})
+
+    def test_download_published_to_shared_store(self):
+        """Test calendario scaricato salvato per gli altri worker"""
+        def fake_download(manager, deadline=None):
+            manager.last_download = {'hash': manager.calculate_hash(self.CALENDAR_DATA),
+                                     'etag': None, 'last_modified': None, 'not_modified': False}
+            return self.CALENDAR_DATA
+
+        with patch.object(self.app_module, 'SHARED_STORE', self.store), \
+                patch.object(UniversityCalendarManager, 'download_calendar', fake_download):
+            self.app_module.download_and_cache_calendar(self.url, self.cache_key)
+
+        self.assertEqual(self.store.get_upstream(self.cache_key)['data'], self.CALENDAR_DATA)
+
+
+class TestSubscriptionStore(unittest.TestCase):
+    """Test per le iscrizioni con ID breve"""
+
+    CALENDAR_DATA = CalendarAppTestCase.CALENDAR_DATA
+
+    def setUp(self):
+        """Setup per ogni test"""
+        import app as app_module
+        from subscription_store import SubscriptionStore
+        self.app_module = app_module
+        self.client = app_module.app.test_client()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'subscriptions.sqlite3')
+        self.store = SubscriptionStore(self.db_path)
+        self.url = "https://example.com/calendar.ics"
+        app_module.CALENDAR_CACHE.clear()
+        app_module.PARSED_CACHE.clear()
+        app_module.RENDERED_CACHE.clear()
+
+    def tearDown(self):
+        """Pulizia dopo ogni test"""
+        self.app_module.CALENDAR_CACHE.clear()
+        self.app_module.PARSED_CACHE.clear()
+        self.app_module.RENDERED_CACHE.clear()
+        self.tmpdir.cleanup()
+
+    def test_same_selection_same_id(self):
+        """Test ID identico per selezioni equivalenti"""
+        first = self.store.create_feeds([(self.url, ['B', 'A', 'A'])])
+        second = self.store.create_feeds([(self.url, ['A', 'B'])])
+        other = self.store.create_feeds([(self.url, ['A'])])
+
+        self.assertEqual(first.id, second.id)
+        self.assertNotEqual(first.id, other.id)
+        self.assertEqual(len(first.id), 16)
+        self.assertEqual(first.feeds[0].courses, frozenset({'A', 'B'}))
+        self.assertEqual(first.feeds[0].selection, ('A', 'B'))
+
+    def test_subscription_persisted(self):
+        """Test iscrizione letta dal database da un altro processo"""
+        from subscription_store import SubscriptionStore
+        created = self.store.create_feeds([(self.url, ['MATEMATICA'])])
+
+        loaded = SubscriptionStore(self.db_path).get(created.id).feeds[0]
+
+        self.assertEqual(loaded.url, self.url)
+        self.assertEqual(loaded.selection, ('MATEMATICA',))
+        self.assertEqual(loaded.cache_key, created.feeds[0].cache_key)
+        self.assertIsNone(self.store.get('missing'))
+
+    def test_serve_subscription(self):
+        """Test calendario servito tramite ID breve"""
+        manager = UniversityCalendarManager(self.url)
+        subscription = self.store.create_feeds([(self.url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])])
+        self.app_module.CALENDAR_CACHE[subscription.feeds[0].cache_key] = {
+            'data': self.CALENDAR_DATA,
+            'hash': manager.calculate_hash(self.CALENDAR_DATA),
+            'changed_at': 1704103200.0,
+            'timestamp': self.app_module.time.time(),
+            'url': self.url
+        }
+
+        with patch.object(self.app_module, 'SUBSCRIPTION_STORE', self.store):
+            response = self.client.get(f'/api/ical/{subscription.id}')
+            missing = self.client.get('/api/ical/0000000000000000')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.data.decode('utf-8')
+        self.assertIn('evt-1', body)
+        self.assertNotIn('evt-2', body)
+        self.assertEqual(missing.status_code, 404)
+
+    def test_multi_feed_subscription(self):
+        """Test iscrizione a più calendari: ID canonico e schema precedente migrato"""
+        import sqlite3
+        from subscription_store import SubscriptionStore
+        other_url = "https://example.com/other.ics"
+        first = self.store.create_feeds([(other_url, ['B']), (self.url, ['A'])])
+        second = self.store.create_feeds([(self.url, ['A']), (other_url, ['B', 'B'])])
+
+        self.assertEqual(first.id, second.id)
+        self.assertEqual([feed.url for feed in first.feeds], [self.url, other_url])
+        reloaded = SubscriptionStore(self.db_path).get(first.id)
+        self.assertEqual([(f.url, f.selection) for f in reloaded.feeds],
+                         [(self.url, ('A',)), (other_url, ('B',))])
+
+        legacy_path = os.path.join(self.tmpdir.name, 'legacy.sqlite3')
+        with sqlite3.connect(legacy_path) as conn:
+            conn.execute('CREATE TABLE subscriptions (id TEXT PRIMARY KEY, url TEXT NOT NULL, '
+                         'courses TEXT NOT NULL, created REAL NOT NULL)')
+            conn.execute("INSERT INTO subscriptions VALUES ('legacy', ?, '[\"A\"]', 0)", (self.url,))
+        legacy = SubscriptionStore(legacy_path)
+        self.assertEqual(legacy.get('legacy').feeds[0].selection, ('A',))
+        self.assertEqual(legacy.create_feeds([(self.url, ['A']), (other_url, ['B'])]).id, first.id)
+
+    def test_serve_merged_feeds(self):
+        """Test calendari uniti, scaricati in parallelo e senza UID duplicati"""
+        import threading
+        other_url = "https://example.com/other.ics"
+        other_data = self.CALENDAR_DATA.replace(
+            'UID:evt-2\nSUMMARY:ASD - ALGORITMI E STRUTTURE DATI',
+            'UID:evt-3\nSUMMARY:MATEMATICA DISCRETA')
+        manager = UniversityCalendarManager(self.url)
+        entries = {
+            url: {'data': data, 'hash': manager.calculate_hash(data), 'changed_at': 1704103200.0,
+                  'timestamp': self.app_module.time.time(), 'url': url}
+            for url, data in ((self.url, self.CALENDAR_DATA), (other_url, other_data))
+        }
+        subscription = self.store.create_feeds([
+            (self.url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI']),
+            (other_url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI', 'MATEMATICA DISCRETA'])
+        ])
+        # Entrambi i calendari devono essere richiesti contemporaneamente
+        barrier = threading.Barrier(2, timeout=5)
+
+        def fake_entry(url, cache_key, force_refresh=False, deadline=None):
+            barrier.wait()
+            return entries[url]
+
+        with patch.object(self.app_module, 'SUBSCRIPTION_STORE', self.store), \
+                patch.object(self.app_module, 'get_calendar_entry', side_effect=fake_entry):
+            response = self.client.get(f'/api/ical/{subscription.id}')
+            body = response.data.decode('utf-8')
+            cached = self.client.get(f'/api/ical/{subscription.id}',
+                                     headers={'If-None-Match': response.headers['ETag']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body.count('UID:evt-1'), 1)
+        self.assertIn('UID:evt-3', body)
+        self.assertNotIn('UID:evt-2', body)
+        self.assertEqual(body.count('BEGIN:VCALENDAR'), 1)
+        self.assertEqual(cached.status_code, 304)
+
+    def test_permanent_link_uses_short_id(self):
+        """Test link permanente con ID breve"""
+        session_id = 'subscription-test'
+        cache_key = self.app_module.hashlib.md5(self.url.encode()).hexdigest()
+        self.app_module.CALENDAR_CACHE[cache_key] = {'data': self.CALENDAR_DATA, 'hash': session_id}
+
+        with patch.object(self.app_module, 'SUBSCRIPTION_STORE', self.store):
+            response = self.client.post('/api/create_permanent_link', json={
+                'session_id': session_id,
+                'calendar_url': self.url,
+                'selected_courses': ['B', 'A']
+            })
+
+        data = json.loads(response.data)
+        subscription_id = feeds_subscription_id([(self.url, ['A', 'B'])])
+        self.assertIsNotNone(self.store.get(subscription_id))
+        self.assertTrue(data['ical_url'].endswith(f'/api/ical/{subscription_id}'))
+        self.assertTrue(data['webcal_url'].startswith('webcal://'))
+
+    def test_permanent_link_without_store_is_self_contained(self):
+        """Test link con configurazione codificata se le iscrizioni non sono persistenti"""
+        from urllib.parse import urlsplit
+        manager = UniversityCalendarManager(self.url)
+        session_id = manager.calculate_hash(self.CALENDAR_DATA)
+        cache_key = self.app_module.hashlib.md5(self.url.encode()).hexdigest()
+        self.app_module.CALENDAR_CACHE[cache_key] = {
+            'data': self.CALENDAR_DATA, 'hash': session_id, 'changed_at': 1704103200.0,
+            'timestamp': self.app_module.time.time(), 'url': self.url
+        }
+
+        with patch.object(self.app_module, 'SUBSCRIPTION_STORE', None):
+            response = self.client.post('/api/create_permanent_link', json={
+                'session_id': session_id,
+                'calendar_url': self.url,
+                'selected_courses': ['LFT - LINGUAGGI FORMALI E TRADUTTORI']
+            })
+            ical_url = json.loads(response.data)['ical_url']
+            link = urlsplit(ical_url)
+            served = self.client.get(f'{link.path}?{link.query}')
+            missing = self.client.get('/api/ical/0000000000000000')
+
+        self.assertIn('/api/ical?cfg=', ical_url)
+        self.assertEqual(served.status_code, 200)
+        self.assertIn(b'evt-1', served.data)
+        self.assertEqual(missing.status_code, 404)
+
+
+class TestSessionFileStore(unittest.TestCase):
+    """Test per i file temporanei delle sessioni"""
+
+    def setUp(self):
+        """Setup per ogni test"""
+        from session_store import SessionFileStore
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = SessionFileStore(self.tmpdir.name, max_bytes=10, max_entries=2, ttl=60)
+
+    def tearDown(self):
+        """Pulizia dopo ogni test"""
+        self.tmpdir.cleanup()
+
+    def _set_access(self, name, timestamp):
+        """Simula l'ultimo accesso a un file"""
+        os.utime(self.store.path(name), (timestamp, timestamp))
+        self.store._entries[name] = (self.store._entries[name][0], timestamp)
+
+    def _set_access_time(self, name, offset):
+        """Simula l'ultimo accesso a un file scritto da un altro processo (secondi da ora)"""
+        import time
+        timestamp = time.time() + offset
+        os.utime(self.store.path(name), (timestamp, timestamp))
+
+    def test_lru_eviction_by_entries_and_bytes(self):
+        """Test eliminazione dei file usati meno di recente oltre i limiti"""
+        self.store.write_chunks('a_filtered.ics', [b'aaa'])
+        self.store.write_chunks('b_filtered.ics', [b'bbb'])
+        self._set_access('a_filtered.ics', self.store._entries['b_filtered.ics'][1] - 1)
+        self.assertIsNotNone(self.store.get_path('a_filtered.ics'))
+        self.store.write_chunks('c_filtered.ics', [b'ccc'])
+
+        self.assertIsNone(self.store.get_path('b_filtered.ics'))
+        self.assertFalse(os.path.exists(self.store.path('b_filtered.ics')))
+        self.store.write_chunks('d_filtered.ics', [b'dddd', b'dddd'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['d_filtered.ics'])
+        self.assertEqual(self.store.stats()['evictions'], 3)
+        self.assertEqual(self.store.stats()['bytes'], 8)
+
+    def test_limits_shared_between_processes(self):
+        """Test limiti applicati anche ai file scritti da un altro processo"""
+        from session_store import SessionFileStore
+        other = SessionFileStore(self.tmpdir.name, max_bytes=10, max_entries=2, ttl=60)
+        other.write_chunks('a_filtered.ics', [b'aaaa'])
+        self._set_access_time('a_filtered.ics', -10)
+        other.write_chunks('b_filtered.ics', [b'bbbb'])
+        self._set_access_time('b_filtered.ics', -5)
+
+        self.store.write_chunks('c_filtered.ics', [b'cccc'])
+
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), ['b_filtered.ics', 'c_filtered.ics'])
+        self.assertEqual(self.store.stats()['bytes'], 8)
+
+    def test_ttl_expiry_and_sweep(self):
+        """Test file scaduti eliminati, anche se scritti da un altro processo"""
+        self.store.write_chunks('old_filtered.ics', [b'old'])
+        self._set_access('old_filtered.ics', self.store._entries['old_filtered.ics'][1] - 120)
+        self.assertIsNone(self.store.get_path('old_filtered.ics'))
+
+        with open(self.store.path('other_filtered.ics'), 'w') as f:
+            f.write('x')
+        self.assertIsNotNone(self.store.get_path('other_filtered.ics'))
+        self.assertEqual(self.store.sweep(now=self.store._entries['other_filtered.ics'][1] + 61), 1)
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+        self.assertEqual(self.store.stats()['expired'], 2)
+
+    def test_path_stays_in_directory(self):
+        """Test nomi di file senza sottocartelle"""
+        self.assertEqual(self.store.path('../../etc/passwd'),
+                         os.path.join(self.tmpdir.name, 'passwd'))
+
+
+class TestBenchmarks(unittest.TestCase):
+    """Test per il generatore di calendari sintetici e la suite di benchmark"""
+
+    def test_synthetic_calendar(self):
+        """Test calendario sintetico realistico e riproducibile"""
+        from benchmarks.synthetic_ics import course_names, generate_calendar
+        data = generate_calendar(events=120, courses=30, seed=7)
+        manager = UniversityCalendarManager("https://example.com/benchmark.ics")
+
+        self.assertEqual(data, generate_calendar(events=120, courses=30, seed=7))
+        self.assertEqual(data.count('BEGIN:VEVENT'), 120)
+        self.assertTrue(all(len(line.encode('utf-8')) <= 75 for line in data.split('\r\n')))
+        self.assertIn('\r\n ', data)
+        courses = manager.extract_courses(manager.parse_calendar(data))
+        self.assertEqual(sorted(courses), sorted(course_names(30, seed=7)))
+
+    def test_run_benchmarks(self):
+        """Test risultati per ogni fase, in forma serializzabile"""
+        from benchmarks.bench_calendar import run_benchmarks
+        results = run_benchmarks(events=40, courses=10, selected=2, repeat=1)
+
+        stages = {result['stage'] for result in results}
+        self.assertTrue({'parse_calendar', 'extract_courses', 'extract_course_name',
+                         'create_filtered_calendar', 'to_ical'} <= stages)
+        for result in results:
+            self.assertGreater(result['best_s'], 0)
+            self.assertGreaterEqual(result['peak_bytes'], 0)
+        json.dumps(results)
+
+    def test_stub_upstream(self):
+        """Test server simulato: ETag, 304 e nuove versioni"""
+        import requests
+        from benchmarks.load_test import StubUpstream
+        stub = StubUpstream(feeds=1, events=20, courses=5, latency=0, change_every=3600).start()
+        try:
+            first = requests.get(stub.feed_url(0), timeout=5)
+            revalidated = requests.get(stub.feed_url(0), timeout=5,
+                                       headers={'If-None-Match': first.headers['ETag']})
+            self.assertEqual(first.status_code, 200)
+            self.assertEqual(first.text.count('BEGIN:VEVENT'), 20)
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertNotEqual(stub.body(0, 0), stub.body(0, 1))
+            self.assertEqual(stub.stats()['not_modified'], 1)
+        finally:
+            stub.stop()
+
+    def test_load_test_report(self):
+        """Test breve esecuzione contro l'app Flask con latenze e cache nel report"""
+        import contextlib
+        import io
+        import random
+        from benchmarks.load_test import (FlaskTarget, LoadClient, StubUpstream,
+                                          build_subscribers, hit_ratios)
+        stub = StubUpstream(feeds=1, events=30, courses=6, latency=0, seed=3).start()
+        import app as app_module
+        upload_folder = app_module.UPLOAD_FOLDER
+        files_before = set(os.listdir(upload_folder))
+        target = FlaskTarget()
+        session_dir = app_module.SESSION_STORE.directory
+        try:
+            subscribers = build_subscribers(stub, 3, 1, 2, 1.1, random.Random(0))
+            client = LoadClient(target, subscribers, 1.0, 'gzip', 30)
+            before = target.cache_stats()
+            with contextlib.redirect_stdout(io.StringIO()):
+                duration = client.run(12, 3, 0.25, 0)
+            ratios = hit_ratios(before, target.cache_stats())
+        finally:
+            target.stop()
+            stub.stop()
+
+        report = client.report(duration)
+        self.assertEqual(sum(stats['errors'] for stats in report['endpoints'].values()), 0)
+        self.assertIn('ical', report['endpoints'])
+        self.assertLessEqual(report['endpoints']['ical']['p50_ms'],
+                             report['endpoints']['ical']['p99_ms'])
+        self.assertEqual(stub.stats()['full'], 1)
+        self.assertGreater(ratios['rendered'], 0)
+        # I file generati durante la prova restano fuori dalla cartella delle sessioni
+        self.assertNotEqual(session_dir, upload_folder)
+        self.assertFalse(os.path.exists(session_dir))
+        self.assertEqual(app_module.UPLOAD_FOLDER, upload_folder)
+        self.assertEqual(set(os.listdir(upload_folder)), files_before)
+
+
+class TestMetrics(unittest.TestCase):
+    """Test per le metriche in formato Prometheus"""
+
+    def test_histogram_and_counter_format(self):
+        """Test intervalli cumulativi, somma, conteggio ed escape delle etichette"""
+        from metrics import MetricsRegistry
+        registry = MetricsRegistry()
+        histogram = registry.histogram('stage_seconds', 'Durata', labels=('stage',),
+                                       buckets=(0.1, 1.0))
+        counter = registry.counter('responses_total', 'Risposte', labels=('status',))
+        histogram.observe(0.05, stage='parse')
+        histogram.observe(0.5, stage='parse')
+        histogram.observe(5, stage='parse')
+        counter.inc(status='200')
+        counter.inc(2, status='a"b')
+        registry.register_collector(lambda: [('entries', 'gauge', 'Voci', [({'cache': 'x'}, 3)])])
+
+        text = registry.render()
+        self.assertIn('# TYPE stage_seconds histogram', text)
+        self.assertIn('stage_seconds_bucket{stage="parse",le="0.1"} 1', text)
+        self.assertIn('stage_seconds_bucket{stage="parse",le="1"} 2', text)
+        self.assertIn('stage_seconds_bucket{stage="parse",le="+Inf"} 3', text)
+        self.assertIn('stage_seconds_sum{stage="parse"} 5.55', text)
+        self.assertIn('stage_seconds_count{stage="parse"} 3', text)
+        self.assertIn('responses_total{status="200"} 1', text)
+        self.assertIn('responses_total{status="a\\"b"} 2', text)
+        self.assertIn('entries{cache="x"} 3', text)
+        self.assertEqual(histogram.count(stage='parse'), 3)
+
+    def test_metrics_route(self):
+        """Test fasi e contatori delle cache esportati da /metrics"""
+        import app as app_module
+        from metrics import STAGE_SECONDS
+        manager = UniversityCalendarManager("https://example.com/calendar.ics")
+        parsed_before = STAGE_SECONDS.count(stage='parse')
+        index_before = STAGE_SECONDS.count(stage='index')
+        app_module.PARSED_CACHE.clear()
+        try:
+            app_module.get_parsed_calendar(manager, CalendarAppTestCase.CALENDAR_DATA)
+            app_module.get_parsed_calendar(manager, CalendarAppTestCase.CALENDAR_DATA)
+        finally:
+            app_module.PARSED_CACHE.clear()
+
+        response = app_module.app.test_client().get('/metrics')
+        text = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertEqual(STAGE_SECONDS.count(stage='parse'), parsed_before + 1)
+        self.assertEqual(STAGE_SECONDS.count(stage='index'), index_before + 1)
+        self.assertIn('calendar_stage_seconds_count{stage="parse"}', text)
+        self.assertIn('calendar_cache_requests_total{cache="parsed",result="hit"}', text)
+        self.assertIn('calendar_cache_entries{cache="rendered"}', text)
+
+    @patch('calendar_manager.get_http_session')
+    def test_upstream_counters(self, mock_session):
+        """Test codici di stato e byte delle risposte del calendario originale"""
+        from metrics import UPSTREAM_BYTES, UPSTREAM_RESPONSES
+        UniversityCalendarManager._upstream_state.clear()
+        body = "BEGIN:VCALENDAR\nEND:VCALENDAR"
+        mock_session.return_value.get.return_value = upstream_response(body=body)
+        responses_before = UPSTREAM_RESPONSES.value(status='200')
+        bytes_before = UPSTREAM_BYTES.value()
+
+        UniversityCalendarManager("https://example.com/metrics.ics").download_calendar()
+
+        self.assertEqual(UPSTREAM_RESPONSES.value(status='200'), responses_before + 1)
+        self.assertEqual(UPSTREAM_BYTES.value(), bytes_before + len(body))
+
+
+class TestRequestProfiler(CalendarAppTestCase):
+    """Test per la profilazione su richiesta delle richieste lente"""
+
+    def setUp(self):
+        """Setup per ogni test"""
+        super().setUp()
+        self.profile_dir = tempfile.mkdtemp()
+        profiler = self.app_module.PROFILER
+        self.patches = [
+            patch.object(profiler, 'enabled', True),
+            patch.object(profiler, 'directory', self.profile_dir),
+            patch.object(profiler, 'threshold', 0),
+            patch.object(profiler, 'token', None),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Pulizia dopo ogni test"""
+        import shutil
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        super().tearDown()
+
+    def _profiles(self):
+        return sorted(name for name in os.listdir(self.profile_dir) if name.endswith('.prof'))
+
+    def test_flagged_request_is_profiled(self):
+        """Test profilo e metadati salvati per una richiesta con il flag (risposta a blocchi)"""
+        import pstats
+        path = self._ical_path(self._cache_calendar(), ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+
+        response = self.client.get(path, headers={'X-Profile': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'LFT', response.data)
+
+        profiles = self._profiles()
+        self.assertEqual(len(profiles), 1)
+        self.assertIn('serve_ical', profiles[0])
+        stats = pstats.Stats(os.path.join(self.profile_dir, profiles[0]))
+        self.assertTrue(any('iter_filtered_calendar' in func[2] for func in stats.stats))
+        with open(os.path.join(self.profile_dir, profiles[0][:-5] + '.json')) as f:
+            info = json.load(f)
+        self.assertEqual(info['selection_size'], 1)
+        self.assertEqual(info['upstream_bytes'], len(self.CALENDAR_DATA))
+
+    def test_requests_without_flag_or_when_disabled(self):
+        """Test nessun profilo senza flag o con la profilazione disattivata"""
+        path = self._ical_path(self._cache_calendar(), ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        self.client.get(path)
+        with patch.object(self.app_module.PROFILER, 'enabled', False):
+            self.client.get(path, headers={'X-Profile': '1'})
+        with patch.object(self.app_module.PROFILER, 'token', 'segreto'):
+            self.client.get(path, headers={'X-Profile': '1'})
+
+        self.assertEqual(self._profiles(), [])
+
+    def test_threshold_and_rotation(self):
+        """Test soglia di latenza e limite al numero di profili conservati"""
+        path = self._ical_path(self._cache_calendar(), ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        with patch.object(self.app_module.PROFILER, 'threshold', 60):
+            self.client.get(path + '&profile=1')
+        self.assertEqual(self._profiles(), [])
+
+        with patch.object(self.app_module.PROFILER, 'max_files', 2):
+            for _ in range(3):
+                self.client.get(path + '&profile=1')
+        self.assertEqual(len(self._profiles()), 2)
+        self.assertEqual(len(os.listdir(self.profile_dir)), 4)
+
+
+class TestTracing(CalendarAppTestCase):
+    """Test per le tracce delle richieste e i log JSON"""
+
+    def setUp(self):
+        """Setup per ogni test"""
+        super().setUp()
+        self.logger = Mock()
+        self.logger.isEnabledFor.return_value = True
+        self.patches = [
+            patch('tracing.get_logger', return_value=self.logger),
+            patch('tracing.TRACE_SAMPLE_RATE', 1.0),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Pulizia dopo ogni test"""
+        for p in self.patches:
+            p.stop()
+        super().tearDown()
+
+    def _traces(self):
+        return [call.kwargs['extra']['fields'] for call in self.logger.log.call_args_list
+                if call.kwargs['extra']['fields'].get('type') == 'trace']
+
+    def test_json_formatter(self):
+        """Test una riga JSON con messaggio e campi strutturati"""
+        import logging
+        from tracing import JsonFormatter
+        record = logging.LogRecord('calendario', logging.WARNING, __file__, 1, 'Errore %s', ('x',), None)
+        record.fields = {'trace_id': 'abc', 'bytes': 10}
+
+        payload = json.loads(JsonFormatter().format(record))
+        self.assertEqual(payload['message'], 'Errore x')
+        self.assertEqual(payload['level'], 'warning')
+        self.assertEqual(payload['trace_id'], 'abc')
+        self.assertEqual(payload['bytes'], 10)
+
+    def test_ical_request_trace(self):
+        """Test traccia di /api/ical con ID della richiesta, fasi e attributi"""
+        path = self._ical_path(self._cache_calendar(), ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+
+        response = self.client.get(path, headers={'X-Request-ID': 'req-123'})
+        response.get_data()
+        response.close()
+
+        self.assertEqual(response.headers['X-Request-ID'], 'req-123')
+        traces = self._traces()
+        self.assertEqual(len(traces), 1)
+        trace = traces[0]
+        self.assertEqual(trace['trace_id'], 'req-123')
+        self.assertEqual(trace['route'], '/api/ical')
+        self.assertEqual(trace['status'], 200)
+        self.assertEqual(trace['selection_size'], 1)
+        spans = {span['name']: span for span in trace['spans']}
+        self.assertEqual(spans['cache_lookup']['result'], 'miss')
+        self.assertIn('parse', spans)
+        self.assertEqual(spans['filter']['events'], 1)
+
+    def test_unsampled_traces_are_not_written(self):
+        """Test tracce non campionate scritte solo se lente o con errori"""
+        from tracing import request_trace
+        with patch('tracing.TRACE_SAMPLE_RATE', 0.0):
+            with request_trace('veloce'):
+                pass
+            with self.assertRaises(ValueError):
+                with request_trace('errore'):
+                    raise ValueError('boom')
+
+        traces = self._traces()
+        self.assertEqual([trace['error'] for trace in traces], ['ValueError: boom'])
+
+    def test_shed_traces_follow_sampling(self):
+        """Test 503 per sovraccarico scritti solo se campionati, senza livello di errore"""
+        import logging
+        from resilience import AdmissionLimiter
+        path = self._ical_path(self._cache_calendar(), ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        limiter = AdmissionLimiter(max_concurrent=0, max_queue=0)
+
+        def fetch():
+            response = self.client.get(path)
+            response.close()
+            return response.status_code
+
+        with patch.object(self.app_module, 'RENDER_LIMITER', limiter):
+            with patch('tracing.TRACE_SAMPLE_RATE', 0.0):
+                self.assertEqual(fetch(), 503)
+            self.assertEqual(self._traces(), [])
+            self.assertEqual(fetch(), 503)
+
+        traces = self._traces()
+        self.assertEqual([(trace['status'], trace['shed']) for trace in traces], [(503, True)])
+        self.assertEqual(self.logger.log.call_args.args[0], logging.INFO)
+
+    def test_log_event_carries_trace_id(self):
+        """Test ID della traccia corrente nei messaggi di log"""
+        from tracing import log_event, request_trace
+        with request_trace('richiesta', trace_id='t-1'):
+            log_event("Messaggio", bytes=3)
+
+        fields = self.logger.log.call_args_list[0].kwargs['extra']['fields']
+        self.assertEqual(fields, {'bytes': 3, 'trace_id': 't-1'})
+
+
+class TestUpstreamFailures(CalendarAppTestCase):
+    """Test per l'interruttore del server remoto e le copie non aggiornate"""
+
+    def _expire(self, url):
+        """Rende la copia in cache più vecchia della finestra stale-while-revalidate"""
+        entry = self.app_module.CALENDAR_CACHE[self.app_module.hashlib.md5(url.encode()).hexdigest()]
+        entry['timestamp'] -= self.app_module.CACHE_DURATION + self.app_module.STALE_DURATION + 1
+        return entry
+
+    def test_circuit_breaker_states(self):
+        """Test apertura, richiesta di prova e chiusura dell'interruttore"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+        breaker.reset_timeout = 0
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())  # una sola richiesta di prova
+        breaker.record_failure()
+        self.assertEqual(breaker.trips, 2)
+
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertEqual(breaker.stats()['rejected'], 2)
+
+    @patch.object(UniversityCalendarManager, 'download_calendar', return_value=None)
+    def test_serve_stale_on_upstream_error(self, mock_download):
+        """Test ultima copia valida servita (e segnalata) se il download fallisce"""
+        url = self._cache_calendar()
+        self._expire(url)
+
+        response = self.client.get(self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI']))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'LINGUAGGI FORMALI', response.data)
+        self.assertEqual(response.headers['X-Calendar-Stale'], 'upstream-error')
+        self.assertIn('110', response.headers['Warning'])
+        self.assertEqual(response.headers['Cache-Control'],
+                         f'public, max-age={self.app_module.STALE_MAX_AGE}')
+        mock_download.assert_called_once()
+        deadline = mock_download.call_args.args[0]
+        self.assertLessEqual(deadline - self.app_module.time.monotonic(),
+                             self.app_module.REQUEST_DEADLINE)
+
+    @patch.object(UniversityCalendarManager, 'download_calendar', return_value=None)
+    def test_upstream_error_without_cache(self, mock_download):
+        """Test 502 se il download fallisce senza copie in cache"""
+        path = self._ical_path('https://example.com/other.ics', ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+
+        self.assertEqual(self.client.get(path).status_code, 502)
+
+    def test_fresh_response_not_marked_stale(self):
+        """Test nessuna segnalazione per copie recenti"""
+        url = self._cache_calendar()
+
+        response = self.client.get(self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI']))
+
+        self.assertNotIn('X-Calendar-Stale', response.headers)
+        self.assertIn('max-age=86400', response.headers['Cache-Control'])
+
+    def test_revalidating_response_marked_stale(self):
+        """Test segnalazione delle copie servite durante l'aggiornamento in background"""
+        url = self._cache_calendar()
+        entry = self._expire(url)
+        entry['timestamp'] += self.app_module.STALE_DURATION
+
+        with patch.object(self.app_module, 'schedule_refresh') as mock_refresh:
+            response = self.client.get(self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI']))
+
+        mock_refresh.assert_called_once()
+        self.assertEqual(response.headers['X-Calendar-Stale'], 'revalidating')
+        self.assertGreaterEqual(int(response.headers['Age']), self.app_module.CACHE_DURATION)
+
+
+class TestRenderAdmission(CalendarAppTestCase):
+    """Test per il controllo di ammissione delle elaborazioni costose"""
+
+    def setUp(self):
+        """Setup per ogni test"""
+        super().setUp()
+        from resilience import AdmissionLimiter
+        self.limiter = AdmissionLimiter(max_concurrent=1, max_queue=0)
+        self.patch = patch.object(self.app_module, 'RENDER_LIMITER', self.limiter)
+        self.patch.start()
+
+    def tearDown(self):
+        """Pulizia dopo ogni test"""
+        self.patch.stop()
+        super().tearDown()
+
+    def test_limiter_queue_and_shed(self):
+        """Test attesa in coda, rifiuto a coda piena e scadenza dell'attesa"""
+        import threading
+        from resilience import AdmissionLimiter
+        limiter = AdmissionLimiter(max_concurrent=1, max_queue=1, queue_timeout=5)
+        self.assertTrue(limiter.acquire())
+
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+        waiter.start()
+        while limiter.stats()['waiting'] < 1:
+            waiter.join(0.01)
+        self.assertFalse(limiter.acquire())  # coda piena
+        limiter.release()
+        waiter.join(5)
+        self.assertEqual(results, [True])
+
+        limiter.queue_timeout = 0.01
+        self.assertFalse(limiter.acquire())  # posto ancora occupato dal thread
+        stats = limiter.stats()
+        self.assertEqual((stats['active'], stats['waiting']), (1, 0))
+        self.assertEqual((stats['admitted'], stats['queued'], stats['shed'], stats['timed_out']),
+                         (2, 2, 1, 1))
+
+    def test_slot_released_before_sending(self):
+        """Test posto liberato a fine generazione, prima dell'invio al client"""
+        path = self._ical_path(self._cache_calendar(), ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+
+        response = self.client.get(path, buffered=False)
+
+        self.assertEqual(self.limiter.stats()['active'], 0)
+        self.assertEqual(self.limiter.admitted, 2)  # parsing, poi serializzazione
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'LINGUAGGI FORMALI', response.data)
+        response.close()
+
+    def test_concurrent_cold_requests_share_one_slot(self):
+        """Test richieste concorrenti a freddo per lo stesso link: un posto alla volta, tutte servite"""
+        import threading
+        import time
+        path = self._ical_path("https://example.com/calendar.ics",
+                               ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        parse_calendar = self.manager.parse_calendar
+
+        def slow_download(manager, deadline=None):
+            time.sleep(0.1)
+            manager.last_download = {'hash': manager.calculate_hash(self.CALENDAR_DATA),
+                                     'etag': None, 'last_modified': None, 'not_modified': False}
+            return self.CALENDAR_DATA
+
+        def slow_parse(data):
+            time.sleep(0.1)
+            return parse_calendar(data)
+
+        statuses = []
+
+        def fetch():
+            response = self.app_module.app.test_client().get(path)
+            statuses.append(response.status_code)
+
+        with patch.object(UniversityCalendarManager, 'download_calendar', slow_download), \
+             patch.object(UniversityCalendarManager, 'parse_calendar', side_effect=slow_parse) as mock_parse:
+            threads = [threading.Thread(target=fetch) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+
+        self.assertEqual(statuses, [200] * len(threads))
+        self.assertEqual(mock_parse.call_count, 1)
+        # Un posto per il parsing e uno per la serializzazione, mai insieme
+        self.assertEqual((self.limiter.admitted, self.limiter.shed), (2, 0))
+
+    def test_overload_sheds_only_renders(self):
+        """Test 503 con Retry-After per le cache mancate; cache, 304 e /health non limitati"""
+        url = self._cache_calendar()
+        cached_path = self._ical_path(url, ['LFT - LINGUAGGI FORMALI E TRADUTTORI'])
+        first = self.client.get(cached_path)
+        first.get_data()
+        first.close()
+
+        self.assertTrue(self.limiter.acquire())  # elaborazione in corso
+        try:
+            shed = self.client.get(self._ical_path(url, ['ASD - ALGORITMI E STRUTTURE DATI']))
+            hit = self.client.get(cached_path)
+            not_modified = self.client.get(cached_path, headers={'If-None-Match': first.headers['ETag']})
+            health = self.client.get('/health')
+        finally:
+            self.limiter.release()
+
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(shed.headers['Retry-After'], str(self.app_module.RENDER_RETRY_AFTER))
+        self.assertEqual(hit.status_code, 200)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(health.status_code, 200)
+        self.assertEqual(health.get_json()['render_admission']['shed'], 1)
+        self.assertIn('calendar_render_admissions_total{result="shed"} 1',
+                      self.client.get('/metrics').get_data(as_text=True))
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test per il raggruppamento delle chiamate concorrenti"""
+
+    def _run_concurrently(self, flight, fn, callers=5):
+        """Avvia più thread che chiamano flight.do sulla stessa chiave"""
+        import threading
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(flight.do('key', fn)))
+            for _ in range(callers)
+        ]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_concurrent_calls_are_coalesced(self):
+        """Test esecuzione unica per chiamate concorrenti"""
+        import threading
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def slow_download():
+            calls.append(1)
+            release.wait(5)
+            return 'calendar'
+
+        threads, results = self._run_concurrently(flight, slow_download)
+        while flight.executed + flight.coalesced < len(threads):
+            release.wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['calendar'] * len(threads))
+        self.assertEqual(flight.stats(), {'executed': 1, 'coalesced': len(threads) - 1, 'timed_out': 0})
+
+    def test_follower_wait_is_bounded(self):
+        """Test attesa limitata dalla scadenza di chi si accoda a una chiamata in corso"""
+        import threading
+        import time
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_download():
+            started.set()
+            release.wait(5)
+            return 'calendar'
+
+        leader = threading.Thread(target=lambda: flight.do('key', slow_download))
+        leader.start()
+        started.wait(5)
+        try:
+            with self.assertRaises(TimeoutError):
+                flight.do('key', slow_download, wait_until=time.monotonic() + 0.05)
+        finally:
+            release.set()
+            leader.join(5)
+        self.assertEqual(flight.stats()['timed_out'], 1)
+
+    def test_error_is_shared_and_key_released(self):
+        """Test propagazione errori e riutilizzo della chiave"""
+        flight = SingleFlight()
+
+        def failing():
+            raise ValueError('upstream down')
+
+        with self.assertRaises(ValueError):
+            flight.do('key', failing)
+        self.assertEqual(flight.do('key', lambda: 'ok'), 'ok')
+        self.assertEqual(flight.executed, 2)
+
+
 if __name__ == '__main__':
     # Crea directory di test se necessario
     if not os.path.exists('temp_calendars'):
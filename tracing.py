@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Tracciamento delle richieste e log strutturati in JSON
+Ogni richiesta (o esecuzione di auto_update) ha un ID e raccoglie gli
+intervalli delle sue fasi (ricerca in cache, download, parsing, filtraggio,
+serializzazione) con i loro attributi. Le tracce campionate, lente o con
+errori e i messaggi di log vengono scritti come righe JSON da un thread
+dedicato (QueueHandler/QueueListener), senza I/O sul percorso della richiesta.
+
+Configurazione:
+    LOG_LEVEL: Livello minimo dei messaggi (default INFO)
+    TRACE_SAMPLE_RATE: Frazione delle tracce scritte (default 0.1)
+    TRACE_SLOW_MS: Tracce più lente di questa soglia sempre scritte (default 1000)
+"""
+
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from typing import Callable, Optional
+
+from metrics import observe_stage
+
+LOGGER_NAME = 'calendario'
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.1))
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', 1000))
+
+_current_trace = contextvars.ContextVar('calendar_trace', default=None)
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per record: ora, livello, messaggio e campi strutturati"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': round(record.created, 6),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        payload.update(getattr(record, 'fields', None) or {})
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def get_logger() -> logging.Logger:
+    """
+    Logger condiviso, configurato al primo utilizzo
+
+    I record vengono accodati (QueueHandler) e formattati e scritti su stderr
+    dal thread del QueueListener.
+    """
+    global _listener
+    logger = logging.getLogger(LOGGER_NAME)
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                log_queue = queue.SimpleQueue()
+                stream_handler = logging.StreamHandler(sys.stderr)
+                stream_handler.setFormatter(JsonFormatter())
+                listener = logging.handlers.QueueListener(log_queue, stream_handler)
+                listener.start()
+                atexit.register(listener.stop)
+                logger.addHandler(logging.handlers.QueueHandler(log_queue))
+                logger.setLevel(LOG_LEVEL)
+                logger.propagate = False
+                _listener = listener
+    return logger
+
+
+def log_event(message: str, level: int = logging.INFO, **fields):
+    """
+    Scrive un messaggio strutturato, con l'ID della traccia corrente se presente
+
+    Args:
+        message: Messaggio leggibile
+        level: Livello del messaggio (logging.INFO, logging.WARNING, ...)
+        **fields: Campi aggiuntivi del record JSON
+    """
+    logger = get_logger()
+    if not logger.isEnabledFor(level):
+        return
+    trace = _current_trace.get()
+    if trace is not None:
+        fields.setdefault('trace_id', trace.id)
+    logger.log(level, message, extra={'fields': fields})
+
+
+class Span:
+    """Intervallo di una fase della traccia, con i suoi attributi"""
+
+    __slots__ = ('name', 'start', 'duration', 'attributes')
+
+    def __init__(self, name: str, start: float, attributes: dict):
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """Aggiunge attributi all'intervallo"""
+        self.attributes.update(attributes)
+
+    def to_dict(self, trace_start: float) -> dict:
+        return dict(self.attributes, name=self.name,
+                    start_ms=round((self.start - trace_start) * 1000, 3),
+                    duration_ms=round((self.duration or 0) * 1000, 3))
+
+
+class Trace:
+    """
+    Traccia di una richiesta
+
+    Gli intervalli vengono sempre raccolti (costo trascurabile); la traccia
+    viene scritta se campionata, se supera TRACE_SLOW_MS o se termina con un errore;
+    le richieste rifiutate per sovraccarico (attributo shed) solo se campionate.
+    """
+
+    def __init__(self, name: str, trace_id: Optional[str] = None,
+                 sampled: Optional[bool] = None, **attributes):
+        self.name = name
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.sampled = random.random() < TRACE_SAMPLE_RATE if sampled is None else sampled
+        self.attributes = attributes
+        self.spans = []
+        self.error = None
+        self.finished = False
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        """Aggiunge attributi alla traccia"""
+        self.attributes.update(attributes)
+
+    def add_span(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self, error: Optional[BaseException] = None):
+        """Chiude la traccia e la scrive se campionata, lenta o con errore (una volta sola)"""
+        with self._lock:
+            if self.finished:
+                return
+            self.finished = True
+            spans = list(self.spans)
+        if error is not None:
+            self.error = f'{type(error).__name__}: {error}'
+
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        if self.attributes.get('shed') and not self.error:
+            # Richiesta rifiutata per sovraccarico (503 voluto, già contato nelle metriche):
+            # solo campionamento, per non riempire il log proprio quando il processo è saturo
+            failed = False
+            if not self.sampled:
+                return
+        else:
+            failed = self.error or self.attributes.get('status', 0) >= 500
+            if not (self.sampled or failed or duration_ms >= TRACE_SLOW_MS):
+                return
+        fields = dict(self.attributes, trace_id=self.id, type='trace',
+                      started_at=self.started_at, duration_ms=round(duration_ms, 3),
+                      spans=[span.to_dict(self._start) for span in spans])
+        if self.error:
+            fields['error'] = self.error
+        get_logger().log(logging.ERROR if failed else logging.INFO, self.name,
+                         extra={'fields': fields})
+
+
+def current_trace() -> Optional[Trace]:
+    """Traccia della richiesta corrente, o None"""
+    return _current_trace.get()
+
+
+def start_trace(name: str, trace_id: Optional[str] = None, sampled: Optional[bool] = None,
+                **attributes) -> Trace:
+    """Avvia una traccia e la rende corrente (va chiusa con end_trace)"""
+    trace = Trace(name, trace_id, sampled, **attributes)
+    _current_trace.set(trace)
+    return trace
+
+
+def end_trace(trace: Trace, error: Optional[BaseException] = None, **attributes):
+    """Chiude la traccia e, se è quella corrente, la rimuove"""
+    trace.set(**attributes)
+    trace.finish(error)
+    if _current_trace.get() is trace:
+        _current_trace.set(None)
+
+
+@contextmanager
+def request_trace(name: str, trace_id: Optional[str] = None, **attributes):
+    """Traccia del blocco with (gestori serverless, auto_update)"""
+    previous = _current_trace.get()
+    trace = start_trace(name, trace_id, **attributes)
+    try:
+        yield trace
+    except BaseException as e:
+        end_trace(trace, e)
+        raise
+    else:
+        end_trace(trace)
+    finally:
+        _current_trace.set(previous)
+
+
+class _NoopSpan:
+    """Intervallo senza traccia corrente: gli attributi vengono ignorati"""
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Registra il blocco with come intervallo della traccia corrente"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP_SPAN
+        return
+    current = Span(name, time.perf_counter(), attributes)
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter() - current.start
+        trace.add_span(current)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Fase di elaborazione: intervallo della traccia e istogramma calendar_stage_seconds"""
+    start = time.perf_counter()
+    trace = _current_trace.get()
+    current = Span(name, start, attributes) if trace is not None else _NOOP_SPAN
+    try:
+        yield current
+    finally:
+        duration = time.perf_counter() - start
+        observe_stage(name, duration)
+        if trace is not None:
+            current.duration = duration
+            trace.add_span(current)
+
+
+def record_stage(name: str, seconds: float, **attributes):
+    """Registra una fase già misurata (es. tempo accumulato da un generatore)"""
+    observe_stage(name, seconds)
+    trace = _current_trace.get()
+    if trace is not None:
+        current = Span(name, time.perf_counter() - seconds, attributes)
+        current.duration = seconds
+        trace.add_span(current)
+
+
+def annotate(**attributes):
+    """Aggiunge attributi alla traccia corrente, se presente"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set(**attributes)
+
+
+def bind_trace(fn: Callable) -> Callable:
+    """Esegue fn (es. in un ThreadPoolExecutor) con la traccia corrente del chiamante"""
+    trace = _current_trace.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous = _current_trace.get()
+        _current_trace.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_trace.set(previous)
+
+    return wrapper
+
+
+def traced_handler(route: str):
+    """Decoratore dei metodi do_GET/do_POST dei gestori serverless: una traccia per richiesta"""
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            request_id = (self.headers.get('X-Request-ID') or '')[:64] or None
+            with request_trace(f'{self.command} {route}', request_id,
+                               method=self.command, route=route):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedRequestHandler(BaseHTTPRequestHandler):
+    """Gestore HTTP che registra lo stato della risposta e restituisce l'ID della traccia"""
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.set(status=code)
+            self.send_header('X-Request-ID', trace.id)
+
+    def log_message(self, format, *args):
+        log_event(format % args, logging.DEBUG, client=self.address_string())